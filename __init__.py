@@ -20,8 +20,10 @@
 
 import bpy
 import warnings
+from math import radians, degrees
 from . import import_iff
 from . import export_iff
+from .workers import can_fork
 
 # ExportHelper is a helper class, defines filename and
 # invoke() function which calls the file selector.
@@ -82,6 +84,13 @@ class ImportIFF(Operator, ImportHelper):
     #     default=True
     # )
 
+    lazy_textures = BoolProperty(
+        name="Defer texture loading",
+        description="Use placeholder images for the MATs, and decode them "
+        "later with Image > Load Deferred WCP/SO Textures",
+        default=False
+    )
+
     backend_class_name = "IFFImporter"
 
     def execute(self, context):
@@ -94,7 +103,7 @@ class ImportIFF(Operator, ImportHelper):
 
         importer = getattr(import_iff, self.backend_class_name)(
             self.filepath, self.texname, wc_orientation_matrix,
-            self.import_bsp
+            self.import_bsp, self.lazy_textures
         )
 
         importer.load()
@@ -104,6 +113,76 @@ class ImportIFF(Operator, ImportHelper):
         return {"FINISHED"}
 
 
+class LoadIFFTextures(Operator):
+    """Decode the MATs of textures whose loading was deferred on import"""
+    bl_idname = "image.wcp_load_textures"
+
+    bl_label = "Load Deferred WCP/SO Textures"
+
+    selected_only = BoolProperty(
+        name="Selected objects only",
+        description="Only load the textures used by the selected objects",
+        default=False
+    )
+
+    threads = IntProperty(
+        name="Threads",
+        description="Number of threads to decode MATs with (0 for one per "
+        "CPU)",
+        default=0,
+        min=0,
+        max=64
+    )
+
+    def execute(self, context):
+        bl_images = import_iff.deferred_images(
+            context.selected_objects if self.selected_only else None)
+        if not bl_images:
+            self.report({"INFO"}, "There are no textures to load.")
+            return {"CANCELLED"}
+        self.loader = import_iff.TextureLoader(self.threads)
+        for bl_img in bl_images:
+            self.loader.request(bl_img)
+        self.total = len(bl_images)
+        wm = context.window_manager
+        self.timer = wm.event_timer_add(0.1, context.window)
+        wm.modal_handler_add(self)
+        return {"RUNNING_MODAL"}
+
+    def modal(self, context, event):
+        # The timer and threads are stopped when loading is done, cancelled,
+        # or fails.
+        done = True
+        try:
+            if event.type == "ESC":
+                self.report({"INFO"}, "Stopped loading textures.")
+                return {"CANCELLED"}
+            if event.type != "TIMER":
+                done = False
+                return {"PASS_THROUGH"}
+            # Images can only be changed from the main thread
+            with warnings.catch_warnings(record=True) as wlist:
+                warnings.simplefilter("always")
+                remaining = self.loader.upload()
+            for warning in wlist:
+                self.report({"WARNING"}, str(warning.message))
+            if remaining:
+                done = False
+                return {"PASS_THROUGH"}
+            failed = self.loader.failed
+            self.report({"WARNING"} if failed else {"INFO"},
+                        "Loaded {} textures, {} failed.".format(
+                            self.total - failed, failed))
+            return {"FINISHED"}
+        finally:
+            if done:
+                self.finish(context)
+
+    def finish(self, context):
+        context.window_manager.event_timer_remove(self.timer)
+        self.loader.close()
+
+
 class ExportIFF(Operator, ExportHelper):
     """Export to a WCP/WCSO mesh file"""
     # important since its how bpy.ops.import_test.some_data is constructed
@@ -142,14 +221,18 @@ class ExportIFF(Operator, ExportHelper):
         default=True
     )
 
-    # NOTE: BSP Tree generation is not implemented!
-    # As a fallback measure, I'm hard-coding this attribute for now.
     generate_bsp = BoolProperty(
         name="Generate BSP",
         description="Generate a BSP tree "
         "(for corvette and capship hull/component meshes)",
-        default=False,
-        options={"HIDDEN"}
+        default=False
+    )
+
+    bsp_regions = BoolProperty(
+        name="Generate BSP regions",
+        description="Generate a region blockmap for the BSP tree, so the "
+        "polygons near a point can be found quickly",
+        default=False
     )
 
     axis_forward = EnumProperty(
@@ -200,6 +283,174 @@ class ExportIFF(Operator, ExportHelper):
         default=500.0
     )
 
+    auto_lods = IntProperty(
+        name="Generated LODs",
+        description="Number of LODs to generate by simplifying LOD 0, for "
+        "models that only have a LOD 0. 0 disables LOD generation.",
+        default=0,
+        min=0,
+        max=6
+    )
+
+    auto_lod_ratio = FloatProperty(
+        name="Generated LOD ratio",
+        description="Number of triangles in each generated LOD, relative to "
+        "the LOD before it",
+        default=0.5,
+        min=0.05,
+        max=0.95
+    )
+
+    range_solver = BoolProperty(
+        name="Error-based LOD ranges",
+        description="Calculate the LOD ranges that were not given from how "
+        "far each LOD deviates from LOD 0, instead of using the LOD range "
+        "increment",
+        default=False
+    )
+
+    pixel_tolerance = FloatProperty(
+        name="LOD pixel tolerance",
+        description="How many pixels a LOD may deviate from LOD 0 on screen",
+        min=0.1,
+        max=100.0,
+        default=1.0
+    )
+
+    lod_fov = FloatProperty(
+        name="LOD field of view",
+        description="Vertical field of view used to calculate LOD ranges",
+        subtype="ANGLE",
+        min=radians(1.0),
+        max=radians(179.0),
+        default=radians(60.0)
+    )
+
+    lod_resolution = IntProperty(
+        name="LOD screen height",
+        description="Vertical screen resolution used to calculate LOD ranges",
+        min=1,
+        max=16384,
+        default=768
+    )
+
+    merge_coplanar = BoolProperty(
+        name="Merge coplanar faces",
+        description="Merge adjacent coplanar faces with the same texture "
+        "into convex polygons, so the model has fewer faces",
+        default=False
+    )
+
+    compact_meshes = BoolProperty(
+        name="Compact meshes",
+        description="Remove unused vertices and normals, and weld vertices "
+        "that are closer together than the weld distance",
+        default=False
+    )
+
+    weld_distance = FloatProperty(
+        name="Weld distance",
+        description="Vertices closer together than this are merged",
+        min=0.0,
+        max=1.0,
+        precision=5,
+        default=0.0001
+    )
+
+    reorder_faces = BoolProperty(
+        name="Sort faces by texture",
+        description="Group faces by texture, and sort them by position, so "
+        "the renderer switches textures less often",
+        default=False
+    )
+
+    normal_tolerance = FloatProperty(
+        name="Normal merge angle",
+        description="Vertex normals closer together than this many degrees "
+        "are merged. 0 only merges identical normals.",
+        min=0.0,
+        max=15.0,
+        default=0.0
+    )
+
+    use_cache = BoolProperty(
+        name="Only export changed models",
+        description="Skip models that have not changed since they were last "
+        "exported to the same folder",
+        default=False
+    )
+
+    use_texture_registry = BoolProperty(
+        name="Texture number registry",
+        description="Keep the texture number of each image the same between "
+        "exports, using a registry file in the export folder or one of its "
+        "parent folders",
+        default=False
+    )
+
+    build_textures = BoolProperty(
+        name="Build MATs",
+        description="Convert the texture images to MATs in the 'mat' folder "
+        "next to the export folder. Unchanged textures are not converted "
+        "again.",
+        default=False
+    )
+
+    texture_palette = StringProperty(
+        name="MAT palette",
+        description="The .pal file to convert the texture images with. If "
+        "blank, a palette is built from the texture images.",
+        subtype="FILE_PATH"
+    )
+
+    embed_palette = BoolProperty(
+        name="Embed palette",
+        description="Store the palette colours in each MAT, instead of "
+        "referring to the palette by its filename",
+        default=True
+    )
+
+    use_atlas = BoolProperty(
+        name="Pack textures into atlases",
+        description="Pack the textures of each model into a few texture "
+        "atlases, so it uses fewer textures. Faces with wrapping UVs keep "
+        "their own textures. Requires Build MATs",
+        default=False
+    )
+
+    atlas_size = EnumProperty(
+        name="Atlas size",
+        description="Maximum width and height of a texture atlas",
+        items=(("256", "256", ""),
+               ("512", "512", ""),
+               ("1024", "1024", ""),
+               ("2048", "2048", ""),
+               ),
+        default="1024",
+    )
+
+    lod_textures = IntProperty(
+        name="Downscale textures from LOD",
+        description="LODs from this one on use downscaled copies of the "
+        "textures, halved once more for each LOD (0 to use full size "
+        "textures for all LODs). Requires Build MATs",
+        min=0,
+        max=6,
+        default=0
+    )
+
+    # Worker processes are forked from Blender, so they are not available
+    # on Windows, where everything is done in Blender's own process.
+    workers = IntProperty(
+        name="Worker processes",
+        description="Number of worker processes to use for slow export "
+        "stages, such as generating BSP trees. 0 uses one per CPU.",
+        default=0,
+        min=0,
+        max=64,
+        options=set() if can_fork() else {"HIDDEN"}
+    )
+
     test_run = BoolProperty(
         name="Test run",
         description="Do a test run; don't actually export anything. "
@@ -208,6 +459,14 @@ class ExportIFF(Operator, ExportHelper):
         options={"HIDDEN"}
     )
 
+    sphere_report = BoolProperty(
+        name="Sphere report",
+        description="Compare the bounding sphere of each LOD to the ones "
+        "made by the other methods, and by older versions of the exporter",
+        default=False,
+        options={"HIDDEN"}
+    )
+
     # output_version = EnumProperty(
     #     name="Mesh version",
     #     items=(("8", "Mesh version 8", "Use mesh version 8"),
@@ -243,10 +502,34 @@ class ExportIFF(Operator, ExportHelper):
             self.filepath, self.texnum, self.apply_modifiers,
             self.active_as_lod0, self.use_facetex, wc_orientation_matrix,
             self.include_far_chunk, self.drang_increment, self.generate_bsp,
-            self.test_run
+            self.test_run, self.workers, self.bsp_regions, self.auto_lods,
+            self.auto_lod_ratio, self.range_solver, self.pixel_tolerance,
+            degrees(self.lod_fov), self.lod_resolution, self.merge_coplanar,
+            self.compact_meshes, self.weld_distance, self.reorder_faces,
+            self.normal_tolerance, self.use_cache, self.use_texture_registry,
+            self.build_textures, self.texture_palette, self.embed_palette,
+            self.use_atlas, int(self.atlas_size), self.lod_textures,
+            self.sphere_report
         )
 
         exporter.export()
+        if exporter.phase_times is not None:
+            self.report({"INFO"}, "Extraction took {:.2f} seconds, writing "
+                        "took {:.2f} seconds.".format(*exporter.phase_times))
+        if exporter.model_aliases:
+            self.report({"INFO"}, "{} models were identical to other models, "
+                        "and were not written. See the console for which "
+                        "ones.".format(len(exporter.model_aliases)))
+        if exporter.skipped_models:
+            self.report({"INFO"}, "Skipped {} unchanged models.".format(
+                exporter.skipped_models))
+        if exporter.built_textures is not None:
+            self.report({"INFO"}, "Built {} MATs.".format(
+                exporter.built_textures))
+        if exporter.extract_memory is not None:
+            self.report({"INFO"}, "Memory use grew by up to {:.1f} MiB while "
+                        "extracting the models.".format(
+                            exporter.extract_memory))
         with warnings.catch_warnings(record=True) as wlist:
             for warning in wlist:
                 self.report({"WARNING"}, warning.message)
@@ -373,6 +656,10 @@ def menu_func_import_iff(self, context):
     self.layout.operator(ImportIFF.bl_idname, text="WCP/SO IFF Mesh (.iff)")
 
 
+def menu_func_load_textures(self, context):
+    self.layout.operator(LoadIFFTextures.bl_idname)
+
+
 def menu_func_export_xmf(self, context):
     self.layout.operator(ExportXMF.bl_idname,
                          text="WCP/SO IFF Mesh XMF source (.pas)")
@@ -381,6 +668,8 @@ def menu_func_export_xmf(self, context):
 def register():
     bpy.utils.register_class(ImportIFF)
     bpy.types.INFO_MT_file_import.append(menu_func_import_iff)
+    bpy.utils.register_class(LoadIFFTextures)
+    bpy.types.IMAGE_MT_image.append(menu_func_load_textures)
     bpy.utils.register_class(ExportIFF)
     bpy.types.INFO_MT_file_export.append(menu_func_export_iff)
     # bpy.utils.register_class(ExportXMF)
@@ -390,6 +679,8 @@ def register():
 def unregister():
     bpy.utils.unregister_class(ImportIFF)
     bpy.types.INFO_MT_file_import.append(menu_func_import_iff)
+    bpy.utils.unregister_class(LoadIFFTextures)
+    bpy.types.IMAGE_MT_image.remove(menu_func_load_textures)
     bpy.utils.unregister_class(ExportIFF)
     bpy.types.INFO_MT_file_export.remove(menu_func_export_iff)
     # bpy.utils.unregister_class(ExportXMF)
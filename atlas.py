@@ -0,0 +1,237 @@
+# -*- coding: utf8 -*-
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+
+
+# Texture atlas packer
+#
+# Packs the texture images used by a model into a few power of two sized
+# atlases with a skyline packer, so the model uses fewer textures. The UVs
+# of each face are moved into the part of the atlas its image was put in.
+# Faces whose UVs wrap around their image cannot use an atlas, so they are
+# left alone, and keep using the image's own texture.
+import hashlib
+from collections import OrderedDict
+
+UV_EPSILON = 1e-4  # UVs this far outside of 0 to 1 do not count as wrapping
+ATLAS_PREFIX = "//atlas_"  # Texture filenames of atlases start with this
+
+
+class SkylinePacker:
+    """Packs rectangles into an area of a fixed size.
+
+    The skyline is the bottom edge of the packed rectangles, as a list of
+    [x, y, width] segments from left to right. y grows downwards, like the
+    rows of a MAT. Each rectangle is put where its bottom edge is highest,
+    and then furthest to the left."""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.skyline = [[0, 0, width]]
+
+    def _fit(self, index, width, height):
+        """Get the y a rectangle would be put at, with its left edge at the
+        start of a skyline segment, or None if it does not fit there."""
+        if self.skyline[index][0] + width > self.width:
+            return None
+        top = 0
+        remaining = width
+        while remaining > 0:
+            seg_x, seg_y, seg_width = self.skyline[index]
+            top = max(top, seg_y)
+            if top + height > self.height:
+                return None
+            remaining -= seg_width
+            index += 1
+        return top
+
+    def insert(self, width, height):
+        "Pack a rectangle. Returns its (x, y), or None if it does not fit."
+        best = best_index = None
+        for index, (seg_x, seg_y, seg_width) in enumerate(self.skyline):
+            top = self._fit(index, width, height)
+            if top is None:
+                continue
+            if best is None or (top + height, seg_x) < best[:2]:
+                best = (top + height, seg_x, top)
+                best_index = index
+        if best is None:
+            return None
+        bottom, left, top = best
+        self._add(best_index, left, bottom, width)
+        return left, top
+
+    def _add(self, index, left, bottom, width):
+        "Raise the skyline under a newly packed rectangle."
+        skyline = self.skyline
+        skyline.insert(index, [left, bottom, width])
+        right = left + width
+        index += 1
+        while index < len(skyline) and skyline[index][0] < right:
+            seg = skyline[index]
+            seg_right = seg[0] + seg[2]
+            if seg_right <= right:
+                del skyline[index]
+            else:
+                seg[0], seg[2] = right, seg_right - right
+                break
+        index = 0
+        while index < len(skyline) - 1:
+            if skyline[index][1] == skyline[index + 1][1]:
+                skyline[index][2] += skyline[index + 1][2]
+                del skyline[index + 1]
+            else:
+                index += 1
+
+
+class Atlas:
+    """A texture made of several images.
+
+    placements maps the name of each image to its (x, y, width, height) in
+    the atlas, in pixels from the top left corner. Each image has padding
+    pixels around it, which are filled with the pixels at its edges."""
+
+    def __init__(self, width, height, padding=0):
+        self.width = width
+        self.height = height
+        self.padding = padding
+        self.placements = OrderedDict()
+
+    @property
+    def name(self):
+        """A texture filename for the atlas.
+
+        Atlases with the same layout have the same name, so models that
+        use the same images still get the same texture numbers. The name
+        never ends in a number, so it is not taken for a numeric texture."""
+        digest = hashlib.sha1(repr((
+            self.width, self.height, self.padding,
+            list(self.placements.items()))).encode("utf-8"))
+        return ATLAS_PREFIX + digest.hexdigest()[:16]
+
+    def uv_transform(self, image):
+        """Get the (scale u, scale v, offset u, offset v) that move the UVs
+        of an image into the atlas."""
+        left, top, width, height = self.placements[image]
+        return (width / self.width, height / self.height,
+                left / self.width, top / self.height)
+
+    def __str__(self):
+        return "Atlas {} ({}x{}, {} images)".format(
+            self.name, self.width, self.height, len(self.placements))
+
+
+def _pow2(value):
+    "The smallest power of two that is at least value."
+    return 1 << max(value - 1, 0).bit_length()
+
+
+def _grow(width, height, max_size):
+    "Double the smaller side of an atlas, if it can grow."
+    if width <= height and width < max_size:
+        return width * 2, height
+    if height < max_size:
+        return width, height * 2
+    return width * 2, height
+
+
+def _fill(images, sizes, width, height, padding):
+    "Pack as many images as possible into an atlas."
+    packer = SkylinePacker(width, height)
+    atlas = Atlas(width, height, padding)
+    left_over = []
+    for image in images:
+        img_width, img_height = sizes[image]
+        pos = packer.insert(img_width + padding * 2, img_height + padding * 2)
+        if pos is None:
+            left_over.append(image)
+        else:
+            atlas.placements[image] = (pos[0] + padding, pos[1] + padding,
+                                       img_width, img_height)
+    return atlas, left_over
+
+
+def pack_atlases(sizes, max_size=1024, padding=2):
+    """Pack images into as few atlases as possible.
+
+    sizes maps image names to their (width, height). Each atlas is as small
+    as it can be, with power of two sides no longer than max_size. Images
+    that are too big for an atlas, and atlases with only one image, are
+    left out, since they would not save anything. Returns a list of
+    Atlases."""
+    if max_size < 1 or max_size & (max_size - 1):
+        raise ValueError("The atlas size must be a power of two!")
+    limit = max_size - padding * 2
+    # Tallest images first, so each row of the skyline is filled evenly.
+    remaining = sorted(
+        (image for image, (width, height) in sizes.items()
+         if 0 < width <= limit and 0 < height <= limit),
+        key=lambda image: (-sizes[image][1], -sizes[image][0]))
+    atlases = []
+    while remaining:
+        padded = [(sizes[image][0] + padding * 2,
+                   sizes[image][1] + padding * 2) for image in remaining]
+        area = sum(width * height for width, height in padded)
+        width = _pow2(max(width for width, height in padded))
+        height = _pow2(max(height for width, height in padded))
+        while width * height < area and width * height < max_size ** 2:
+            width, height = _grow(width, height, max_size)
+        while True:
+            atlas, left_over = _fill(remaining, sizes, width, height,
+                                     padding)
+            if not left_over or width >= max_size and height >= max_size:
+                break
+            width, height = _grow(width, height, max_size)
+        if len(atlas.placements) > 1:
+            atlases.append(atlas)
+        remaining = left_over
+    return atlases
+
+
+def uvs_in_range(uvs, epsilon=UV_EPSILON):
+    "Check that UV coordinates stay within their image, and do not wrap."
+    return not uvs or (min(uvs) >= -epsilon and max(uvs) <= 1 + epsilon)
+
+
+def remap_faces(packed, remap):
+    """Move the UVs of the faces of a PackedLOD into atlas space.
+
+    remap maps the texture number of each image in an atlas to the texture
+    number of the atlas, and the image's Atlas.uv_transform. Faces whose
+    UVs wrap are left alone. Returns the number of faces that were moved
+    into an atlas, and the number that were left alone."""
+    uvs = packed.fvrt_uvs
+    moved = wrapped = 0
+    for face_idx in range(packed.num_faces):
+        entry = remap.get(packed.face_texnums[face_idx])
+        if entry is None:
+            continue
+        first = packed.face_first[face_idx] * 2
+        end = first + packed.face_nverts[face_idx] * 2
+        if not uvs_in_range(uvs[first:end]):
+            wrapped += 1
+            continue
+        atlas_texnum, (scale_u, scale_v, off_u, off_v) = entry
+        for idx in range(first, end, 2):
+            uvs[idx] = off_u + min(max(uvs[idx], 0.0), 1.0) * scale_u
+            uvs[idx + 1] = off_v + min(max(uvs[idx + 1], 0.0), 1.0) * scale_v
+        packed.face_texnums[face_idx] = atlas_texnum
+        moved += 1
+    return moved, wrapped
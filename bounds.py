@@ -0,0 +1,276 @@
+# -*- coding: utf8 -*-
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+
+# Bounding sphere calculation for CNTR/RADI and SPHR data.
+# Vertex arrays are flat sequences of floats (x, y, z, x, y, z, ...), like
+# the data in a VERT chunk.
+import time
+from math import sqrt
+from random import Random
+
+# Relative tolerance used when checking whether a point is inside a sphere.
+SPHERE_EPSILON = 1e-6
+
+
+def points_of(coords):
+    "Convert a flat vertex array to a list of unique (x, y, z) tuples."
+    if len(coords) % 3 != 0:
+        raise ValueError("The length of a vertex array must be a multiple "
+                         "of 3!")
+    return list(set(zip(coords[0::3], coords[1::3], coords[2::3])))
+
+
+def _dist2(a, b):
+    dx = a[0] - b[0]
+    dy = a[1] - b[1]
+    dz = a[2] - b[2]
+    return dx * dx + dy * dy + dz * dz
+
+
+def _sphere2(a, b):
+    "Smallest sphere with a and b on its boundary."
+    c = ((a[0] + b[0]) / 2, (a[1] + b[1]) / 2, (a[2] + b[2]) / 2)
+    return c, _dist2(a, c)
+
+
+def _sphere3(a, b, c):
+    "Circumsphere of triangle abc, or None if abc is degenerate."
+    # Solve for the circumcentre in the plane of the triangle.
+    ab = (b[0] - a[0], b[1] - a[1], b[2] - a[2])
+    ac = (c[0] - a[0], c[1] - a[1], c[2] - a[2])
+    # n = ab x ac
+    n = (ab[1] * ac[2] - ab[2] * ac[1],
+         ab[2] * ac[0] - ab[0] * ac[2],
+         ab[0] * ac[1] - ab[1] * ac[0])
+    nn = n[0] * n[0] + n[1] * n[1] + n[2] * n[2]
+    if nn < 1e-20:
+        return None
+    ab2 = ab[0] * ab[0] + ab[1] * ab[1] + ab[2] * ab[2]
+    ac2 = ac[0] * ac[0] + ac[1] * ac[1] + ac[2] * ac[2]
+    # ((n x ab) * |ac|^2 + (ac x n) * |ab|^2) / (2 * |n|^2)
+    nxab = (n[1] * ab[2] - n[2] * ab[1],
+            n[2] * ab[0] - n[0] * ab[2],
+            n[0] * ab[1] - n[1] * ab[0])
+    acxn = (ac[1] * n[2] - ac[2] * n[1],
+            ac[2] * n[0] - ac[0] * n[2],
+            ac[0] * n[1] - ac[1] * n[0])
+    ofs = tuple((nxab[i] * ac2 + acxn[i] * ab2) / (2 * nn) for i in range(3))
+    cen = (a[0] + ofs[0], a[1] + ofs[1], a[2] + ofs[2])
+    return cen, _dist2(a, cen)
+
+
+def _sphere4(a, b, c, d):
+    "Circumsphere of tetrahedron abcd, or None if abcd is degenerate."
+    ab = (b[0] - a[0], b[1] - a[1], b[2] - a[2])
+    ac = (c[0] - a[0], c[1] - a[1], c[2] - a[2])
+    ad = (d[0] - a[0], d[1] - a[1], d[2] - a[2])
+    det = (ab[0] * (ac[1] * ad[2] - ac[2] * ad[1]) -
+           ab[1] * (ac[0] * ad[2] - ac[2] * ad[0]) +
+           ab[2] * (ac[0] * ad[1] - ac[1] * ad[0]))
+    if abs(det) < 1e-20:
+        return None
+    ab2 = (ab[0] * ab[0] + ab[1] * ab[1] + ab[2] * ab[2]) / 2
+    ac2 = (ac[0] * ac[0] + ac[1] * ac[1] + ac[2] * ac[2]) / 2
+    ad2 = (ad[0] * ad[0] + ad[1] * ad[1] + ad[2] * ad[2]) / 2
+    # Cramer's rule
+    ox = (ab2 * (ac[1] * ad[2] - ac[2] * ad[1]) -
+          ab[1] * (ac2 * ad[2] - ac[2] * ad2) +
+          ab[2] * (ac2 * ad[1] - ac[1] * ad2)) / det
+    oy = (ab[0] * (ac2 * ad[2] - ac[2] * ad2) -
+          ab2 * (ac[0] * ad[2] - ac[2] * ad[0]) +
+          ab[2] * (ac[0] * ad2 - ac2 * ad[0])) / det
+    oz = (ab[0] * (ac[1] * ad2 - ac2 * ad[1]) -
+          ab[1] * (ac[0] * ad2 - ac2 * ad[0]) +
+          ab2 * (ac[0] * ad[1] - ac[1] * ad[0])) / det
+    cen = (a[0] + ox, a[1] + oy, a[2] + oz)
+    return cen, _dist2(a, cen)
+
+
+def _contains(sphere, pt):
+    cen, r2 = sphere
+    return _dist2(cen, pt) <= r2 * (1 + SPHERE_EPSILON) + SPHERE_EPSILON
+
+
+def _min_sphere_small(pts):
+    """Minimal sphere for up to 4 points, by brute force.
+
+    Used as a fallback when the support set of the Welzl algorithm is
+    degenerate (collinear or coplanar points)."""
+    if len(pts) == 1:
+        return pts[0], 0.0
+    cands = []
+    npts = len(pts)
+    for i in range(npts):
+        for j in range(i + 1, npts):
+            cands.append(_sphere2(pts[i], pts[j]))
+            for k in range(j + 1, npts):
+                cands.append(_sphere3(pts[i], pts[j], pts[k]))
+    if npts == 4:
+        cands.append(_sphere4(*pts))
+    best = None
+    for sphere in cands:
+        if sphere is None:
+            continue
+        if best is not None and sphere[1] >= best[1]:
+            continue
+        if all(_contains(sphere, pt) for pt in pts):
+            best = sphere
+    return best
+
+
+def _finish(pts, sphere):
+    """Ensure every point is inside the sphere.
+
+    Floating point error can leave points just outside of the calculated
+    sphere, so the radius is grown to the farthest point from the centre."""
+    cen, r2 = sphere
+    far2 = max(map(lambda pt: _dist2(cen, pt), pts))
+    return cen[0], cen[1], cen[2], sqrt(max(r2, far2))
+
+
+def ritter_sphere(coords):
+    """Calculate an approximate bounding sphere using Ritter's algorithm.
+
+    This is fast (two passes over the vertices), but the sphere is usually a
+    few percent larger than the minimal one. Returns (x, y, z, radius)"""
+    pts = points_of(coords)
+    if len(pts) == 0:
+        raise ValueError("Cannot calculate a bounding sphere for nothing!")
+
+    first = pts[0]
+    pa = max(pts, key=lambda pt: _dist2(first, pt))
+    pb = max(pts, key=lambda pt: _dist2(pa, pt))
+    (cx, cy, cz), r2 = _sphere2(pa, pb)
+    r = sqrt(r2)
+
+    for pt in pts:
+        dx = pt[0] - cx
+        dy = pt[1] - cy
+        dz = pt[2] - cz
+        d2 = dx * dx + dy * dy + dz * dz
+        if d2 > r * r:
+            d = sqrt(d2)
+            nr = (r + d) / 2
+            k = (nr - r) / d
+            cx += dx * k
+            cy += dy * k
+            cz += dz * k
+            r = nr
+
+    return _finish(pts, ((cx, cy, cz), r * r))
+
+
+def exact_sphere(coords, seed=0):
+    """Calculate the minimal bounding sphere using Welzl's algorithm.
+
+    The algorithm is written iteratively, with one loop per point on the
+    boundary of the sphere, so there is no recursion limit to worry about.
+    The points are shuffled with a fixed seed, so the result is
+    deterministic. Expected running time is linear in the number of unique
+    vertices. Returns (x, y, z, radius)"""
+    pts = points_of(coords)
+    if len(pts) == 0:
+        raise ValueError("Cannot calculate a bounding sphere for nothing!")
+    # Sorting first makes the shuffle independent of set ordering.
+    pts.sort()
+    Random(seed).shuffle(pts)
+
+    sphere = (pts[0], 0.0)
+    for i in range(1, len(pts)):
+        if _contains(sphere, pts[i]):
+            continue
+        # pts[i] is on the boundary
+        p = pts[i]
+        sphere = (p, 0.0)
+        for j in range(i):
+            if _contains(sphere, pts[j]):
+                continue
+            # pts[i] and pts[j] are on the boundary
+            q = pts[j]
+            sphere = _sphere2(p, q)
+            for k in range(j):
+                if _contains(sphere, pts[k]):
+                    continue
+                # pts[i], pts[j], and pts[k] are on the boundary
+                s = pts[k]
+                sphere = _sphere3(p, q, s) or _min_sphere_small([p, q, s])
+                for m in range(k):
+                    if _contains(sphere, pts[m]):
+                        continue
+                    sphere = (_sphere4(p, q, s, pts[m]) or
+                              _min_sphere_small([p, q, s, pts[m]]))
+
+    return _finish(pts, sphere)
+
+
+def box_sphere(coords):
+    """Bounding sphere of the axis-aligned bounding box.
+
+    Centred on the bounding box centre, with the radius being half of the
+    bounding box diagonal. Returns (x, y, z, radius)"""
+    if len(coords) < 3:
+        raise ValueError("Cannot calculate a bounding sphere for nothing!")
+    mins = [min(coords[ax::3]) for ax in range(3)]
+    maxs = [max(coords[ax::3]) for ax in range(3)]
+    cen = tuple((lo + hi) / 2 for lo, hi in zip(mins, maxs))
+    return cen + (sqrt(_dist2(mins, maxs)) / 2,)
+
+
+def uncovered(coords, sphere):
+    """How far the farthest vertex lies outside of the sphere.
+
+    Returns 0 if all of the vertices are inside the sphere."""
+    cen = sphere[:3]
+    far = sqrt(max(map(lambda pt: _dist2(cen, pt), points_of(coords))))
+    return max(0.0, far - sphere[3])
+
+
+def sphere_report(coords, old_sphere=None):
+    """Compare the sphere calculation methods for a vertex array.
+
+    Returns a list of (method, sphere, seconds, uncovered distance) tuples.
+    If old_sphere is given, it is included as the "old" method."""
+    report = []
+    if old_sphere is not None:
+        report.append(("old", tuple(old_sphere), 0.0,
+                       uncovered(coords, old_sphere)))
+    for name, method in (("box", box_sphere), ("ritter", ritter_sphere),
+                         ("exact", exact_sphere)):
+        start = time.perf_counter()
+        sphere = method(coords)
+        elapsed = time.perf_counter() - start
+        report.append((name, sphere, elapsed, uncovered(coords, sphere)))
+    return report
+
+
+def fmt_sphere_report(report):
+    "Format a report from sphere_report as a string."
+    exact_r = [sphere[3] for name, sphere, t, u in report if name == "exact"]
+    exact_r = exact_r[0] if exact_r else None
+    lines = []
+    for name, sphere, elapsed, outside in report:
+        line = "{:>6}: ({:.4f}, {:.4f}, {:.4f}:{:.4f}) {:.2f}ms".format(
+            name, sphere[0], sphere[1], sphere[2], sphere[3], elapsed * 1000)
+        if exact_r:
+            line += " {:+.2%} radius".format(sphere[3] / exact_r - 1)
+        if outside > 0:
+            line += " ({:.4f} uncovered!)".format(outside)
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,831 @@
+# -*- coding: utf8 -*-
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+
+# BSP tree builder for corvette and capship collision meshes.
+#
+# The input is a "packed" polygon set: a flat vertex array (x, y, z, ...)
+# in VISION engine coordinates, and a list of polygons, each of which is a
+# sequence of vertex indices. Polygons are assumed to be convex and wound so
+# that their normals point out of the model.
+#
+# Each node of the tree stores a splitting plane, and the polygons lying on
+# it. The front (outside) and back (inside) subtrees are built from the
+# polygons in front of, and behind, the plane. Polygons spanning the plane
+# are split in two.
+#
+# A Blockmap is a uniform grid of regions over the polygons of a tree, used
+# for "bsp+region" colliders, and for checking collision coverage offline.
+#
+# Once a splitting plane is chosen, the front and back subtrees are
+# independent of each other, so small enough subtrees can be built by worker
+# processes.
+import array
+import time
+from math import sqrt
+
+try:
+    from . import workers
+except ImportError:
+    # Not imported as part of the add-on (ex. by the unit tests)
+    import workers
+
+# Polygon classifications relative to a plane
+COPLANAR = 0
+FRONT = 1
+BACK = 2
+SPANNING = 3
+
+# Child index used for a leaf.
+NO_NODE = -1
+
+
+def poly_plane(pts):
+    """Calculate the plane of a polygon using Newell's method.
+
+    Returns (nx, ny, nz, d), such that nx * x + ny * y + nz * z + d = 0 for
+    points on the plane, or None if the polygon has no area."""
+    nx = ny = nz = 0.0
+    cx = cy = cz = 0.0
+    npts = len(pts)
+    for i in range(npts):
+        x1, y1, z1 = pts[i]
+        x2, y2, z2 = pts[(i + 1) % npts]
+        nx += (y1 - y2) * (z1 + z2)
+        ny += (z1 - z2) * (x1 + x2)
+        nz += (x1 - x2) * (y1 + y2)
+        cx += x1
+        cy += y1
+        cz += z1
+    nlen = sqrt(nx * nx + ny * ny + nz * nz)
+    if nlen < 1e-12:
+        return None
+    nx /= nlen
+    ny /= nlen
+    nz /= nlen
+    d = -(nx * cx + ny * cy + nz * cz) / npts
+    return nx, ny, nz, d
+
+
+def classify(pts, plane, eps):
+    "Classify a polygon as COPLANAR, FRONT, BACK, or SPANNING the plane."
+    nx, ny, nz, d = plane
+    side = COPLANAR
+    for x, y, z in pts:
+        dist = nx * x + ny * y + nz * z + d
+        if dist > eps:
+            side |= FRONT
+        elif dist < -eps:
+            side |= BACK
+    return side
+
+
+def split_poly(pts, plane, eps):
+    """Split a convex polygon along a plane.
+
+    Returns the (front, back) pieces as lists of points."""
+    nx, ny, nz, d = plane
+    dists = [nx * x + ny * y + nz * z + d for x, y, z in pts]
+    front = []
+    back = []
+    npts = len(pts)
+    for i in range(npts):
+        j = (i + 1) % npts
+        pi, di = pts[i], dists[i]
+        pj, dj = pts[j], dists[j]
+        if di >= -eps:
+            front.append(pi)
+        if di <= eps:
+            back.append(pi)
+        if (di > eps and dj < -eps) or (di < -eps and dj > eps):
+            t = di / (di - dj)
+            isect = (pi[0] + (pj[0] - pi[0]) * t,
+                     pi[1] + (pj[1] - pi[1]) * t,
+                     pi[2] + (pj[2] - pi[2]) * t)
+            front.append(isect)
+            back.append(isect)
+    return front, back
+
+
+def poly_bounds(pts):
+    "Bounding sphere (centroid and radius) of a polygon."
+    npts = len(pts)
+    cx = sum(pt[0] for pt in pts) / npts
+    cy = sum(pt[1] for pt in pts) / npts
+    cz = sum(pt[2] for pt in pts) / npts
+    r2 = max((x - cx) ** 2 + (y - cy) ** 2 + (z - cz) ** 2
+             for x, y, z in pts)
+    return cx, cy, cz, sqrt(r2)
+
+
+def _stride_sample(items, count):
+    "Evenly spaced, deterministic sample of up to count items."
+    num = len(items)
+    if num <= count:
+        return items
+    return [items[i * num // count] for i in range(count)]
+
+
+def _subtree_preorder(root):
+    """Convert a subtree to a pre-order list of nodes, for pickling.
+
+    Each node is a (plane, polys, depth, has front, has back) tuple."""
+    items = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        items.append((node.plane, node.polys, node.depth,
+                      node.front is not None, node.back is not None))
+        if node.back is not None:
+            stack.append(node.back)
+        if node.front is not None:
+            stack.append(node.front)
+    return items
+
+
+def _subtree_from_preorder(items):
+    "Convert a list made by _subtree_preorder back to a subtree."
+    root = None
+    # Child slots that still need a node, as (parent, is front) tuples
+    slots = []
+    for plane, polys, depth, has_front, has_back in items:
+        node = BSPBuildNode(plane, polys, depth)
+        if slots:
+            parent, is_front = slots.pop()
+            if is_front:
+                parent.front = node
+            else:
+                parent.back = node
+        else:
+            root = node
+        if has_back:
+            slots.append((node, False))
+        if has_front:
+            slots.append((node, True))
+    return root
+
+
+def _build_shared_subtree(task):
+    """Build a subtree from polygons in a shared memory block.
+
+    This runs in a worker process. Returns the subtree as a pre-order list
+    of nodes, and the number of polygons that were split."""
+    descriptor, params, start, stop, depth = task
+    data = workers.read_shared(descriptor, start, stop)
+    polys = []
+    idx = 0
+    while idx < len(data):
+        npts = int(data[idx])
+        plane = tuple(data[idx + 1:idx + 5])
+        bnds = tuple(data[idx + 5:idx + 9])
+        flat = data[idx + 9:idx + 9 + npts * 3]
+        pts = tuple(zip(flat[0::3], flat[1::3], flat[2::3]))
+        polys.append((pts, plane, bnds))
+        idx += 9 + npts * 3
+    builder = BSPTree.__new__(BSPTree)
+    builder.setup(*params)
+    root = builder.build(polys, depth)
+    return _subtree_preorder(root), builder.num_splits
+
+
+class BSPBuildNode:
+    "A node of a BSP tree that is being built."
+
+    __slots__ = ("plane", "polys", "front", "back", "depth")
+
+    def __init__(self, plane, polys, depth):
+        self.plane = plane
+        self.polys = polys  # Polygons lying on the plane
+        self.front = None  # BSPBuildNode, or None for a leaf
+        self.back = None
+        self.depth = depth
+
+
+class BSPTree:
+    """A BSP tree built from a packed polygon set.
+
+    The tree is flattened into arrays, with nodes in depth-first (pre-order,
+    front before back) order, and vertices in order of first use. The
+    flattened arrays only depend on the tree, not the order in which the
+    subtrees were built.
+
+    If workers is not 1, subtrees with no more than parallel_threshold
+    polygons are built by a pool of that many worker processes (0 means
+    one per CPU). The tree is the same regardless of the number of
+    workers."""
+
+    # Polygons at or below this count are split using the first polygon
+    # as the splitter, without scoring any candidates.
+    TRIVIAL_SIZE = 3
+
+    # Smallest default parallel_threshold. Smaller subtrees are not worth
+    # the overhead of sending them to a worker.
+    MIN_PARALLEL_SIZE = 256
+
+    def __init__(self, coords, polys, max_candidates=12, sample_size=96,
+                 split_weight=4.0, epsilon=None, workers=1,
+                 parallel_threshold=None):
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+        self.num_workers = 1
+
+        start = time.perf_counter()
+
+        pts = list(zip(coords[0::3], coords[1::3], coords[2::3]))
+        if epsilon is None:
+            if len(pts) > 0:
+                extent = max(max(map(abs, coords)), 1.0)
+            else:
+                extent = 1.0
+            epsilon = extent * 1e-5
+        self.setup(max_candidates, sample_size, split_weight, epsilon)
+
+        # Input polygons, as (points, plane, bounds) tuples
+        in_polys = []
+        self.num_degenerate = 0
+        for poly in polys:
+            poly_pts = tuple(pts[vidx] for vidx in poly)
+            plane = poly_plane(poly_pts)
+            if plane is None or len(poly_pts) < 3:
+                self.num_degenerate += 1
+                continue
+            in_polys.append((poly_pts, plane, poly_bounds(poly_pts)))
+        self.num_input = len(in_polys)
+
+        if self.workers == 1:
+            self.root = self.build(in_polys)
+        else:
+            self.root = self.build_parallel(in_polys)
+        self.flatten()
+        self.build_time = time.perf_counter() - start
+
+    def setup(self, max_candidates, sample_size, split_weight, epsilon):
+        "Set the tree building parameters."
+        self.max_candidates = max_candidates
+        self.sample_size = sample_size
+        self.split_weight = split_weight
+        self.epsilon = epsilon
+        self.num_splits = 0
+
+    def choose_plane(self, polys):
+        """Choose a splitting plane for the given polygons.
+
+        Candidate planes are taken from an evenly spaced sample of the
+        polygons, and each candidate is scored against another sample of the
+        polygons. The score is the number of splits (weighted by
+        split_weight), plus the imbalance between the front and back."""
+        if len(polys) <= self.TRIVIAL_SIZE:
+            return polys[0][1]
+
+        eps = self.epsilon
+        candidates = []
+        seen_planes = set()
+        for cand in _stride_sample(polys, self.max_candidates):
+            if cand[1] not in seen_planes:
+                seen_planes.add(cand[1])
+                candidates.append(cand[1])
+        sample = _stride_sample(polys, self.sample_size)
+
+        best_plane = None
+        best_score = None
+        for plane in candidates:
+            nx, ny, nz, d = plane
+            num_front = num_back = num_split = 0
+            for poly_pts, poly_plane, (cx, cy, cz, cr) in sample:
+                # Polygons whose bounding spheres don't touch the plane
+                # don't need to be checked vertex by vertex.
+                dist = nx * cx + ny * cy + nz * cz + d
+                if dist > cr + eps:
+                    num_front += 1
+                    continue
+                elif dist < -cr - eps:
+                    num_back += 1
+                    continue
+                side = classify(poly_pts, plane, eps)
+                if side == FRONT:
+                    num_front += 1
+                elif side == BACK:
+                    num_back += 1
+                elif side == SPANNING:
+                    num_split += 1
+            score = (self.split_weight * num_split +
+                     abs(num_front - num_back))
+            if best_score is None or score < best_score:
+                best_plane = plane
+                best_score = score
+        return best_plane
+
+    def partition(self, polys, plane):
+        """Partition polygons by a plane.
+
+        Returns (coplanar, front, back) lists of polygons. Spanning polygons
+        are split, and their pieces are added to the front and back lists."""
+        eps = self.epsilon
+        nx, ny, nz, d = plane
+        coplanar = []
+        front = []
+        back = []
+        for poly in polys:
+            cx, cy, cz, cr = poly[2]
+            dist = nx * cx + ny * cy + nz * cz + d
+            if dist > cr + eps:
+                front.append(poly)
+                continue
+            elif dist < -cr - eps:
+                back.append(poly)
+                continue
+            side = classify(poly[0], plane, eps)
+            if side == COPLANAR:
+                coplanar.append(poly)
+            elif side == FRONT:
+                front.append(poly)
+            elif side == BACK:
+                back.append(poly)
+            else:
+                fpts, bpts = split_poly(poly[0], plane, eps)
+                self.num_splits += 1
+                if len(fpts) >= 3:
+                    front.append((tuple(fpts), poly[1], poly_bounds(fpts)))
+                if len(bpts) >= 3:
+                    back.append((tuple(bpts), poly[1], poly_bounds(bpts)))
+        return coplanar, front, back
+
+    def build(self, polys, depth=0, deferred=None):
+        """Build a (sub)tree from a list of (points, plane, bounds) polygons.
+
+        If deferred is a list, child subtrees with no more than
+        parallel_threshold polygons are not built. Instead, (polygons,
+        parent node, is front child, depth) tuples for them are appended to
+        deferred.
+
+        Returns the root BSPBuildNode of the subtree, or None if there are no
+        polygons."""
+        if len(polys) == 0:
+            return None
+        root = None
+        # Explicit stack of (polygons, parent node, is front child, depth)
+        stack = [(polys, None, False, depth)]
+        while stack:
+            cur_polys, parent, is_front, cur_depth = stack.pop()
+            if (deferred is not None and parent is not None and
+                    len(cur_polys) <= self.parallel_threshold):
+                deferred.append((cur_polys, parent, is_front, cur_depth))
+                continue
+            plane = self.choose_plane(cur_polys)
+            coplanar, front, back = self.partition(cur_polys, plane)
+            node = BSPBuildNode(plane, coplanar, cur_depth)
+            if parent is None:
+                root = node
+            elif is_front:
+                parent.front = node
+            else:
+                parent.back = node
+            if len(back) > 0:
+                stack.append((back, node, False, cur_depth + 1))
+            if len(front) > 0:
+                stack.append((front, node, True, cur_depth + 1))
+        return root
+
+    def build_parallel(self, polys):
+        """Build the tree, using a pool of worker processes for subtrees.
+
+        The top of the tree is built in this process. The polygons of the
+        subtrees that were deferred are packed into a shared memory block,
+        and the workers build the subtrees from there. Each subtree is built
+        exactly as build() would build it."""
+        num_workers = workers.num_workers(self.workers)
+        if num_workers == 1 or not workers.can_fork():
+            return self.build(polys)
+        if self.parallel_threshold is None:
+            self.parallel_threshold = max(self.MIN_PARALLEL_SIZE,
+                                          len(polys) // (4 * num_workers))
+
+        deferred = []
+        root = self.build(polys, 0, deferred)
+        if len(deferred) == 0:
+            return root
+
+        # Each polygon is packed as its number of points, its plane, its
+        # bounds, and its points.
+        packed = array.array("d")
+        tasks = []
+        for sub_polys, parent, is_front, depth in deferred:
+            start = len(packed)
+            for pts, plane, bnds in sub_polys:
+                packed.append(len(pts))
+                packed.extend(plane)
+                packed.extend(bnds)
+                for pt in pts:
+                    packed.extend(pt)
+            tasks.append((start, len(packed), depth))
+        params = (self.max_candidates, self.sample_size, self.split_weight,
+                  self.epsilon)
+        # Biggest subtrees first, so that the workers finish at around the
+        # same time.
+        order = sorted(range(len(tasks)),
+                       key=lambda t: tasks[t][0] - tasks[t][1])
+
+        with workers.SharedArray(packed) as shared, \
+                workers.WorkerPool(num_workers) as pool:
+            self.num_workers = pool.workers
+            results = pool.map(_build_shared_subtree, [
+                (shared.descriptor, params) + tasks[t] for t in order])
+
+        for t, (preorder, num_splits) in zip(order, results):
+            sub_polys, parent, is_front, depth = deferred[t]
+            self.num_splits += num_splits
+            if is_front:
+                parent.front = _subtree_from_preorder(preorder)
+            else:
+                parent.back = _subtree_from_preorder(preorder)
+        return root
+
+    def flatten(self):
+        """Flatten the tree into arrays.
+
+        verts is a flat list of vertex coordinates.
+        nodes is a list of (nx, ny, nz, d, front, back, first poly, number
+        of polys) tuples. front and back are node indices, or NO_NODE.
+        polys is a list of (first pvrt, number of vertices, node) tuples.
+        pvrts is a list of vertex indices."""
+        self.verts = []
+        self.nodes = []
+        self.polys = []
+        self.pvrts = []
+        self.depth = 0
+        vert_idxs = {}
+        if self.root is None:
+            return
+
+        # Node index assignment is pre-order, so each node's index is known
+        # before its children are visited; children are patched in later.
+        stack = [(self.root, None, False)]
+        while stack:
+            node, parent_idx, is_front = stack.pop()
+            node_idx = len(self.nodes)
+            if parent_idx is not None:
+                parent = list(self.nodes[parent_idx])
+                parent[4 if is_front else 5] = node_idx
+                self.nodes[parent_idx] = tuple(parent)
+            self.depth = max(self.depth, node.depth + 1)
+
+            first_poly = len(self.polys)
+            for poly_pts, poly_plane, poly_bnds in node.polys:
+                first_pvrt = len(self.pvrts)
+                for pt in poly_pts:
+                    vidx = vert_idxs.get(pt)
+                    if vidx is None:
+                        vidx = len(vert_idxs)
+                        vert_idxs[pt] = vidx
+                        self.verts.extend(pt)
+                    self.pvrts.append(vidx)
+                self.polys.append((first_pvrt, len(poly_pts), node_idx))
+
+            self.nodes.append(node.plane + (NO_NODE, NO_NODE, first_poly,
+                                            len(node.polys)))
+            if node.back is not None:
+                stack.append((node.back, node_idx, False))
+            if node.front is not None:
+                stack.append((node.front, node_idx, True))
+
+        # Relative depth within the subtree.
+        self.depth -= self.root.depth
+
+    def stats(self):
+        "Get information about the quality of this tree."
+        num_leaves = 0
+        for node in self.nodes:
+            num_leaves += (node[4] == NO_NODE) + (node[5] == NO_NODE)
+        return {
+            "input_polys": self.num_input,
+            "degenerate_polys": self.num_degenerate,
+            "output_polys": len(self.polys),
+            "splits": self.num_splits,
+            "nodes": len(self.nodes),
+            "leaves": num_leaves,
+            "depth": self.depth,
+            "vertices": len(self.verts) // 3,
+            "build_time": self.build_time,
+            "workers": self.num_workers,
+        }
+
+    def fmt_stats(self):
+        "Format the tree statistics as a string."
+        return ("BSP tree: {nodes} nodes, {leaves} leaves, depth {depth}, "
+                "{input_polys} polygons in, {output_polys} out "
+                "({splits} splits, {degenerate_polys} degenerate), "
+                "{vertices} vertices, built in {build_time:.3f} seconds "
+                "({workers} workers)"
+                .format(**self.stats()))
+
+    def point_inside(self, x, y, z):
+        """Check whether a point is inside the solid defined by this tree.
+
+        Points behind a leaf node's plane are inside."""
+        if len(self.nodes) == 0:
+            return False
+        node_idx = 0
+        while True:
+            nx, ny, nz, d, front, back = self.nodes[node_idx][:6]
+            if nx * x + ny * y + nz * z + d >= 0:
+                if front == NO_NODE:
+                    return False
+                node_idx = front
+            else:
+                if back == NO_NODE:
+                    return True
+                node_idx = back
+
+    def segment_poly_hit(self, start, end, poly_idx):
+        """Check whether a line segment hits a polygon of this tree.
+
+        Returns the fraction of the segment at which it hits the polygon,
+        or None if it misses."""
+        first_pvrt, nverts, node_idx = self.polys[poly_idx]
+        nx, ny, nz, d = self.nodes[node_idx][:4]
+        d0 = nx * start[0] + ny * start[1] + nz * start[2] + d
+        d1 = nx * end[0] + ny * end[1] + nz * end[2] + d
+        if (d0 > 0 and d1 > 0) or (d0 < 0 and d1 < 0) or d0 == d1:
+            return None
+        t = d0 / (d0 - d1)
+        qx = start[0] + (end[0] - start[0]) * t
+        qy = start[1] + (end[1] - start[1]) * t
+        qz = start[2] + (end[2] - start[2]) * t
+
+        # The hit point must be on the same side of every edge. The polygon
+        # may face either way along the node's plane.
+        verts = self.verts
+        vidxs = self.pvrts[first_pvrt:first_pvrt + nverts]
+        pts = [(verts[vidx * 3], verts[vidx * 3 + 1], verts[vidx * 3 + 2])
+               for vidx in vidxs]
+        inner = outer = False
+        for i in range(nverts):
+            ax, ay, az = pts[i]
+            bx, by, bz = pts[(i + 1) % nverts]
+            ex, ey, ez = bx - ax, by - ay, bz - az
+            px, py, pz = qx - ax, qy - ay, qz - az
+            side = (nx * (ey * pz - ez * py) + ny * (ez * px - ex * pz) +
+                    nz * (ex * py - ey * px))
+            eps = self.epsilon * sqrt(ex * ex + ey * ey + ez * ez)
+            if side > eps:
+                inner = True
+            elif side < -eps:
+                outer = True
+            if inner and outer:
+                return None
+        return t
+
+    def __str__(self):
+        return "BSPTree ({} nodes, depth {})".format(
+            len(self.nodes), self.depth)
+
+
+class Blockmap:
+    """Uniform grid of regions over the polygons of a BSP tree.
+
+    Each region (grid cell) lists the polygons (indices into the tree's
+    polys) whose bounding boxes overlap it. The lists are stored
+    contiguously: the polygons of cell c are
+    cell_polys[cell_first[c]:cell_first[c] + cell_count[c]]. Cells are
+    numbered x-major: c = (k * dims[1] + j) * dims[0] + i."""
+
+    # Maximum number of cells along each axis
+    MAX_DIM = 64
+
+    def __init__(self, tree, cell_size=None, polys_per_cell=4):
+        if not isinstance(tree, BSPTree):
+            raise TypeError("A blockmap must be built from a BSP tree!")
+        self.tree = tree
+        start = time.perf_counter()
+
+        # Polygon bounding boxes, as (min x, min y, min z, max x, max y,
+        # max z) tuples.
+        verts = tree.verts
+        boxes = []
+        for first_pvrt, nverts, node in tree.polys:
+            vidxs = tree.pvrts[first_pvrt:first_pvrt + nverts]
+            xs = [verts[vidx * 3] for vidx in vidxs]
+            ys = [verts[vidx * 3 + 1] for vidx in vidxs]
+            zs = [verts[vidx * 3 + 2] for vidx in vidxs]
+            boxes.append((min(xs), min(ys), min(zs),
+                          max(xs), max(ys), max(zs)))
+
+        if boxes:
+            lo = [min(box[ax] for box in boxes) for ax in range(3)]
+            hi = [max(box[ax + 3] for box in boxes) for ax in range(3)]
+        else:
+            lo = [0.0, 0.0, 0.0]
+            hi = [0.0, 0.0, 0.0]
+        extents = [hi[ax] - lo[ax] for ax in range(3)]
+        max_extent = max(max(extents), 1e-6)
+
+        if cell_size is None:
+            # Aim for polys_per_cell polygons per cell on average. Flat
+            # models are treated as having some thickness.
+            target_cells = max(1, len(boxes) // polys_per_cell)
+            volume = 1.0
+            for extent in extents:
+                volume *= max(extent, max_extent / self.MAX_DIM)
+            cell_size = (volume / target_cells) ** (1 / 3)
+        if cell_size <= 0:
+            raise ValueError("The blockmap cell size must be positive!")
+        # Cells must be big enough to fit the model in MAX_DIM cells.
+        self.cell_size = max(cell_size, max_extent / self.MAX_DIM)
+        self.origin = tuple(lo)
+        self.dims = tuple(
+            min(max(1, int(extent // self.cell_size) + 1), self.MAX_DIM)
+            for extent in extents)
+
+        # One bucketing pass: add each polygon to every cell that its
+        # bounding box overlaps.
+        num_cells = self.dims[0] * self.dims[1] * self.dims[2]
+        buckets = [[] for cell in range(num_cells)]
+        for poly_idx, box in enumerate(boxes):
+            i0, j0, k0 = self._clamped_cell(box[0], box[1], box[2])
+            i1, j1, k1 = self._clamped_cell(box[3], box[4], box[5])
+            for k in range(k0, k1 + 1):
+                for j in range(j0, j1 + 1):
+                    row = (k * self.dims[1] + j) * self.dims[0]
+                    for i in range(i0, i1 + 1):
+                        buckets[row + i].append(poly_idx)
+
+        self.cell_first = array.array("i")
+        self.cell_count = array.array("i")
+        self.cell_polys = array.array("i")
+        for bucket in buckets:
+            self.cell_first.append(len(self.cell_polys))
+            self.cell_count.append(len(bucket))
+            self.cell_polys.extend(bucket)
+        self.build_time = time.perf_counter() - start
+
+    def _clamped_cell(self, x, y, z):
+        "Grid coordinates of the cell containing a point, clamped to the grid."
+        cell = []
+        for ax, coord in enumerate((x, y, z)):
+            idx = int((coord - self.origin[ax]) // self.cell_size)
+            cell.append(min(max(idx, 0), self.dims[ax] - 1))
+        return tuple(cell)
+
+    def cell_index(self, x, y, z):
+        "Index of the cell containing a point, or None if it is outside."
+        cell = []
+        for ax, coord in enumerate((x, y, z)):
+            idx = int((coord - self.origin[ax]) // self.cell_size)
+            if idx < 0 or idx >= self.dims[ax]:
+                return None
+            cell.append(idx)
+        return (cell[2] * self.dims[1] + cell[1]) * self.dims[0] + cell[0]
+
+    def cell_polygons(self, cell):
+        "Polygon indices in the given cell."
+        first = self.cell_first[cell]
+        return self.cell_polys[first:first + self.cell_count[cell]]
+
+    def polys_at(self, x, y, z):
+        "Polygon indices in the region containing a point."
+        cell = self.cell_index(x, y, z)
+        if cell is None:
+            return array.array("i")
+        return self.cell_polygons(cell)
+
+    def cells_along(self, start, end):
+        """Get the cells that a line segment passes through, in order.
+
+        Yields (cell index, t) tuples, where t is the fraction of the
+        segment at which it leaves the cell. This is a 3D DDA (Amanatides
+        and Woo) walk through the grid."""
+        # Clip the segment to the grid bounds.
+        t_enter = 0.0
+        t_exit = 1.0
+        delta = [end[ax] - start[ax] for ax in range(3)]
+        for ax in range(3):
+            lo = self.origin[ax]
+            hi = lo + self.dims[ax] * self.cell_size
+            if delta[ax] == 0:
+                if start[ax] < lo or start[ax] > hi:
+                    return
+                continue
+            ta = (lo - start[ax]) / delta[ax]
+            tb = (hi - start[ax]) / delta[ax]
+            if ta > tb:
+                ta, tb = tb, ta
+            t_enter = max(t_enter, ta)
+            t_exit = min(t_exit, tb)
+        if t_enter > t_exit:
+            return
+
+        pos = [start[ax] + delta[ax] * t_enter for ax in range(3)]
+        cell = list(self._clamped_cell(*pos))
+        step = [0, 0, 0]
+        t_max = [float("inf")] * 3
+        t_delta = [float("inf")] * 3
+        for ax in range(3):
+            if delta[ax] > 0:
+                step[ax] = 1
+                bound = self.origin[ax] + (cell[ax] + 1) * self.cell_size
+            elif delta[ax] < 0:
+                step[ax] = -1
+                bound = self.origin[ax] + cell[ax] * self.cell_size
+            else:
+                continue
+            t_max[ax] = (bound - start[ax]) / delta[ax]
+            t_delta[ax] = self.cell_size / abs(delta[ax])
+
+        while True:
+            ax = t_max.index(min(t_max))
+            leave = min(t_max[ax], t_exit)
+            yield ((cell[2] * self.dims[1] + cell[1]) * self.dims[0] +
+                   cell[0], leave)
+            if t_max[ax] >= t_exit:
+                return
+            cell[ax] += step[ax]
+            if cell[ax] < 0 or cell[ax] >= self.dims[ax]:
+                return
+            t_max[ax] += t_delta[ax]
+
+    def polys_along(self, start, end):
+        "Sorted indices of the polygons in the regions along a segment."
+        polys = set()
+        for cell, t in self.cells_along(start, end):
+            polys.update(self.cell_polygons(cell))
+        return sorted(polys)
+
+    def segment_hit(self, start, end, candidates=None):
+        """Find the first polygon that a line segment hits.
+
+        Only the polygons in the regions along the segment are tested,
+        unless candidates (an iterable of polygon indices) is given.
+        Returns a (t, polygon index) tuple, where t is the fraction of the
+        segment at which the hit occurs, or None if nothing is hit."""
+        if candidates is not None:
+            best = None
+            for poly_idx in candidates:
+                t = self.tree.segment_poly_hit(start, end, poly_idx)
+                if t is not None and (best is None or t < best[0]):
+                    best = (t, poly_idx)
+            return best
+
+        tested = set()
+        best = None
+        for cell, t_leave in self.cells_along(start, end):
+            for poly_idx in self.cell_polygons(cell):
+                if poly_idx in tested:
+                    continue
+                tested.add(poly_idx)
+                t = self.tree.segment_poly_hit(start, end, poly_idx)
+                if t is not None and (best is None or t < best[0]):
+                    best = (t, poly_idx)
+            # Hits in later cells are farther along the segment.
+            if best is not None and best[0] <= t_leave:
+                break
+        return best
+
+    def unindexed_polys(self):
+        """Check the coverage of the blockmap.
+
+        Returns a list of the polygon indices that are not in any region.
+        It should always be empty."""
+        indexed = set(self.cell_polys)
+        return [poly_idx for poly_idx in range(len(self.tree.polys))
+                if poly_idx not in indexed]
+
+    def stats(self):
+        "Get information about the regions in this blockmap."
+        counts = self.cell_count
+        used = [count for count in counts if count > 0]
+        return {
+            "dims": "x".join(map(str, self.dims)),
+            "cell_size": self.cell_size,
+            "cells": len(counts),
+            "used_cells": len(used),
+            "max_polys": max(counts) if counts else 0,
+            "avg_polys": sum(used) / len(used) if used else 0.0,
+            "entries": len(self.cell_polys),
+            "build_time": self.build_time,
+        }
+
+    def fmt_stats(self):
+        "Format the blockmap statistics as a string."
+        return ("Blockmap: {dims} cells of size {cell_size:.4f}, {used_cells} "
+                "of {cells} used, {avg_polys:.1f} polygons per used cell "
+                "(max {max_polys}), {entries} entries, built in "
+                "{build_time:.3f} seconds".format(**self.stats()))
+
+    def __str__(self):
+        return "Blockmap ({} cells)".format("x".join(map(str, self.dims)))
@@ -23,7 +23,7 @@ USAGE
 
 if [[ $# -eq 0 ]]; then usage; exit 1; fi
 
-pyfs=({__init__,{import,export}_iff,iff,iff_{mesh,read},mat_read}.py)
+pyfs=({__init__,{import,export}_iff,iff,iff_{mesh,read},mat_read,bounds,bsp,workers,decimate,lod_range,mesh_opt,serialize,export_cache,texreg,mat_write,texbuild,palgen,atlas,mat_codec}.py)
 
 vers=''
 gvers=''
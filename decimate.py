@@ -0,0 +1,464 @@
+# -*- coding: utf8 -*-
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+
+# Automatic LOD generation, by quadric error mesh simplification.
+#
+# The simplifier works on a PackedLOD. Faces are split into triangles, and
+# edges are collapsed in order of increasing quadric error (Garland and
+# Heckbert), using a heap. Collapses are "half-edge" collapses: one vertex
+# is moved onto the other, so the simplified LODs only use vertex positions
+# from the original mesh.
+#
+# Edges on the border of the mesh, between faces with different textures or
+# light flags, and along UV seams, are "feature" edges. Their vertices can
+# only be collapsed along the feature, and extra quadric planes keep the
+# feature from moving.
+import heapq
+import time
+from math import sqrt
+
+try:
+    from . import iff_mesh
+except ImportError:
+    # Not imported as part of the add-on (ex. by the unit tests)
+    import iff_mesh
+
+# Weight of the quadric planes added along feature edges, relative to the
+# planes of the faces.
+FEATURE_WEIGHT = 10.0
+
+# A collapse is rejected if it turns a triangle's normal by more than this
+# (the minimum cosine between the old and new normals).
+MIN_NORMAL_COS = 0.2
+
+
+def _sub(a, b):
+    return (a[0] - b[0], a[1] - b[1], a[2] - b[2])
+
+
+def _cross(a, b):
+    return (a[1] * b[2] - a[2] * b[1],
+            a[2] * b[0] - a[0] * b[2],
+            a[0] * b[1] - a[1] * b[0])
+
+
+def _dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+def _plane_quadric(nx, ny, nz, d, weight):
+    """Quadric for the squared distance to a plane, scaled by weight.
+
+    Stored as the upper triangle of the symmetric 4x4 matrix, plus the
+    weight: (a2, ab, ac, ad, b2, bc, bd, c2, cd, d2, weight)."""
+    return (weight * nx * nx, weight * nx * ny, weight * nx * nz,
+            weight * nx * d, weight * ny * ny, weight * ny * nz,
+            weight * ny * d, weight * nz * nz, weight * nz * d,
+            weight * d * d, weight)
+
+
+def _add_quadric(qa, qb):
+    return tuple(a + b for a, b in zip(qa, qb))
+
+
+def _quadric_error(quad, pos):
+    "Weighted mean squared distance from pos to the planes of a quadric."
+    a2, ab, ac, ad, b2, bc, bd, c2, cd, d2, weight = quad
+    x, y, z = pos
+    err = (a2 * x * x + 2 * ab * x * y + 2 * ac * x * z + 2 * ad * x +
+           b2 * y * y + 2 * bc * y * z + 2 * bd * y +
+           c2 * z * z + 2 * cd * z + d2)
+    if weight <= 0:
+        return max(err, 0.0)
+    return max(err / weight, 0.0)
+
+
+class Simplifier:
+    """Simplifies the triangles of a PackedLOD by edge collapses.
+
+    Call simplify with a target triangle count as many times as needed, with
+    decreasing targets. Each call continues from the previous one, and
+    returns a new PackedLOD."""
+
+    def __init__(self, packed):
+        if not isinstance(packed, iff_mesh.PackedLOD):
+            raise TypeError("The mesh to simplify must be a PackedLOD!")
+        self.source = packed
+        self.pos = [packed.vertex(vidx) for vidx in range(packed.num_verts)]
+
+        # Triangles, as lists of three corners. A corner is a FVRT index of
+        # the source mesh; the vertex of a corner changes as vertices are
+        # collapsed, so it is stored separately.
+        self.tri_face = []  # Source face index
+        self.tri_verts = []  # [v0, v1, v2]
+        self.tri_uvs = []  # [(u, v), (u, v), (u, v)]
+        uvs = packed.fvrt_uvs
+        for face_idx in range(packed.num_faces):
+            fvrts = packed.face_fvrts(face_idx)
+            for corner in range(1, len(fvrts) - 1):
+                tri = (fvrts[0], fvrts[corner], fvrts[corner + 1])
+                self.tri_face.append(face_idx)
+                self.tri_verts.append([packed.fvrt_verts[fv] for fv in tri])
+                self.tri_uvs.append([(uvs[fv * 2], uvs[fv * 2 + 1])
+                                     for fv in tri])
+        self.tri_alive = [True] * len(self.tri_verts)
+        self.num_tris = len(self.tri_verts)
+
+        # Triangles using each vertex
+        self.vert_tris = [set() for vidx in range(len(self.pos))]
+        for tri_idx, tri in enumerate(self.tri_verts):
+            for vidx in tri:
+                self.vert_tris[vidx].add(tri_idx)
+
+        self.error = 0.0
+        self.num_collapses = 0
+        self._init_quadrics()
+        self._init_heap()
+
+    def _material(self, tri_idx):
+        face_idx = self.tri_face[tri_idx]
+        return (self.source.face_texnums[face_idx],
+                self.source.face_lflags[face_idx])
+
+    def _corner_uv(self, tri_idx, vidx):
+        return self.tri_uvs[tri_idx][self.tri_verts[tri_idx].index(vidx)]
+
+    def _tri_normal(self, tri_idx, moved=None, new_pos=None):
+        "Normal (not normalized) of a triangle, with an optional vertex moved."
+        pts = [new_pos if vidx == moved else self.pos[vidx]
+               for vidx in self.tri_verts[tri_idx]]
+        return _cross(_sub(pts[1], pts[0]), _sub(pts[2], pts[0]))
+
+    def edge_tris(self, va, vb):
+        "Living triangles using the edge between va and vb."
+        return self.vert_tris[va] & self.vert_tris[vb]
+
+    def is_feature_edge(self, va, vb):
+        """Check whether an edge is a feature edge.
+
+        An edge is a feature edge if it is on the border of the mesh, if it
+        is shared by more than two triangles, or if its triangles have
+        different materials or UV coordinates along the edge."""
+        tris = list(self.edge_tris(va, vb))
+        if len(tris) != 2:
+            return True
+        ta, tb = tris
+        if self._material(ta) != self._material(tb):
+            return True
+        return (self._corner_uv(ta, va) != self._corner_uv(tb, va) or
+                self._corner_uv(ta, vb) != self._corner_uv(tb, vb))
+
+    def neighbours(self, vidx):
+        "Vertices that share an edge with a vertex."
+        nbrs = set()
+        for tri_idx in self.vert_tris[vidx]:
+            nbrs.update(self.tri_verts[tri_idx])
+        nbrs.discard(vidx)
+        return nbrs
+
+    def feature_edges(self, vidx):
+        "Vertices at the other ends of the feature edges of a vertex."
+        return [nbr for nbr in self.neighbours(vidx)
+                if self.is_feature_edge(vidx, nbr)]
+
+    def _init_quadrics(self):
+        zero = (0.0,) * 11
+        self.quadrics = [zero] * len(self.pos)
+        for tri_idx, tri in enumerate(self.tri_verts):
+            normal = self._tri_normal(tri_idx)
+            nlen = sqrt(_dot(normal, normal))
+            if nlen < 1e-12:
+                continue
+            nx, ny, nz = (c / nlen for c in normal)
+            d = -_dot((nx, ny, nz), self.pos[tri[0]])
+            quad = _plane_quadric(nx, ny, nz, d, nlen / 2)
+            for vidx in tri:
+                self.quadrics[vidx] = _add_quadric(self.quadrics[vidx], quad)
+
+        # Feature edges get planes perpendicular to their triangles.
+        for tri_idx, tri in enumerate(self.tri_verts):
+            normal = self._tri_normal(tri_idx)
+            nlen = sqrt(_dot(normal, normal))
+            if nlen < 1e-12:
+                continue
+            normal = tuple(c / nlen for c in normal)
+            for corner in range(3):
+                va = tri[corner]
+                vb = tri[(corner + 1) % 3]
+                if not self.is_feature_edge(va, vb):
+                    continue
+                edge = _sub(self.pos[vb], self.pos[va])
+                elen2 = _dot(edge, edge)
+                perp = _cross(edge, normal)
+                plen = sqrt(_dot(perp, perp))
+                if plen < 1e-12:
+                    continue
+                px, py, pz = (c / plen for c in perp)
+                d = -_dot((px, py, pz), self.pos[va])
+                quad = _plane_quadric(px, py, pz, d, elen2 * FEATURE_WEIGHT)
+                for vidx in (va, vb):
+                    self.quadrics[vidx] = _add_quadric(
+                        self.quadrics[vidx], quad)
+
+    def _init_heap(self):
+        self.version = [0] * len(self.pos)
+        self.heap = []
+        edges = set()
+        for tri in self.tri_verts:
+            for corner in range(3):
+                va = tri[corner]
+                vb = tri[(corner + 1) % 3]
+                edges.add((min(va, vb), max(va, vb)))
+        for va, vb in sorted(edges):
+            self._push_edge(va, vb)
+
+    def _push_edge(self, va, vb):
+        "Queue the cheapest direction of collapse for an edge."
+        quad = _add_quadric(self.quadrics[va], self.quadrics[vb])
+        for src, dst in ((va, vb), (vb, va)):
+            cost = _quadric_error(quad, self.pos[dst])
+            heapq.heappush(self.heap, (cost, src, dst, self.version[src],
+                                       self.version[dst]))
+
+    def can_collapse(self, src, dst):
+        """Check whether src can be moved onto dst.
+
+        The collapse must keep the mesh manifold, must not flip or
+        degenerate any triangles, and must keep feature edges (borders,
+        seams, and material boundaries) in place."""
+        shared = self.edge_tris(src, dst)
+        if len(shared) == 0:
+            return False
+
+        # Features: a vertex on one feature line can only slide along it,
+        # and a vertex on more than one (a corner) is locked.
+        src_features = self.feature_edges(src)
+        if src_features:
+            if len(src_features) != 2 or dst not in src_features:
+                return False
+
+        # Link condition: the only vertices adjacent to both src and dst
+        # are the opposite vertices of the triangles using the edge.
+        opposite = set()
+        for tri_idx in shared:
+            opposite.update(self.tri_verts[tri_idx])
+        opposite.discard(src)
+        opposite.discard(dst)
+        if self.neighbours(src) & self.neighbours(dst) != opposite:
+            return False
+
+        # Each UV chart around src must contain dst, so that the corners of
+        # src can take dst's UV coordinates from the same chart.
+        if self._src_uvs(src, dst) is None:
+            return False
+
+        # The remaining triangles must not flip or degenerate.
+        new_pos = self.pos[dst]
+        for tri_idx in self.vert_tris[src] - shared:
+            old_n = self._tri_normal(tri_idx)
+            new_n = self._tri_normal(tri_idx, src, new_pos)
+            old_len = sqrt(_dot(old_n, old_n))
+            new_len = sqrt(_dot(new_n, new_n))
+            if new_len < 1e-12:
+                return False
+            if old_len > 1e-12 and (_dot(old_n, new_n) <
+                                    MIN_NORMAL_COS * old_len * new_len):
+                return False
+        return True
+
+    def _src_uvs(self, src, dst):
+        """Get the new UV coordinates for the corners of src.
+
+        The triangles around src are grouped into charts (triangles sharing
+        an edge of src with the same material and UVs). Returns a dict of
+        triangle index to dst's UV coordinates in its chart, or None if a
+        chart does not touch dst."""
+        tris = self.vert_tris[src]
+        chart_of = {}
+        charts = []
+        for tri_idx in tris:
+            if tri_idx in chart_of:
+                continue
+            chart = [tri_idx]
+            chart_of[tri_idx] = len(charts)
+            stack = [tri_idx]
+            while stack:
+                cur = stack.pop()
+                for vidx in self.tri_verts[cur]:
+                    if vidx == src:
+                        continue
+                    for other in self.edge_tris(src, vidx) & tris:
+                        if (other in chart_of or
+                                self.is_feature_edge(src, vidx)):
+                            continue
+                        chart_of[other] = chart_of[tri_idx]
+                        chart.append(other)
+                        stack.append(other)
+            charts.append(chart)
+
+        shared = self.edge_tris(src, dst)
+        new_uvs = {}
+        for chart in charts:
+            dst_tris = [tri_idx for tri_idx in chart if tri_idx in shared]
+            if not dst_tris:
+                return None
+            uv = self._corner_uv(dst_tris[0], dst)
+            for tri_idx in chart:
+                new_uvs[tri_idx] = uv
+        return new_uvs
+
+    def collapse(self, src, dst):
+        "Move src onto dst, removing the triangles using the edge."
+        new_uvs = self._src_uvs(src, dst)
+        cost = _quadric_error(
+            _add_quadric(self.quadrics[src], self.quadrics[dst]),
+            self.pos[dst])
+        self.error = max(self.error, sqrt(cost))
+
+        for tri_idx in self.edge_tris(src, dst):
+            self.tri_alive[tri_idx] = False
+            self.num_tris -= 1
+            for vidx in self.tri_verts[tri_idx]:
+                self.vert_tris[vidx].discard(tri_idx)
+
+        for tri_idx in self.vert_tris[src]:
+            corner = self.tri_verts[tri_idx].index(src)
+            self.tri_verts[tri_idx][corner] = dst
+            self.tri_uvs[tri_idx][corner] = new_uvs[tri_idx]
+            self.vert_tris[dst].add(tri_idx)
+        self.vert_tris[src] = set()
+
+        self.quadrics[dst] = _add_quadric(self.quadrics[src],
+                                          self.quadrics[dst])
+        self.version[src] += 1
+        self.version[dst] += 1
+        for nbr in self.neighbours(dst):
+            self._push_edge(dst, nbr)
+        self.num_collapses += 1
+
+    def simplify(self, target_tris, max_error=None):
+        """Collapse edges until there are no more than target_tris triangles.
+
+        Stops early if the heap runs out of valid collapses, or if the next
+        collapse would exceed max_error. Returns a PackedLOD."""
+        while self.num_tris > target_tris and self.heap:
+            cost, src, dst, src_ver, dst_ver = heapq.heappop(self.heap)
+            if (self.version[src] != src_ver or
+                    self.version[dst] != dst_ver):
+                continue  # Stale entry
+            if max_error is not None and sqrt(cost) > max_error:
+                heapq.heappush(self.heap, (cost, src, dst, src_ver,
+                                           dst_ver))
+                break
+            if not self.can_collapse(src, dst):
+                continue
+            self.collapse(src, dst)
+        return self.to_packed()
+
+    def to_packed(self):
+        """Convert the current state of the mesh to a PackedLOD.
+
+        Unused vertices are removed, and normals are recalculated. Smooth
+        faces use area-weighted vertex normals."""
+        packed = iff_mesh.PackedLOD()
+        source = self.source
+        alive = [tri_idx for tri_idx in range(len(self.tri_verts))
+                 if self.tri_alive[tri_idx]]
+
+        new_vidx = {}
+        for tri_idx in alive:
+            for vidx in self.tri_verts[tri_idx]:
+                if vidx not in new_vidx:
+                    new_vidx[vidx] = None
+        for vidx in sorted(new_vidx):
+            new_vidx[vidx] = packed.add_vertex(*self.pos[vidx])
+
+        vert_normals = {}
+        for tri_idx in alive:
+            if not source.face_smooth[self.tri_face[tri_idx]]:
+                continue
+            normal = self._tri_normal(tri_idx)
+            for vidx in self.tri_verts[tri_idx]:
+                vn = vert_normals.get(vidx, (0.0, 0.0, 0.0))
+                vert_normals[vidx] = (vn[0] + normal[0], vn[1] + normal[1],
+                                      vn[2] + normal[2])
+
+        def normalize(vec):
+            vlen = sqrt(_dot(vec, vec))
+            if vlen < 1e-12:
+                return (0.0, 0.0, 1.0)
+            return (vec[0] / vlen, vec[1] / vlen, vec[2] / vlen)
+
+        for tri_idx in alive:
+            face_idx = self.tri_face[tri_idx]
+            smooth = source.face_smooth[face_idx]
+            tri = self.tri_verts[tri_idx]
+            if smooth:
+                for vidx in tri:
+                    packed.add_normal(*normalize(vert_normals[vidx]))
+            fnrm = normalize(self._tri_normal(tri_idx))
+            fnrm_idx = packed.add_normal(*fnrm)
+            fvrts = []
+            for vidx, (u, v) in zip(tri, self.tri_uvs[tri_idx]):
+                if smooth:
+                    vtnm_idx = packed.add_normal(
+                        *normalize(vert_normals[vidx]))
+                else:
+                    vtnm_idx = fnrm_idx
+                fvrts.append((new_vidx[vidx], vtnm_idx, u, v))
+            dplane = -_dot(fnrm, self.pos[tri[0]])
+            packed.add_face(fnrm_idx, dplane, source.face_texnums[face_idx],
+                            fvrts, source.face_lflags[face_idx], smooth)
+        return packed
+
+
+def count_tris(packed):
+    "Number of triangles in a PackedLOD, after splitting its faces."
+    return sum(max(0, nverts - 2) for nverts in packed.face_nverts)
+
+
+def make_lods(packed, ratios, max_error=None):
+    """Make simplified LODs from a PackedLOD.
+
+    ratios is a sequence of target triangle counts, as fractions of the
+    triangle count of the original mesh, in decreasing order. Returns a list
+    of (PackedLOD, error, seconds) tuples, one for each ratio. The error is
+    the square root of the largest quadric error of any collapse so far, in
+    model units."""
+    start = time.perf_counter()
+    simplifier = Simplifier(packed)
+    full_tris = simplifier.num_tris
+    lods = []
+    for ratio in ratios:
+        if not 0 < ratio <= 1:
+            raise ValueError("LOD ratios must be between 0 and 1!")
+        lod = simplifier.simplify(int(full_tris * ratio), max_error)
+        lods.append((lod, simplifier.error, time.perf_counter() - start))
+    return lods
+
+
+def fmt_lod_report(packed, lods):
+    "Format the results of make_lods as a string."
+    lines = ["LOD 0: {} triangles".format(count_tris(packed))]
+    for lod_idx, (lod, error, elapsed) in enumerate(lods, 1):
+        lines.append("LOD {}: {} triangles, {} vertices, error {:.4f}, "
+                     "{:.2f} seconds".format(lod_idx, count_tris(lod),
+                                             lod.num_verts, error, elapsed))
+    return "\n".join(lines)
@@ -0,0 +1,140 @@
+# -*- coding: utf8 -*-
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+
+# Export cache, used to skip models that have not changed since the last
+# export.
+#
+# The cache is a JSON file in the folder the models are exported to. It
+# maps the name of each model file to the fingerprint of the data it was
+# exported from, and, if the model was identical to another model, the
+# name of that model's file.
+import hashlib
+import json
+import os
+
+CACHE_FNAME = "wcp_export_cache.json"
+CACHE_VERSION = 1  # The layout of the cache file
+# Change this when models would be exported differently from the same data
+EXPORTER_VERSION = 1
+
+_source_hash = None
+
+
+def exporter_version():
+    """Identify the version of the exporter, to salt fingerprints with.
+
+    Besides EXPORTER_VERSION, it includes a hash of the add-on's source
+    files, so models are exported again after the add-on is upgraded."""
+    global _source_hash
+    if _source_hash is None:
+        digest = hashlib.sha1()
+        srcdir = os.path.dirname(os.path.abspath(__file__))
+        for fname in sorted(os.listdir(srcdir)):
+            if not fname.endswith(".py"):
+                continue
+            try:
+                with open(os.path.join(srcdir, fname), "rb") as src_file:
+                    digest.update(fname.encode("utf-8"))
+                    digest.update(src_file.read())
+            except OSError:
+                continue
+        _source_hash = digest.hexdigest()
+    return EXPORTER_VERSION, _source_hash
+
+
+class Fingerprint:
+    "Incrementally hashes the data a model is exported from."
+
+    def __init__(self):
+        self._hash = hashlib.sha1()
+
+    def add(self, *values):
+        """Add some values to the fingerprint.
+
+        Values are added by their repr, so they should be basic Python
+        types, or tuples or lists of them."""
+        self._hash.update(repr(values).encode("utf-8"))
+
+    def add_bytes(self, data):
+        "Add binary data (ex. an array.array) to the fingerprint."
+        data = bytes(data)
+        self.add(len(data))
+        self._hash.update(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+class ExportCache:
+    """The export cache for a folder.
+
+    Models are looked up and stored by their export filename (without the
+    .iff extension)."""
+
+    def __init__(self, modeldir):
+        self.modeldir = modeldir
+        self.path = os.path.join(modeldir, CACHE_FNAME)
+        self.models = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as cache_file:
+                data = json.load(cache_file)
+        except (OSError, ValueError):
+            data = None
+        if isinstance(data, dict) and data.get("version") == CACHE_VERSION:
+            self.models = data.get("models", {})
+
+    def _model_exists(self, exp_fname):
+        return os.path.isfile(os.path.join(self.modeldir, exp_fname + ".iff"))
+
+    def lookup(self, exp_fname, fingerprint, current=None):
+        """Check whether a model is up to date.
+
+        Returns None if the model has to be exported. Otherwise, returns
+        the name of the model file that holds the model, which is exp_fname
+        itself, unless the model was identical to another one. In that
+        case, the other model must also be up to date, according to
+        current, a dict mapping export filenames to their fingerprints for
+        this export."""
+        entry = self.models.get(exp_fname)
+        if entry is None or entry.get("fingerprint") != fingerprint:
+            return None
+        alias = entry.get("alias")
+        if alias is not None:
+            alias_entry = self.models.get(alias)
+            if (alias_entry is None or alias_entry.get("alias") is not None
+                    or current is None or current.get(alias) is None or
+                    current[alias] != alias_entry.get("fingerprint")):
+                return None
+        model_file = alias or exp_fname
+        if not self._model_exists(model_file):
+            return None
+        return model_file
+
+    def update(self, exp_fname, fingerprint, alias=None):
+        "Record the fingerprint a model was exported from."
+        self.models[exp_fname] = {"fingerprint": fingerprint, "alias": alias}
+
+    def save(self):
+        "Write the cache file."
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as cache_file:
+            json.dump({"version": CACHE_VERSION, "models": self.models},
+                      cache_file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -24,8 +24,10 @@ import warnings
 import re
 import array
 import time
+import os
 from os import sep as dirsep
-from . import iff_mesh
+from . import (iff_mesh, bounds, bsp, mesh_opt, serialize, export_cache,
+               texreg, mat_write, texbuild, palgen, atlas, workers)
 from math import radians
 from collections import OrderedDict
 from itertools import repeat, starmap
@@ -93,7 +95,12 @@ class ModelManager:
 
     def __init__(self, base_name, base_obj, use_facetex, drang_increment,
                  far_chunk, modeldir, gen_bsp, scene_name, wc_matrix,
-                 test_run):
+                 test_run, workers=1, bsp_regions=False, auto_lods=0,
+                 auto_lod_ratio=0.5, range_solver=False, pixel_tolerance=1.0,
+                 lod_fov=60.0, lod_resolution=768, merge_coplanar=False,
+                 compact_meshes=False, weld_distance=0.0001,
+                 reorder_faces=False, normal_tolerance=0.0, use_atlas=False,
+                 atlas_size=1024, lod_textures=0, sphere_report=False):
 
         if not isinstance(base_name, str):
             raise TypeError("Model name must be a string!")
@@ -136,20 +143,64 @@ class ModelManager:
         self.dranges[0] = 0.0
         self.drang_increment = drang_increment
         self.far_chunk = far_chunk
+        # LOD ranges set by the user, with None for the ones to calculate
+        self.drange_fixed = None
+        # Calculate LOD ranges from the error of each LOD. A LOD is used
+        # once its error is within pixel_tolerance pixels, for a vertical
+        # FOV of lod_fov degrees and a screen lod_resolution pixels high.
+        self.range_solver = range_solver
+        self.pixel_tolerance = pixel_tolerance
+        self.lod_fov = lod_fov
+        self.lod_resolution = lod_resolution
+
+        # Export-time optimization passes for the LOD meshes
+        self.merge_coplanar = merge_coplanar  # Merge coplanar faces
+        # Remove unused vertices and normals, and weld the vertices that are
+        # within weld_distance of each other.
+        self.compact_meshes = compact_meshes
+        self.weld_distance = weld_distance
+        # Sort faces by texture and position
+        self.reorder_faces = reorder_faces
+        # Merge normals within normal_tolerance degrees of each other
+        self.normal_tolerance = normal_tolerance
 
         # CNTR/RADI spheres for each LOD.
         self.dsphrs = [None for x in range(MAX_NUM_LODS)]
+
+        # Generated LODs. If the model only has a LOD 0, auto_lods LODs are
+        # made by simplifying it, each with auto_lod_ratio times as many
+        # triangles as the one before it.
+        self.auto_lods = auto_lods
+        self.auto_lod_ratio = auto_lod_ratio
+        self.num_gen_lods = 0
         # Collider (Collision sphere/BSP stuff)
         self.gen_bsp = gen_bsp
+        self.bsp_regions = bsp_regions  # Generate a blockmap for the BSP
         self.collider = None  # COLL form
+        self.collmesh = None  # Name of BSP collision mesh object
 
         # Material/texture stuff
         self.use_mtltex = not use_facetex
         self.mtltexs = OrderedDict()  # Material -> texnum dict
         self.image_txns = OrderedDict()  # Images used by face textures.
+        # Pack the images into texture atlases of at most atlas_size pixels
+        # square, each with its own texture number.
+        self.use_atlas = use_atlas
+        self.atlas_size = atlas_size
+        self.atlases = []
+        self.atlas_txns = []
+        # LODs from lod_textures on (if it is not 0) use downscaled copies
+        # of the textures, halved once more for each LOD.
+        self.lod_textures = lod_textures
+        self.variants = OrderedDict()  # Name -> (texture name, times halved)
+        self.lod_variants = []  # Texture name -> variant name, for each LOD
+        self.variant_txns = OrderedDict()
 
         # Misc fields
         self.test_run = test_run
+        # Compare the bounding sphere methods for each LOD
+        self.sphere_report = sphere_report
+        self.workers = workers  # Number of worker processes (0 = per CPU)
         self.setup_complete = False
 
     def _get_lod(self, lod_obj, base=False):
@@ -209,6 +260,41 @@ class ModelManager:
 
         return valid_slots
 
+    def lod_coords(self, lod_idx):
+        """Get the vertex coordinates of a LOD mesh, as they are exported.
+
+        Returns a flat array of floats (x, y, z, x, y, z, ...), in VISION
+        engine coordinates."""
+        return mesh_coords(self.lodms[lod_idx])
+
+    def coll_polys(self):
+        """Get the packed polygon set used to build the BSP tree.
+
+        The polygons are taken from the collision mesh object (collmesh) if
+        there is one. Otherwise, they are taken from LOD 0. Returns a flat
+        vertex array in VISION engine coordinates, and a list of polygons,
+        each of which is a tuple of vertex indices."""
+        scene = bpy.data.scenes[self.scene]
+        if self.collmesh is not None:
+            cobj = scene.objects[self.collmesh]
+            cmesh = cobj.to_mesh(scene, True, "PREVIEW")
+            cmesh.transform(self.wc_matrix.to_4x4() * cobj.matrix_local)
+            cmesh.calc_tessface()
+        elif self.lodms[0] is not None:
+            cmesh = self.lodms[0]
+        else:
+            raise TypeError("LOD 0 must be a mesh in order to generate a BSP "
+                            "tree from it!")
+
+        coords = mesh_coords(cmesh)
+        # Vertex order is reversed, like it is for the FVRTs, since the X
+        # axis is mirrored.
+        polys = [tuple(reversed(tf.vertices)) for tf in cmesh.tessfaces]
+
+        if self.collmesh is not None:
+            bpy.data.meshes.remove(cmesh)
+        return coords, polys
+
     def setup(self):
         print(banner(self.modelname))
         # Scan for valid LOD objects related to the base LOD object
@@ -278,6 +364,7 @@ class ModelManager:
         # The collider for the lowest (most detailed) LOD takes precedence over
         # colliders for other LODs, and a model can only have one collider.
         collider_lod = MAX_NUM_LODS + 1
+        collmesh_lod = MAX_NUM_LODS + 1
 
         # LOD ranges can be either a custom property of the LOD object, or the
         # name of an empty object parented to said LOD object. The custom
@@ -345,10 +432,32 @@ class ModelManager:
                         self.hardpoints.append(hardpt)
                         self.hpobnames.append(cobj.name)
 
+                elif (cobj.type == "MESH" and cobj.hide is False and
+                      cobj.name.lower().startswith(self.COLLMESH_PFX)):
+                    # BSP collision mesh object
+                    if lod < collmesh_lod:
+                        self.collmesh = cobj.name
+                        collmesh_lod = lod
+
         del collider_lod
+        del collmesh_lod
         del drange_prop
 
+        if self.auto_lods > 0:
+            lod0_obj = bpy.data.scenes[self.scene].objects[self.lods[0]]
+            if len(self.lods) == 1 and lod0_obj.type == "MESH":
+                self.num_gen_lods = min(self.auto_lods, MAX_NUM_LODS - 1)
+                self.dranges.extend(repeat(None, self.num_gen_lods))
+                self.dsphrs.extend(repeat(None, self.num_gen_lods))
+                self.lod_empty.extend(repeat(False, self.num_gen_lods))
+                print("Generating {} LODs from LOD 0.".format(
+                    self.num_gen_lods))
+            else:
+                print("Not generating LODs, since {} has more than one LOD."
+                      .format(self.modelname))
+
         print("dranges (b4):", self.dranges)
+        self.drange_fixed = list(self.dranges)
 
         # Fill in blank LOD ranges
         for dr_idxa in range(len(self.dranges)):
@@ -392,22 +501,6 @@ class ModelManager:
 
         print("dranges (after):", self.dranges)
 
-        # Generate CNTR/RADI data for each LOD where it does not exist.
-        for lod_idx in range(len(self.dsphrs)):
-            if self.dsphrs[lod_idx] is None:
-                lod_obj = (bpy.data.scenes[self.scene]
-                           .objects[self.lods[lod_idx]])
-
-                dsphr_vec = lod_obj.location.copy()
-                dsphr_vec.rotate(self.wc_matrix)
-
-                x, y, z = dsphr_vec
-                x *= -1
-                r = max(lod_obj.dimensions) / 2
-                self.dsphrs[lod_idx] = iff_mesh.Sphere(x, z, y, r)
-
-            print("LOD {} CNTR/RADI: {}".format(lod_idx, self.dsphrs[lod_idx]))
-
         # Ensure there are no hardpoint name conflicts
         hpnames = []
         for hp in self.hardpoints:
@@ -423,46 +516,23 @@ class ModelManager:
         for hp, hpob in zip(self.hardpoints, self.hpobnames):
             print(hp, ": ({})".format(hpob))
 
-        # Generate the collider for this model if it doesn't exist.
-        if self.collider is None:
-            lod_obj = bpy.data.scenes[self.scene].objects[self.lods[0]]
-            coll_vec = lod_obj.location.copy()
-            coll_vec.rotate(self.wc_matrix)
-
-            x, y, z = coll_vec
-            x *= -1
-            r = max(lod_obj.dimensions) / 2
-            self.collider = iff_mesh.Collider(
-                "sphere", iff_mesh.Sphere(x, z, y, r)
-            )
-
-        print("Collider:", self.collider)
-
-        # Convert all LOD objects to meshes to populate the LOD mesh list.
-        for lidx, lod in enumerate(self.lods):
-            try:
-                self.lodms.append(
-                    bpy.data.scenes[self.scene].objects[lod].to_mesh(
-                        bpy.data.scenes[self.scene], True, "PREVIEW")
-                )
-            except RuntimeError:
-                print("Object {} is an empty.".format(lod))
-                self.lod_empty[lidx] = True
-
-        # Get the textures used by all LODs for this model
+        # Get the textures used by all LODs for this model. This only looks
+        # at the original mesh data of each LOD object, so that the LOD
+        # meshes do not have to be evaluated until the model is exported.
+        scene = bpy.data.scenes[self.scene]
+        lod_meshes = [scene.objects[lod].data for lod in self.lods
+                      if scene.objects[lod].type == "MESH"]
         used_materials = []
-        for lodm in self.lodms:
-            lodm.transform(self.wc_matrix.to_4x4())
-            lodm.calc_normals()
-            lodm.calc_tessface()
-            # tf_mtl = None  # The material for this tessface
-            # tf_mlf = 0  # The light flags for this tessface
-            # tf_mtf = False  # Is the material a flat colour
-            for tf in lodm.tessfaces:
+        for lod_mesh in lod_meshes:
+            mtl_idxs = array.array("i", bytes(len(lod_mesh.polygons) * 4))
+            lod_mesh.polygons.foreach_get("material_index", mtl_idxs)
+            for mtl_idx in OrderedDict.fromkeys(mtl_idxs):
                 # Ensure material for this face exists
                 try:
-                    tf_mtl = lodm.materials[tf.material_index]
+                    tf_mtl = lod_mesh.materials[mtl_idx]
                 except IndexError:
+                    tf_mtl = None
+                if tf_mtl is None:
                     raise ValueError("You must have a valid material "
                                      "assigned to each face!")
 
@@ -497,9 +567,8 @@ class ModelManager:
         del used_materials
 
         if not self.use_mtltex:
-            for lodm in self.lodms:
-                for tf, tfuv in zip(lodm.tessfaces,
-                                    lodm.tessface_uv_textures.active.data):
+            for lod_mesh in lod_meshes:
+                for tfuv in lod_mesh.uv_textures.active.data:
                     if (tfuv.image is not None and tfuv.image.filepath not in
                             self.image_txns):
                         self.image_txns[tfuv.image.filepath] = None
@@ -508,12 +577,171 @@ class ModelManager:
         for mtl, mtx in self.mtltexs.items():
             print("{}: {} (Light flags: {})".format(mtl, mtx[1], mtx[0]))
 
+        if self.use_atlas:
+            self.plan_atlases(lod_meshes)
+        if self.lod_textures > 0:
+            self.plan_variants()
+
         self.setup_complete = True
 
+    def poly_image(self, lod_mesh, poly_idx, mtl_idx):
+        "Get the texture image filename of a polygon, or None."
+        if not self.use_mtltex:
+            tfuv = lod_mesh.uv_textures.active.data[poly_idx]
+            if tfuv.image is not None:
+                return tfuv.image.filepath
+        img = self.mtltexs[lod_mesh.materials[mtl_idx].name][1]
+        return None if isinstance(img, int) else img
+
+    def plan_atlases(self, lod_meshes):
+        """Decide which images go in which texture atlas.
+
+        Images that are mapped to a polygon with UVs that wrap around the
+        image are left out, since that polygon could not use the atlas."""
+        wrapping = set()
+        for lod_mesh in lod_meshes:
+            if lod_mesh.uv_layers.active is None:
+                continue
+            uvs = array.array("f", bytes(len(lod_mesh.loops) * 8))
+            lod_mesh.uv_layers.active.data.foreach_get("uv", uvs)
+            poly_data = []
+            for attr in ("loop_start", "loop_total", "material_index"):
+                values = array.array("i", bytes(len(lod_mesh.polygons) * 4))
+                lod_mesh.polygons.foreach_get(attr, values)
+                poly_data.append(values)
+            for poly_idx, (start, total, mtl_idx) in enumerate(
+                    zip(*poly_data)):
+                if not atlas.uvs_in_range(uvs[start * 2:(start + total) * 2]):
+                    wrapping.add(self.poly_image(lod_mesh, poly_idx, mtl_idx))
+        sizes = OrderedDict()
+        for img_fname in self.get_images():
+            image = image_for(img_fname)
+            if img_fname not in wrapping and image is not None:
+                sizes[img_fname] = tuple(image.size)
+        self.atlases = atlas.pack_atlases(sizes, self.atlas_size)
+        wrapping.discard(None)
+        if wrapping:
+            print("Images with wrapping UVs (not in an atlas):")
+            print("\n".join(sorted(wrapping)))
+        for tex_atlas in self.atlases:
+            print(tex_atlas)
+
+    def plan_variants(self):
+        "Decide which downscaled textures each LOD uses."
+        sizes = OrderedDict()
+        for img_fname in self.get_images():
+            image = image_for(img_fname)
+            if image is not None and 0 not in image.size:
+                sizes[img_fname] = tuple(image.size)
+        for tex_atlas in self.atlases:
+            sizes[tex_atlas.name] = tex_atlas.width, tex_atlas.height
+        self.lod_variants = [OrderedDict() for drange in self.dranges]
+        for lodi in range(self.lod_textures, len(self.dranges)):
+            for name, (width, height) in sizes.items():
+                level = texbuild.variant_level(
+                    width, height, lodi - self.lod_textures + 1)
+                if level > 0:
+                    variant = texbuild.variant_name(name, level)
+                    self.variants[variant] = name, level
+                    self.lod_variants[lodi][name] = variant
+
+    def load_meshes(self):
+        """Evaluate the LOD meshes, and calculate the data that depends on
+        them, like the CNTR/RADI spheres and the collider.
+
+        The meshes should be freed with free_meshes once the model has been
+        extracted."""
+        if not self.setup_complete:
+            raise ValueError("You must set the model up first!")
+
+        # Convert all LOD objects to meshes to populate the LOD mesh list.
+        # Empty LODs have None in place of a mesh, so that the LOD mesh list
+        # lines up with the LOD object list.
+        for lidx, lod in enumerate(self.lods):
+            try:
+                self.lodms.append(
+                    bpy.data.scenes[self.scene].objects[lod].to_mesh(
+                        bpy.data.scenes[self.scene], True, "PREVIEW")
+                )
+            except RuntimeError:
+                print("Object {} is an empty.".format(lod))
+                self.lodms.append(None)
+                self.lod_empty[lidx] = True
+
+        for lodm in self.lodms:
+            if lodm is None:
+                continue
+            lodm.transform(self.wc_matrix.to_4x4())
+            lodm.calc_normals()
+            lodm.calc_tessface()
+
+        # Generate CNTR/RADI data for each LOD where it does not exist.
+        all_coords = array.array("f")
+        for lod_idx in range(len(self.lods)):
+            if self.lod_empty[lod_idx]:
+                if self.dsphrs[lod_idx] is None:
+                    lod_obj = (bpy.data.scenes[self.scene]
+                               .objects[self.lods[lod_idx]])
+                    self.dsphrs[lod_idx] = iff_mesh.Sphere(0, 0, 0, max(
+                        lod_obj.dimensions) / 2)
+                continue
+
+            lod_coords = self.lod_coords(lod_idx)
+            all_coords.extend(lod_coords)
+            if self.dsphrs[lod_idx] is None:
+                self.dsphrs[lod_idx] = iff_mesh.Sphere(
+                    *bounds.exact_sphere(lod_coords))
+
+            print("LOD {} CNTR/RADI: {}".format(lod_idx, self.dsphrs[lod_idx]))
+            if self.test_run or self.sphere_report:
+                # The sphere older versions of the exporter used
+                lod_obj = (bpy.data.scenes[self.scene]
+                           .objects[self.lods[lod_idx]])
+                old_sphere = (0, 0, 0, max(lod_obj.dimensions) / 2)
+                print(bounds.fmt_sphere_report(bounds.sphere_report(
+                    lod_coords, old_sphere)))
+
+        # Generate the collider for this model if it doesn't exist. The
+        # collision sphere encloses every exported LOD.
+        if self.collider is None:
+            if len(all_coords) > 0:
+                coll_sphr = iff_mesh.Sphere(*bounds.exact_sphere(all_coords))
+            else:
+                coll_sphr = iff_mesh.Sphere(*self.dsphrs[0].to_tuple())
+            self.collider = iff_mesh.Collider("sphere", coll_sphr)
+
+        if self.gen_bsp:
+            bsp_tree = bsp.BSPTree(*self.coll_polys(), workers=self.workers)
+            print(bsp_tree.fmt_stats())
+            if self.bsp_regions:
+                blockmap = bsp.Blockmap(bsp_tree)
+                print(blockmap.fmt_stats())
+                self.collider = iff_mesh.Collider(
+                    "bsp+region", self.collider.data[0], bsp_tree, blockmap)
+            else:
+                self.collider = iff_mesh.Collider(
+                    "bsp", self.collider.data[0], bsp_tree)
+
+        print("Collider:", self.collider)
+        del all_coords
+
+    def free_meshes(self):
+        "Remove the evaluated LOD meshes from Blender."
+        for lodm in self.lodms:
+            if lodm is not None:
+                bpy.data.meshes.remove(lodm)
+        self.lodms = []
+
     def get_materials(self):
         if not self.setup_complete:
             raise ValueError("You must set the model up first!")
 
+        return (self.get_images() +
+                [tex_atlas.name for tex_atlas in self.atlases] +
+                list(self.variants.keys()))
+
+    def get_images(self):
+        "Get the texture image filenames used by this model."
         if self.use_mtltex:
             used_textures = []
             for mtex in self.mtltexs.values():
@@ -523,7 +751,7 @@ class ModelManager:
 
             return used_textures
         else:
-            return self.image_txns.keys()
+            return list(self.image_txns.keys())
 
     def mtls_for_img(self, img_fname):
         for mtl, mtldata in self.mtltexs.items():
@@ -542,6 +770,38 @@ class ModelManager:
                 if img in self.image_txns.keys():
                     print("Assigning {} to {}...".format(txnm, img))
                     self.image_txns[img] = txnm
+        self.atlas_txns = [mtltxns[tex_atlas.name]
+                           for tex_atlas in self.atlases]
+        self.variant_txns = OrderedDict(
+            (variant, mtltxns[variant]) for variant in self.variants)
+
+    def texture_txns(self):
+        "Map the name of each image and atlas to its texture number."
+        tex_txns = OrderedDict(self.image_txns)
+        for mtl_flags, img, txnm in self.mtltexs.values():
+            tex_txns.setdefault(img, txnm)
+        for tex_atlas, atlas_txnm in zip(self.atlases, self.atlas_txns):
+            tex_txns[tex_atlas.name] = atlas_txnm
+        return tex_txns
+
+    def atlas_remap(self):
+        """Map the texture number of each image in an atlas to the texture
+        number and UV transform of the atlas, for atlas.remap_faces."""
+        tex_txns = self.texture_txns()
+        remap = {}
+        for tex_atlas, atlas_txnm in zip(self.atlases, self.atlas_txns):
+            for img in tex_atlas.placements.keys():
+                remap[tex_txns[img]] = (atlas_txnm,
+                                        tex_atlas.uv_transform(img))
+        return remap
+
+    def lod_texnums(self):
+        """Map the texture numbers used by each LOD to the texture numbers
+        of the downscaled textures it uses instead."""
+        tex_txns = self.texture_txns()
+        return [{tex_txns[name]: self.variant_txns[variant]
+                 for name, variant in variants.items()}
+                for variants in self.lod_variants]
 
     def calc_dplane(self, vert, facenrm):
         """Calculate the D-Plane of the face.
@@ -576,106 +836,265 @@ class ModelManager:
     def exp_fname(self):
         self._exp_fname = self.modelname
 
-    def export(self):
-        modelfile = iff_mesh.ModelIff(self.modeldir + dirsep + self._exp_fname,
-                                      self.far_chunk)
-
-        modelfile.set_collider(self.collider)
-        for hardpt in self.hardpoints:
-            modelfile.add_hardpt(hardpt)
-
-        for drange, lodi in zip(self.dranges, range(len(self.lods))):
+    def pack_lod(self, lodi):
+        """Pack the geometry of a LOD mesh into a PackedLOD.
+
+        Texture numbers must have been assigned first."""
+        cur_lodm = self.lodms[lodi]
+        packed = iff_mesh.PackedLOD()
+
+        for vert in cur_lodm.vertices:
+            packed.add_vertex(vert.co.x * -1, vert.co.y, vert.co.z)
+
+        for tf, tfuv in zip(
+                cur_lodm.tessfaces,
+                cur_lodm.tessface_uv_textures.active.data):
+
+            # Get vertex normals. This depends on whether or not the
+            # faces are smooth or flat shaded.
+            if tf.use_smooth:
+                # Smooth - use individual vertex normals
+                for vert in tf.vertices:
+                    nx, ny, nz = cur_lodm.vertices[vert].normal
+                    packed.add_normal(-nx, ny, nz)
+
+            # Flat - use face normal. This normal will be added anyway,
+            # since it is referenced by the FACE chunk.
+            nx, ny, nz = tf.normal
+            fnrm_idx = packed.add_normal(-nx, ny, nz)
+
+            # Get the FVRTs for the face
+            fvrts = []
+            uv_idx = len(tf.vertices) - 1
+            for fvrt in reversed(tf.vertices):
+                if tf.use_smooth:
+                    nx, ny, nz = cur_lodm.vertices[fvrt].normal
+                    vtnm_idx = packed.add_normal(-nx, ny, nz)
+                else:
+                    vtnm_idx = fnrm_idx
+                fvrts.append((fvrt, vtnm_idx, tfuv.uv[uv_idx][0],
+                              1 - tfuv.uv[uv_idx][1]))
+                uv_idx -= 1
+            del uv_idx
+
+            # Get the texnum and light flags
+            if self.use_mtltex:
+                texnum = self.mtltexs[
+                    cur_lodm.materials[tf.material_index].name][2]
+            else:
+                if tfuv.image is not None:
+                    texnum = self.image_txns[tfuv.image.filepath]
+                else:
+                    # This should be a flat colour
+                    texnum = self.mtltexs[
+                        cur_lodm.materials[tf.material_index].name][2]
+            light_flags = self.mtltexs[
+                cur_lodm.materials[tf.material_index].name][0]
+
+            first_vert = cur_lodm.vertices[tf.vertices[-1]].co.copy()
+            first_vert.x *= -1
+
+            face_nrm = tf.normal.copy()
+            face_nrm.x *= -1
+
+            # Add the face
+            packed.add_face(
+                fnrm_idx, self.calc_dplane(first_vert, face_nrm),
+                texnum, fvrts, light_flags, tf.use_smooth)
+
+        if self.atlases:
+            moved, wrapped = atlas.remap_faces(packed, self.atlas_remap())
+            if wrapped:
+                print("LOD {}: {} faces use an atlas, and {} have wrapping "
+                      "UVs.".format(lodi, moved, wrapped))
+
+        return packed
+
+    def dedupe_key(self):
+        """A key that is the same for models that export identical files.
+
+        Models with the same key have LOD objects that use the same mesh
+        datablocks and modifier settings, and have the same materials,
+        hardpoints, LOD ranges, spheres, and collider settings. The
+        collision mesh is also placed the same way, since the BSP tree is
+        built from it after transforming it by its matrix_local. Returns None
+        if a modifier of one of the LOD objects uses another object, since
+        its result may then depend on where that object is."""
+        scene = bpy.data.scenes[self.scene]
+        lod_keys = []
+        obj_names = list(self.lods)
+        if self.collmesh is not None:
+            obj_names.append(self.collmesh)
+        for obj_name in obj_names:
+            obj = scene.objects[obj_name]
+            if obj.type != "MESH":
+                lod_keys.append(None)
+                continue
+            mod_keys = []
+            for modifier in obj.modifiers:
+                mod_key = rna_values(modifier)
+                if mod_key is None:
+                    return None
+                mod_keys.append(mod_key)
+            lod_key = (obj.data.name, tuple(mod_keys))
+            if obj_name == self.collmesh:
+                lod_key += (tuple(tuple(row) for row in obj.matrix_local),)
+            lod_keys.append(lod_key)
+
+        hardpoints = tuple(
+            (hardpt.name, tuple(tuple(row) for row in hardpt.rot_matrix),
+             tuple(hardpt.location)) for hardpt in self.hardpoints)
+        spheres = tuple(sphere and sphere.to_tuple()
+                        for sphere in self.dsphrs)
+        collider = self.collider and (
+            self.collider.col_type, self.collider.data[0].to_tuple())
+        return (self.modelname, tuple(lod_keys), hardpoints,
+                tuple(self.dranges), spheres, collider,
+                tuple((mtl, tuple(mtldata))
+                      for mtl, mtldata in self.mtltexs.items()),
+                tuple(self.image_txns.items()),
+                tuple(zip((tex_atlas.name for tex_atlas in self.atlases),
+                          self.atlas_txns)),
+                tuple(self.variant_txns.items()))
+
+    def fingerprint(self, settings=()):
+        """Fingerprint the data this model is exported from.
+
+        The fingerprint covers the version of the exporter, and the mesh
+        data, shape keys, normal settings (auto smooth and sharp edges),
+        modifier settings, transforms, materials, and child empties
+        (hardpoints, LOD ranges, etc.) of each LOD object, the texture
+        numbers, and the export settings. settings
+        can add other values that affect the exported file. Returns None if
+        the model cannot be fingerprinted, since one of its modifiers uses
+        another object. Texture numbers must have been assigned first."""
+        scene = bpy.data.scenes[self.scene]
+        fprint = export_cache.Fingerprint()
+        fprint.add(export_cache.exporter_version())
+        fprint.add(self.modelname, self._exp_fname, tuple(settings),
+                   self.drang_increment, self.far_chunk, self.gen_bsp,
+                   self.bsp_regions, self.auto_lods, self.auto_lod_ratio,
+                   self.range_solver, self.pixel_tolerance, self.lod_fov,
+                   self.lod_resolution, self.use_mtltex,
+                   tuple(tuple(row) for row in self.wc_matrix),
+                   [(opt_pass.__name__, sorted(kwargs.items()))
+                    for opt_pass, kwargs in self.opt_passes()],
+                   list(self.mtltexs.items()), list(self.image_txns.items()),
+                   [tex_atlas.name for tex_atlas in self.atlases],
+                   self.atlas_txns, self.lod_textures,
+                   list(self.variant_txns.items()))
+
+        obj_names = list(self.lods)
+        if self.collmesh is not None:
+            obj_names.append(self.collmesh)
+        for obj_name in obj_names:
+            obj = scene.objects[obj_name]
+            fprint.add(obj.name, obj.type, obj.get("drange"),
+                       tuple(tuple(row) for row in obj.matrix_local))
+            for cobj in obj.children:
+                fprint.add(cobj.name, cobj.type, cobj.hide,
+                           cobj.empty_draw_type, tuple(cobj.location),
+                           tuple(cobj.rotation_euler), tuple(cobj.scale))
+            if obj.type != "MESH":
+                continue
+            for modifier in obj.modifiers:
+                mod_values = rna_values(modifier)
+                if mod_values is None:
+                    return None
+                fprint.add(modifier.type, mod_values)
+            mesh = obj.data
+            for collection, attr, typecode, size in (
+                    (mesh.vertices, "co", "f", 3),
+                    (mesh.loops, "vertex_index", "i", 1),
+                    (mesh.polygons, "loop_total", "i", 1),
+                    (mesh.polygons, "material_index", "i", 1),
+                    (mesh.polygons, "use_smooth", "B", 1),
+                    (mesh.edges, "vertices", "i", 2),
+                    (mesh.edges, "use_edge_sharp", "B", 1)):
+                data = array.array(typecode, bytes(
+                    len(collection) * size * array.array(typecode).itemsize))
+                collection.foreach_get(attr, data)
+                fprint.add_bytes(data)
+            fprint.add(mesh.use_auto_smooth, mesh.auto_smooth_angle,
+                       getattr(mesh, "has_custom_normals", False))
+            if mesh.shape_keys is not None:
+                fprint.add(obj.active_shape_key_index,
+                           obj.show_only_shape_key,
+                           mesh.shape_keys.use_relative)
+                for key_block in mesh.shape_keys.key_blocks:
+                    fprint.add(key_block.name, key_block.value,
+                               key_block.mute, key_block.slider_min,
+                               key_block.slider_max, key_block.vertex_group,
+                               key_block.interpolation,
+                               key_block.relative_key.name)
+                    coords = array.array("f", bytes(len(key_block.data) * 12))
+                    key_block.data.foreach_get("co", coords)
+                    fprint.add_bytes(coords)
+            if mesh.uv_layers.active is not None:
+                uvs = array.array("f", bytes(len(mesh.loops) * 8))
+                mesh.uv_layers.active.data.foreach_get("uv", uvs)
+                fprint.add_bytes(uvs)
+                fprint.add([tfuv.image and tfuv.image.filepath
+                            for tfuv in mesh.uv_textures.active.data])
+            for material in mesh.materials:
+                if material is None:
+                    fprint.add(None)
+                    continue
+                fprint.add(material.name, tuple(material.diffuse_color),
+                           material.use_shadeless, material.get("light_flags"),
+                           [texture.image.filepath for texture in
+                            self.texs_for_mtl(material)])
+        return fprint.hexdigest()
+
+    def opt_passes(self):
+        "The enabled optimization passes, as (function, kwargs) tuples."
+        passes = []
+        if self.merge_coplanar:
+            passes.append((mesh_opt.merge_coplanar, {}))
+        if self.normal_tolerance > 0:
+            passes.append((mesh_opt.cluster_normals,
+                           {"tolerance": self.normal_tolerance}))
+        if self.compact_meshes:
+            passes.append((mesh_opt.compact,
+                           {"weld_distance": self.weld_distance}))
+        if self.reorder_faces:
+            passes.append((mesh_opt.reorder_faces, {}))
+        return passes
+
+    def extract(self, memory=None):
+        """Get the data to write the model file from Blender.
+
+        Returns a ModelJob, which does not use any Blender data, and can be
+        run in another process. The LOD meshes are evaluated, and freed
+        once they have been packed. If a workers.MemoryWatch is given, it is
+        sampled while the meshes are still in memory."""
+        self.load_meshes()
+        packed_lods = []
+        for lodi in range(len(self.lods)):
             if self.lod_empty[lodi] is False:
-                ilodm = iff_mesh.MeshLODForm(lodi)
-                ilodm.set_name(self.modelname)
-                ilodm.set_cntradi(self.dsphrs[lodi])
-
-                cur_lodm = self.lodms[lodi]
-
-                for vert in cur_lodm.vertices:
-                    ilodm.add_vertex(vert.co.x * -1, vert.co.y, vert.co.z)
-
-                unique_normals = {}
-                norm_idx = 0
-                fvrt_idx = 0
-                for tf, tfuv in zip(
-                        cur_lodm.tessfaces,
-                        cur_lodm.tessface_uv_textures.active.data):
-
-                    # Get vertex normals. This depends on whether or not the
-                    # faces are smooth or flat shaded.
-                    if tf.use_smooth:
-                        # Smooth - use individual vertex normals
-                        for vert in tf.vertices:
-                            nx, ny, nz = cur_lodm.vertices[vert].normal
-                            nx *= -1
-                            vnrm = array.array("f", (nx, ny, nz)).tobytes()
-                            if vnrm not in unique_normals:
-                                unique_normals[vnrm] = norm_idx
-                                ilodm.add_vert_normal(nx, ny, nz)
-                                norm_idx += 1
-
-                    # Flat - use face normal. This normal will be added anyway,
-                    # since it is referenced by the FACE chunk.
-                    nx, ny, nz = tf.normal
-                    nx *= -1
-                    fnrm = array.array("f", (nx, ny, nz)).tobytes()
-                    if fnrm not in unique_normals:
-                        unique_normals[fnrm] = norm_idx
-                        ilodm.add_face_normal(nx, ny, nz)
-                        norm_idx += 1
-
-                    # Add the FVRTs for the face
-                    uv_idx = len(tf.vertices) - 1
-                    for fvrt in reversed(tf.vertices):
-                        vtnm_idx = None
-                        if tf.use_smooth:
-                            nx, ny, nz = cur_lodm.vertices[fvrt].normal
-                            nx *= -1
-                            vnrm = array.array("f", (nx, ny, nz)).tobytes()
-                            vtnm_idx = unique_normals[vnrm]
-                        else:
-                            nx, ny, nz = tf.normal
-                            nx *= -1
-                            vnrm = array.array("f", (nx, ny, nz)).tobytes()
-                            vtnm_idx = unique_normals[vnrm]
-                        ilodm.add_fvrt(fvrt, vtnm_idx, tfuv.uv[uv_idx][0],
-                                       1 - tfuv.uv[uv_idx][1])
-                        uv_idx -= 1
-                    del uv_idx
-
-                    # Get the texnum and light flags
-                    if self.use_mtltex:
-                        texnum = self.mtltexs[
-                            cur_lodm.materials[tf.material_index].name][2]
-                    else:
-                        if tfuv.image is not None:
-                            texnum = self.image_txns[tfuv.image.filepath]
-                        else:
-                            # This should be a flat colour
-                            texnum = self.mtltexs[
-                                cur_lodm.materials[tf.material_index].name][2]
-                    light_flags = self.mtltexs[
-                        cur_lodm.materials[tf.material_index].name][0]
-
-                    first_vert = cur_lodm.vertices[tf.vertices[-1]].co.copy()
-                    first_vert.x *= -1
-
-                    face_nrm = tf.normal.copy()
-                    face_nrm.x *= -1
-
-                    # Add the face
-                    ilodm.add_face(
-                        unique_normals[fnrm],
-                        self.calc_dplane(first_vert, face_nrm),
-                        texnum, fvrt_idx, len(tf.vertices), light_flags)
-                    fvrt_idx += len(tf.vertices)
+                packed_lods.append(self.pack_lod(lodi))
             else:
-                ilodm = iff_mesh.EmptyLODForm(lodi)
+                packed_lods.append(None)
+        if memory is not None:
+            memory.sample()
+        self.free_meshes()
+
+        # mathutils types are converted to tuples, so they can be pickled.
+        hardpoints = [
+            iff_mesh.Hardpoint(tuple(tuple(row) for row in hardpt.rot_matrix),
+                               tuple(hardpt.location), hardpt.name)
+            for hardpt in self.hardpoints]
+
+        return serialize.ModelJob(
+            self.modeldir + dirsep + self._exp_fname, self.modelname,
+            self.far_chunk, self.collider, hardpoints, packed_lods,
+            self.dranges, self.dsphrs, self.drange_fixed, self.num_gen_lods,
+            self.auto_lod_ratio, self.range_solver, self.pixel_tolerance,
+            self.lod_fov, self.lod_resolution, self.opt_passes(),
+            self.test_run, self.lod_texnums())
 
-            modelfile.add_lod(ilodm, drange)
-        if not self.test_run:
-            modelfile.write_file_bin()
+    def export(self):
+        self.extract().run()
 
 
 class ExportBackend:
@@ -690,7 +1109,35 @@ class ExportBackend:
                  include_far_chunk=True,
                  drang_increment=500.0,
                  generate_bsp=False,
-                 test_run=False):
+                 test_run=False,
+                 workers=0,
+                 bsp_regions=False,
+                 auto_lods=0,
+                 auto_lod_ratio=0.5,
+                 range_solver=False,
+                 pixel_tolerance=1.0,
+                 lod_fov=60.0,
+                 lod_resolution=768,
+                 merge_coplanar=False,
+                 compact_meshes=False,
+                 weld_distance=0.0001,
+                 reorder_faces=False,
+                 normal_tolerance=0.0,
+                 use_cache=False,
+                 use_texture_registry=False,
+                 build_textures=False,
+                 texture_palette="",
+                 embed_palette=True,
+                 use_atlas=False,
+                 atlas_size=1024,
+                 lod_textures=0,
+                 sphere_report=False):
+        if use_atlas and not build_textures:
+            raise ValueError("Texture atlases can only be used when "
+                             "building MATs!")
+        if lod_textures > 0 and not build_textures:
+            raise ValueError("Downscaled LOD textures can only be used when "
+                             "building MATs!")
         self.filepath = filepath
         self.start_texnum = start_texnum
         self.apply_modifiers = apply_modifiers
@@ -701,7 +1148,48 @@ class ExportBackend:
         self.drang_incval = drang_increment
         self.generate_bsp = generate_bsp
         self.test_run = test_run
+        # Optional ModelManager settings
+        self.model_options = {
+            "workers": workers,
+            "bsp_regions": bsp_regions,
+            "auto_lods": auto_lods,
+            "auto_lod_ratio": auto_lod_ratio,
+            "range_solver": range_solver,
+            "pixel_tolerance": pixel_tolerance,
+            "lod_fov": lod_fov,
+            "lod_resolution": lod_resolution,
+            "merge_coplanar": merge_coplanar,
+            "compact_meshes": compact_meshes,
+            "weld_distance": weld_distance,
+            "reorder_faces": reorder_faces,
+            "normal_tolerance": normal_tolerance,
+            "use_atlas": use_atlas,
+            "atlas_size": atlas_size,
+            "lod_textures": lod_textures,
+            "sphere_report": sphere_report,
+        }
         self.modelname = ""
+        # Seconds taken by the extraction and writing phases of the export
+        self.phase_times = None
+        # MiB that the memory use of Blender grew by while extracting the
+        # models, and the peak memory use of a worker process
+        self.extract_memory = None
+        self.worker_memory = None
+        # Export filenames of the models that were not written, since they
+        # are identical to another model, mapped to the other model's name.
+        self.model_aliases = {}
+        # Skip models that have not changed since they were last exported
+        self.use_cache = use_cache
+        self.skipped_models = None  # Number of unchanged models skipped
+        # Get texture numbers from the registry for the mod folder, so they
+        # stay the same between exports.
+        self.use_texture_registry = use_texture_registry
+        self.tex_status = {}  # Texture filename -> texreg status
+        # Convert the texture images to MATs using the given .pal file
+        self.build_textures = build_textures
+        self.texture_palette = texture_palette
+        self.embed_palette = embed_palette
+        self.built_textures = None  # Number of MATs built
 
     def get_texnums(self, textures):
         """Convert all of the named textures to texture numbers.
@@ -723,6 +1211,32 @@ class ExportBackend:
             if numtx_match:
                 numeric_txs[idx] = int(numtx_match.group(1))
 
+        if self.use_texture_registry:
+            modeldir = self.filepath[:self.filepath.rfind(dirsep)]
+            registry = texreg.TextureRegistry(
+                texreg.find_registry(modeldir), self.start_texnum,
+                read_only=self.test_run)
+            print("Using texture registry", registry.path)
+            with registry:
+                for txnum in numeric_txs:
+                    if txnum is not None:
+                        registry.reserve(txnum)
+                for idx, txfname in enumerate(textures):
+                    if numeric_txs[idx] is not None:
+                        texnums[txfname] = numeric_txs[idx]
+                        self.tex_status[txfname] = texreg.TEX_SAME
+                    elif (txfname.startswith(atlas.ATLAS_PREFIX) or
+                          texbuild.is_variant_name(txfname)):
+                        # Atlases and halved textures have no image file.
+                        texnums[txfname], self.tex_status[txfname] = (
+                            registry.texnum_for_name(txfname))
+                    else:
+                        img_path = bpy.path.abspath(txfname)
+                        texnums[txfname], self.tex_status[txfname] = (
+                            registry.texnum_for(
+                                img_path, texreg.file_hash(img_path)))
+            return texnums
+
         for idx, txfname in enumerate(textures):
             if numeric_txs[idx] is not None:
                 texnums[txfname] = numeric_txs[idx]
@@ -735,8 +1249,161 @@ class ExportBackend:
 
         return texnums
 
-    def fmt_txinfo(self, mtl_texnums, as_comment=False):
-        """Gets a string showing the Image Filename->Texture number"""
+    def load_palette(self, modeldir, palname, images, cache):
+        """Load the palette to build MATs with.
+
+        If no palette file was chosen, a palette named palname is built from
+        the images. If the palette is not embedded in the MATs, it is
+        referred to by name, and copied to the "pal" folder next to the
+        "mat" folder if it is not there already. Returns None if there are
+        no images to build MATs from."""
+        if not images:
+            warnings.warn("There are no texture images to build MATs from!",
+                          ValueWarning)
+            return None
+        paldir = os.path.join(
+            os.path.dirname(texbuild.mat_dir(modeldir)), "pal")
+        if not self.texture_palette:
+            return self.build_palette(paldir, palname[:8], images, cache)
+        palpath = bpy.path.abspath(self.texture_palette)
+        if self.embed_palette:
+            return mat_write.Palette.from_pal_file(palpath)
+        palname = os.path.splitext(os.path.basename(palpath))[0]
+        palette = mat_write.Palette.from_pal_file(palpath, palname.upper())
+        paldest = os.path.join(paldir, palname.lower() + ".pal")
+        if not self.test_run and not os.path.isfile(paldest):
+            os.makedirs(paldir, exist_ok=True)
+            palette.write_pal(paldest)
+        return palette
+
+    def build_palette(self, paldir, palname, images, cache):
+        """Build a palette for the images, and save it as <palname>.pal.
+
+        The palette is only built again if the images have changed. Returns
+        None if none of the images have any visible pixels."""
+        palpath = os.path.join(paldir, palname.lower() + ".pal")
+        name = None if self.embed_palette else palname.upper()
+        key = texbuild.palette_key(
+            [content_hash for image, content_hash in images.values()])
+        # The build cache is in the "mat" folder
+        pal_fname = os.path.join("..", "pal", os.path.basename(palpath))
+        if cache.lookup(pal_fname, key):
+            return mat_write.Palette.from_pal_file(palpath, name)
+        print("Building palette {}...".format(palpath))
+        palette, errors = palgen.palette_for_images((
+            (img_fname, texbuild.rgba_bytes(
+                image.pixels[:], image.size[0], image.size[1]))
+            for img_fname, (image, content_hash) in images.items()
+            if image.size[0] > 0 and image.size[1] > 0), name)
+        if palette is None:
+            warnings.warn("None of the texture images have any visible "
+                          "pixels, so no MATs were built!", ValueWarning)
+            return None
+        print(banner("Palette error for each texture:", 70))
+        print(palgen.fmt_errors(errors))
+        if not self.test_run:
+            os.makedirs(paldir, exist_ok=True)
+            palette.write_pal(palpath)
+            cache.update(pal_fname, key)
+        return palette
+
+    def texture_jobs(self, mtl_texnums, modeldir, modelname, atlases=None,
+                     variants=None):
+        """Get a TextureJob for each texture image that has to be built.
+
+        Images are looked up in the build cache by a hash of their file,
+        or of their pixels if they are packed or have unsaved changes, so
+        their pixels are only read from Blender if the MAT is out of date.
+        atlases maps the names of texture atlases to their Atlases, and an
+        AtlasJob is made for each out of date atlas. variants maps the names
+        of downscaled textures to the name of the image or atlas, and the
+        number of times it is halved. Returns the jobs, and the BuildCache
+        to save once they are done."""
+        matdir = texbuild.mat_dir(modeldir)
+        cache = texbuild.BuildCache(matdir)
+        atlases = atlases or {}
+        variants = variants or {}
+        images = OrderedDict()  # Filename -> (image, content hash)
+        for img_fname in mtl_texnums.keys():
+            if img_fname in atlases or img_fname in variants:
+                continue
+            image = image_for(img_fname)
+            if image is None:
+                warnings.warn("Could not find the image {}!".format(
+                    img_fname), KeyWarning)
+                continue
+            images[img_fname] = image, image_hash(image)
+        palette = self.load_palette(modeldir, modelname, images, cache)
+        if palette is None:
+            return [], cache
+        # Texture name -> (image or atlas name, times halved)
+        textures = OrderedDict((name, (name, 0)) for name in images)
+        textures.update((name, (name, 0)) for name in atlases)
+        textures.update(variants)
+        pixels = {}  # Image filename -> pixels, for images used twice
+
+        def image_pixels(img_fname):
+            if img_fname not in pixels:
+                pixels[img_fname] = array.array(
+                    "f", images[img_fname][0].pixels[:])
+            return pixels[img_fname]
+
+        jobs = []
+        for name, (source, level) in textures.items():
+            if source in atlases:
+                tex_atlas = atlases[source]
+                content = [(images[img_fname][1], place) for img_fname, place
+                           in tex_atlas.placements.items()]
+                settings = (tex_atlas.width, tex_atlas.height,
+                            tex_atlas.padding)
+            elif source in images:
+                content = images[source][1]
+                settings = ()
+            else:
+                continue
+            if level > 0:
+                settings += ("downscale", level)
+            key = texbuild.build_key(content, palette, settings)
+            mat_fname = texbuild.mat_fname(mtl_texnums[name])
+            if level > 0:
+                cache.variants[mat_fname] = texbuild.mat_fname(
+                    mtl_texnums[source])
+            if cache.lookup(mat_fname, key):
+                continue
+            matfpath = os.path.join(matdir, mat_fname)
+            if source in atlases:
+                parts = [place + (image_pixels(img_fname),) for img_fname,
+                         place in tex_atlas.placements.items()]
+                jobs.append(texbuild.AtlasJob(
+                    matfpath, tex_atlas.width, tex_atlas.height, parts,
+                    palette, tex_atlas.padding, self.test_run, level))
+            else:
+                width, height = images[source][0].size
+                if width == 0 or height == 0:
+                    warnings.warn("Could not load the image {}!".format(
+                        source), ValueWarning)
+                    continue
+                jobs.append(texbuild.TextureJob(
+                    matfpath, width, height, image_pixels(source), palette,
+                    self.test_run, level))
+            cache.update(mat_fname, key)
+        print("{} of {} textures have to be converted to MATs.".format(
+            len(jobs), len(mtl_texnums)))
+        return jobs, cache
+
+    def fmt_txinfo(self, mtl_texnums, as_comment=False, changed_only=False):
+        """Gets a string showing the Image Filename->Texture number
+
+        If changed_only is True, only the textures that are new or changed
+        according to the texture registry are shown."""
+        if changed_only:
+            mtl_texnums = OrderedDict(
+                (img_fname, texnum)
+                for img_fname, texnum in mtl_texnums.items()
+                if self.tex_status.get(img_fname, texreg.TEX_NEW) !=
+                texreg.TEX_SAME)
+        if not mtl_texnums:
+            return ""
         # Used to make the Image Filename->Material Number list
         # easier to read.
         # max_width = len(max(mtl_texnums.keys(), key=len))
@@ -760,7 +1427,7 @@ class HierarchyManager:
 
     def __init__(self, root_obj, modelname, modeldir, use_facetex, far_chunk,
                  drang_increment, generate_bsp, scene_name, wc_matrix,
-                 test_run):
+                 test_run, model_options=None):
 
         self.root_obj = root_obj
         self.root_lods = self.lods_of(root_obj.name)
@@ -774,6 +1441,8 @@ class HierarchyManager:
         self.scene_name = scene_name
         self.wc_matrix = wc_matrix
         self.test_run = test_run
+        # Keyword arguments for the optional ModelManager settings
+        self.model_options = model_options or {}
         self.managers = []
         self.mgrtexs = []
 
@@ -967,7 +1636,7 @@ class HierarchyManager:
                 self.modelname, hobj.name, self.use_facetex,
                 self.drang_incval, self.far_chunk, self.modeldir,
                 self.generate_bsp, self.scene_name, self.wc_matrix,
-                self.test_run)
+                self.test_run, **self.model_options)
             cur_manager.exp_fname = self.hierarchy_str_for(hobj)
             print("Export filename for {}: {}.iff".format(
                 hobj.name, cur_manager.exp_fname))
@@ -993,13 +1662,72 @@ class HierarchyManager:
         for manager in self.managers:
             manager.assign_mtltxns(mtltxns)
 
+    def extract(self):
+        "Get a ModelJob for each model in the hierarchy."
+        return [manager.extract() for manager in self.managers]
+
     def export(self):
-        for manager in self.managers:
-            manager.export()
+        serialize.write_models(self.extract(),
+                               self.model_options.get("workers", 1))
 
 
 class IFFExporter(ExportBackend):
 
+    def extract_models(self, models, cache=None):
+        """Get a ModelJob for each ModelManager that has to be written.
+
+        Models that would be written to identical files, like copies of the
+        same turret, are only extracted and written once. Models with the
+        same dedupe_key are not extracted again, and the rest are compared
+        by the digest of their extracted data. If an ExportCache is given,
+        models that have not changed since they were last exported are
+        skipped.
+
+        Returns the jobs, a dict mapping the export filename of each model
+        that is not written to the export filename of the identical model
+        that is, and the fingerprint of each model to add to the cache.
+
+        Memory use is sampled while each model's meshes are in memory, and
+        its growth is kept in extract_memory."""
+        jobs = []
+        memory = workers.MemoryWatch()
+        aliases = OrderedDict()
+        extracted = {}
+        fingerprints = OrderedDict()
+        if cache is not None:
+            current = OrderedDict(
+                (model.exp_fname, model.fingerprint()) for model in models)
+        skipped = 0
+        for model in models:
+            if cache is not None:
+                fingerprint = current[model.exp_fname]
+                if fingerprint is not None:
+                    cached = cache.lookup(model.exp_fname, fingerprint,
+                                          current)
+                    if cached is not None:
+                        skipped += 1
+                        if cached != model.exp_fname:
+                            aliases[model.exp_fname] = cached
+                        continue
+                    fingerprints[model.exp_fname] = fingerprint
+            key = model.dedupe_key()
+            if key is not None and key in extracted:
+                aliases[model.exp_fname] = extracted[key]
+                continue
+            jobs.append(model.extract(memory))
+            if key is not None:
+                extracted[key] = model.exp_fname
+        self.extract_memory = memory.growth
+        jobs, dupe_aliases = serialize.dedupe_jobs(jobs)
+        for dupe, kept in dupe_aliases.items():
+            aliases[dupe[dupe.rfind(dirsep) + 1:]] = kept[
+                kept.rfind(dirsep) + 1:]
+        if cache is not None:
+            print("Skipped {} unchanged models, and rebuilt {}.".format(
+                skipped, len(models) - skipped))
+            self.skipped_models = skipped
+        return jobs, aliases, fingerprints
+
     def export(self):
         """
         Export .iff files from the Blender scene.
@@ -1032,7 +1760,7 @@ class IFFExporter(ExportBackend):
                 bpy.context.active_object, modelname, modeldir,
                 self.use_facetex, self.include_far_chunk, self.drang_incval,
                 self.generate_bsp, bpy.context.scene.name,
-                self.wc_matrix, self.test_run))
+                self.wc_matrix, self.test_run, self.model_options))
 
         else:
             for obj in bpy.context.scene.objects:
@@ -1042,7 +1770,7 @@ class IFFExporter(ExportBackend):
                             obj, modelname, modeldir, self.use_facetex,
                             self.include_far_chunk, self.drang_increment,
                             self.generate_bsp, bpy.context.scene.name,
-                            self.wc_matrix, self.test_run
+                            self.wc_matrix, self.test_run, self.model_options
                         ))
                         warnings.warn("detail-x LOD naming scheme is "
                                       "deprecated.", DeprecationWarning)
@@ -1053,7 +1781,8 @@ class IFFExporter(ExportBackend):
                                 obj, modelname, modeldir, self.use_facetex,
                                 self.include_far_chunk, self.drang_increment,
                                 self.generate_bsp, bpy.context.scene.name,
-                                self.wc_matrix, self.test_run
+                                self.wc_matrix, self.test_run,
+                                self.model_options
                             ))
                             used_names.add(obj_match.group(1))
 
@@ -1069,13 +1798,126 @@ class IFFExporter(ExportBackend):
 
         print(banner("Texture numbers:", 70))
         print(mtltexnums)
-
+        if self.use_texture_registry:
+            print(banner("New or changed textures:", 70))
+            print(self.fmt_txinfo(mtltexnums, changed_only=True) or "None")
+
+        # Get everything from Blender first, and then write the model files
+        # in worker processes. Each model's LOD meshes are evaluated and
+        # freed before the next model's, so only one model's meshes are in
+        # memory at a time.
+        extract_start = time.perf_counter()
         for manager in managers:
             manager.assign_mtltxns(mtltexnums)
-            manager.export()
-
-        print("Export took {} seconds.".format(
-            time.perf_counter() - export_start))
+        models = [model for manager in managers for model in manager.managers]
+        cache = export_cache.ExportCache(modeldir) if self.use_cache else None
+        jobs, aliases, fingerprints = self.extract_models(models, cache)
+        self.model_aliases = aliases
+        if aliases:
+            print(banner("Identical models (not written):", 70))
+            for dupe, kept in aliases.items():
+                print("{}.iff --> {}.iff".format(dupe, kept))
+        # The pixels of the images to build MATs from are only read once
+        # the models are extracted, so they are not in memory alongside the
+        # LOD meshes.
+        tex_jobs = []
+        if self.build_textures:
+            print(banner("Building MATs:", 70))
+            atlases = OrderedDict(
+                (tex_atlas.name, tex_atlas) for model in models
+                for tex_atlas in model.atlases)
+            variants = OrderedDict(
+                variant for model in models
+                for variant in model.variants.items())
+            tex_jobs, build_cache = self.texture_jobs(
+                mtltexnums, modeldir, modelname, atlases, variants)
+            if tex_jobs and not self.test_run:
+                os.makedirs(build_cache.matdir, exist_ok=True)
+        write_start = time.perf_counter()
+        # The MATs are built by the same worker processes, alongside the
+        # model files.
+        serialize.write_models(jobs + tex_jobs, self.model_options["workers"])
+        write_end = time.perf_counter()
+        if self.build_textures:
+            self.built_textures = len(tex_jobs)
+            if not self.test_run:
+                build_cache.save()
+        if cache is not None and not self.test_run:
+            for exp_fname, fingerprint in fingerprints.items():
+                cache.update(exp_fname, fingerprint, aliases.get(exp_fname))
+            cache.save()
+        self.phase_times = (write_start - extract_start,
+                            write_end - write_start)
+
+        self.worker_memory = workers.worker_peak_memory()
+
+        print("Extracting {} models took {:.3f} seconds, and writing them "
+              "took {:.3f} seconds.".format(len(jobs), *self.phase_times))
+        if self.extract_memory is not None:
+            print("Memory use grew by up to {:.1f} MiB while extracting the "
+                  "models.".format(self.extract_memory))
+        if self.worker_memory is not None:
+            print("Peak memory use of a worker process: {:.1f} MiB".format(
+                self.worker_memory))
+        print("Export took {} seconds.".format(write_end - export_start))
+
+
+def mesh_coords(bl_mesh):
+    """Get the vertex coordinates of a Blender mesh, as they are exported.
+
+    The mesh should already be transformed to VISION engine orientation.
+    Returns a flat array of floats (x, y, z, x, y, z, ...)"""
+    coords = array.array("f", bytes(len(bl_mesh.vertices) * 12))
+    bl_mesh.vertices.foreach_get("co", coords)
+    coords[0::3] = array.array("f", map(float.__neg__, coords[0::3]))
+    return coords
+
+
+def image_for(filepath):
+    "Get the Blender image for a texture image filename, or None."
+    for image in bpy.data.images:
+        if image.filepath == filepath:
+            return image
+    return None
+
+
+def image_hash(image):
+    """Get a hash of the contents of a Blender image.
+
+    The image file is hashed, unless the image is packed, or has unsaved
+    changes, in which case its pixels are hashed."""
+    if image.packed_file is None and not image.is_dirty:
+        content_hash = texreg.file_hash(bpy.path.abspath(image.filepath))
+        if content_hash is not None:
+            return content_hash
+    fprint = export_cache.Fingerprint()
+    fprint.add_bytes(array.array("f", image.pixels[:]))
+    return fprint.hexdigest()
+
+
+def rna_values(struct):
+    """Get the values of the editable properties of a Blender struct.
+
+    Returns a tuple of (name, value) tuples, which can be compared and
+    hashed, or None if one of the values is a reference to an object."""
+    values = []
+    for prop in struct.bl_rna.properties:
+        if prop.identifier in ("name", "rna_type") or prop.is_readonly:
+            continue
+        value = getattr(struct, prop.identifier)
+        if isinstance(value, bpy.types.Object):
+            return None
+        elif isinstance(value, bpy.types.ID):
+            value = value.name
+        elif isinstance(value, set):
+            value = tuple(sorted(value))
+        elif not isinstance(value, (bool, int, float, str, type(None))):
+            try:
+                value = tuple(value)
+            except TypeError:
+                value = repr(value)
+        values.append((prop.identifier, value))
+    return tuple(values)
 
 
 def banner(text, width=50):
@@ -150,7 +150,7 @@ class IffForm:
 
 class IffChunk(IffForm):
     # A CHUNK is an IFF data structure that holds binary data,
-    # such as integers, floats, or strings.
+    # such as integers, floats, strings, or raw bytes.
 
     def __init__(self, name, members=None):
         super().__init__(name, members)
@@ -161,7 +161,9 @@ class IffChunk(IffForm):
                 if membtype == 1:
                     memblength += 4  # Number
                 elif membtype == 2:
-                    memblength += len(m)  # String
+                    memblength += len(m) + 1  # Null-terminated string
+                elif membtype == 3:
+                    memblength += len(m)  # Raw bytes
         self._length = memblength
 
     def is_member_valid(self, member):
@@ -170,13 +172,15 @@ class IffChunk(IffForm):
             return 1
         elif isinstance(member, str):
             return 2
+        elif isinstance(member, (bytes, bytearray)):
+            return 3
         else:
             return 0
 
     def add_member(self, member_to_add):
         """Add a member to this CHUNK
 
-        Only ints, floats, and strings can be added to a CHUNK.
+        Only ints, floats, strings, and bytes can be added to a CHUNK.
         """
         membtype = self.is_member_valid(member_to_add)
         if membtype > 0:
@@ -185,6 +189,8 @@ class IffChunk(IffForm):
                 self._length += 4
             elif membtype == 2:  # String
                 self._length += len(member_to_add) + 1  # Null-terminated
+            elif membtype == 3:  # Raw bytes
+                self._length += len(member_to_add)
         else:
             raise TypeError("Tried to add an invalid piece of data!")
 
@@ -222,6 +228,8 @@ class IffChunk(IffForm):
             new_member_length = 4
         elif new_member_type == 2:
             new_member_length = len(new_member) + 1
+        elif new_member_type == 3:
+            new_member_length = len(new_member)
         else:
             raise TypeError("Member is of an invalid type for an IffChunk!")
 
@@ -231,6 +239,8 @@ class IffChunk(IffForm):
             old_member_length = 4
         elif old_member_type == 2:
             old_member_length = len(self._members[member_to_replace]) + 1
+        elif old_member_type == 3:
+            old_member_length = len(self._members[member_to_replace])
 
         self._length += (new_member_length - old_member_length)
         self._members[member_to_replace] = new_member
@@ -253,6 +263,8 @@ class IffChunk(IffForm):
                 xmf_string.write("float %f" % x)
             if isinstance(x, str):
                 xmf_string.write('cstring "%s"' % x)
+            if isinstance(x, (bytes, bytearray)):
+                xmf_string.write(" ".join("byte %i" % b for b in x))
             xmf_string.write("\n")
         xmf_string.write("}")
         return xmf_string.getvalue()
@@ -267,6 +279,8 @@ class IffChunk(IffForm):
             if isinstance(x, str):
                 iffbytes.extend(x.encode("ascii", "replace"))
                 iffbytes.append(0)
+            if isinstance(x, (bytes, bytearray)):
+                iffbytes.extend(x)
 
         iffbytes = (self._name.encode("ascii", "replace") +
                     pack(">l", self._length) + iffbytes)
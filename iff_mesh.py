@@ -19,7 +19,13 @@
 # <pep8-80 compliant>
 
 # Classes for WCP/SO IFF Meshes
-from . import iff
+import array
+try:
+    from . import iff, bsp
+except ImportError:
+    # Not imported as part of the add-on (ex. by the unit tests)
+    import iff
+    import bsp
 
 
 def colour_texnum(colour):
@@ -91,31 +97,102 @@ class Collider:
         if not isinstance(data[0], Sphere):
             raise TypeError("A collider must have a boundary sphere!")
 
-        # if ((col_type == "bsp" or col_type == "bsp+region") and
-        #         not isinstance(data[1], bsp.BSPTree)):
-        #     raise TypeError("Collider data for a BSP collider must have a "
-        #                     "sphere and a BSP tree!")
-        #
-        # if (col_type == "bsp+region" and
-        #         not isinstance(data[2], bsp.Blockmap)):
-        #     raise TypeError("Collider data for a BSP collider must have a "
-        #                     "sphere and a BSP tree!")
+        if ((col_type == "bsp" or col_type == "bsp+region") and
+                (len(data) < 2 or not isinstance(data[1], bsp.BSPTree))):
+            raise TypeError("Collider data for a BSP collider must have a "
+                            "sphere and a BSP tree!")
 
-        if col_type == "bsp" or col_type == "bsp+region":
-            raise TypeError("BSP trees are not yet supported!")
+        if col_type == "bsp+region" and (
+                len(data) < 3 or not isinstance(data[2], bsp.Blockmap)):
+            raise TypeError("Collider data for a BSP+region collider must "
+                            "have a sphere, a BSP tree, and a blockmap!")
 
         self.col_type = col_type
         self.data = data
 
+    def to_bsp_form(self):
+        """Convert the BSP tree of this Collider to a BSP form.
+
+        The BSP form contains four chunks:
+        VERT: Vertex coordinates (3 floats per vertex)
+        PVRT: Polygon vertex indices (1 int per polygon vertex)
+        POLY: Polygons (First PVRT, number of vertices, node; 3 ints)
+        NODE: Nodes (Plane normal X/Y/Z and D as floats, then the front node,
+              back node, first POLY, and number of polygons as ints). -1 is
+              used for a front (empty) or back (solid) leaf."""
+        tree = self.data[1]
+        bsp_form = iff.IffForm("BSP ")
+
+        vert_chunk = iff.IffChunk("VERT")
+        for coord in tree.verts:
+            vert_chunk.add_member(float(coord))
+        bsp_form.add_member(vert_chunk)
+
+        pvrt_chunk = iff.IffChunk("PVRT")
+        for vidx in tree.pvrts:
+            pvrt_chunk.add_member(int(vidx))
+        bsp_form.add_member(pvrt_chunk)
+
+        poly_chunk = iff.IffChunk("POLY")
+        for poly in tree.polys:
+            for pdata in poly:
+                poly_chunk.add_member(int(pdata))
+        bsp_form.add_member(poly_chunk)
+
+        node_chunk = iff.IffChunk("NODE")
+        for node in tree.nodes:
+            for plane_coef in node[:4]:
+                node_chunk.add_member(float(plane_coef))
+            for ndata in node[4:]:
+                node_chunk.add_member(int(ndata))
+        bsp_form.add_member(node_chunk)
+
+        return bsp_form
+
+    def to_blkm_form(self):
+        """Convert the blockmap of this Collider to a BLKM form.
+
+        The BLKM form contains three chunks:
+        GRID: Grid origin X/Y/Z and cell size as floats, then the number of
+              cells along X, Y, and Z as ints.
+        CELL: Cells (First PIDX, number of polygons; 2 ints), X-major.
+        PIDX: Polygon indices (1 int per polygon in each cell)"""
+        blockmap = self.data[2]
+        blkm_form = iff.IffForm("BLKM")
+
+        grid_chunk = iff.IffChunk("GRID")
+        for coord in blockmap.origin:
+            grid_chunk.add_member(float(coord))
+        grid_chunk.add_member(float(blockmap.cell_size))
+        for dim in blockmap.dims:
+            grid_chunk.add_member(int(dim))
+        blkm_form.add_member(grid_chunk)
+
+        cell_chunk = iff.IffChunk("CELL")
+        for first, count in zip(blockmap.cell_first, blockmap.cell_count):
+            cell_chunk.add_member(int(first))
+            cell_chunk.add_member(int(count))
+        blkm_form.add_member(cell_chunk)
+
+        pidx_chunk = iff.IffChunk("PIDX")
+        for poly_idx in blockmap.cell_polys:
+            pidx_chunk.add_member(int(poly_idx))
+        blkm_form.add_member(pidx_chunk)
+
+        return blkm_form
+
     def to_coll_form(self):
         "Convert this Collider to a COLL form."
         coll_form = iff.IffForm("COLL")
         sphr_chnk = self.data[0].to_collsphr_chunk()
         coll_form.add_member(sphr_chnk)
 
-        if self.col_type == "bsp":
+        if self.col_type == "bsp" or self.col_type == "bsp+region":
             if self.data[1] is not None:
                 extn_form = iff.IffForm("EXTN")
+                extn_form.add_member(self.to_bsp_form())
+                if self.col_type == "bsp+region":
+                    extn_form.add_member(self.to_blkm_form())
                 coll_form.add_member(extn_form)
             else:
                 raise TypeError("data[1] must be a BSP tree!")
@@ -234,18 +311,18 @@ class Hardpoint:
     def to_chunk(self):
         "Convert this hardpoint to a HARD chunk."
         hard_chunk = iff.IffChunk("HARD")
-        hard_chunk.add_member(self.rot_matrix[0][0])
-        hard_chunk.add_member(self.rot_matrix[0][1])
-        hard_chunk.add_member(self.rot_matrix[0][2])
-        hard_chunk.add_member(self.location[0])
-        hard_chunk.add_member(self.rot_matrix[1][0])
-        hard_chunk.add_member(self.rot_matrix[1][1])
-        hard_chunk.add_member(self.rot_matrix[1][2])
-        hard_chunk.add_member(self.location[1])
-        hard_chunk.add_member(self.rot_matrix[2][0])
-        hard_chunk.add_member(self.rot_matrix[2][1])
-        hard_chunk.add_member(self.rot_matrix[2][2])
-        hard_chunk.add_member(self.location[2])
+        hard_chunk.add_member(float(self.rot_matrix[0][0]))
+        hard_chunk.add_member(float(self.rot_matrix[0][1]))
+        hard_chunk.add_member(float(self.rot_matrix[0][2]))
+        hard_chunk.add_member(float(self.location[0]))
+        hard_chunk.add_member(float(self.rot_matrix[1][0]))
+        hard_chunk.add_member(float(self.rot_matrix[1][1]))
+        hard_chunk.add_member(float(self.rot_matrix[1][2]))
+        hard_chunk.add_member(float(self.location[1]))
+        hard_chunk.add_member(float(self.rot_matrix[2][0]))
+        hard_chunk.add_member(float(self.rot_matrix[2][1]))
+        hard_chunk.add_member(float(self.rot_matrix[2][2]))
+        hard_chunk.add_member(float(self.location[2]))
         hard_chunk.add_member(self.name)
         return hard_chunk
 
@@ -308,6 +385,102 @@ class Hardpoint:
 # ================================= LOD Info =================================
 
 
+class PackedLOD:
+    """The geometry of a LOD mesh, packed into arrays.
+
+    The data is in VISION engine coordinates and order, exactly as it is
+    written to the VERT, VTNM, FVRT, and FACE chunks, so it can be processed
+    without Blender (ex. by the mesh simplifier), and then converted to a
+    MeshLODForm using MeshLODForm.from_packed.
+
+    verts: Vertex coordinates (x, y, z, x, y, z, ...)
+    norms: Vertex and face normals, like verts
+    fvrt_verts, fvrt_norms: Vertex and normal index of each FVRT
+    fvrt_uvs: UV coordinates of each FVRT (u, v, u, v, ...)
+    face_norms, face_dplanes, face_texnums, face_first, face_nverts,
+    face_lflags: FACE chunk data for each face
+    face_smooth: Whether each face is smooth shaded. Not exported; only
+    used to recalculate normals."""
+
+    def __init__(self):
+        self.verts = array.array("f")
+        self.norms = array.array("f")
+        self._norm_idxs = {}
+        self.fvrt_verts = array.array("i")
+        self.fvrt_norms = array.array("i")
+        self.fvrt_uvs = array.array("f")
+        self.face_norms = array.array("i")
+        self.face_dplanes = array.array("f")
+        self.face_texnums = array.array("i")
+        self.face_first = array.array("i")
+        self.face_nverts = array.array("i")
+        self.face_lflags = array.array("i")
+        self.face_smooth = array.array("B")
+
+    @property
+    def num_verts(self):
+        return len(self.verts) // 3
+
+    @property
+    def num_faces(self):
+        return len(self.face_first)
+
+    def add_vertex(self, vx, vy, vz):
+        "Add a vertex, and return its index."
+        self.verts.extend((vx, vy, vz))
+        return len(self.verts) // 3 - 1
+
+    def add_normal(self, nx, ny, nz):
+        """Add a normal if it is not already used, and return its index.
+
+        Normals are compared as they are exported (single precision)."""
+        nrm = array.array("f", (nx, ny, nz))
+        nkey = nrm.tobytes()
+        norm_idx = self._norm_idxs.get(nkey)
+        if norm_idx is None:
+            norm_idx = len(self.norms) // 3
+            self._norm_idxs[nkey] = norm_idx
+            self.norms.extend(nrm)
+        return norm_idx
+
+    def add_face(self, norm_idx, dplane, texnum, fvrts, light_flags,
+                 smooth=False):
+        """Add a face.
+
+        fvrts is a sequence of (vertex index, normal index, u, v) tuples."""
+        self.face_norms.append(norm_idx)
+        self.face_dplanes.append(dplane)
+        self.face_texnums.append(texnum)
+        self.face_first.append(len(self.fvrt_verts))
+        self.face_nverts.append(len(fvrts))
+        self.face_lflags.append(light_flags)
+        self.face_smooth.append(bool(smooth))
+        for vert_idx, norm_idx, uv_x, uv_y in fvrts:
+            self.fvrt_verts.append(vert_idx)
+            self.fvrt_norms.append(norm_idx)
+            self.fvrt_uvs.extend((uv_x, uv_y))
+
+    def empty_copy(self):
+        "Copy the vertices and normals of this PackedLOD, but not the faces."
+        packed = PackedLOD()
+        packed.verts.extend(self.verts)
+        packed.norms.extend(self.norms)
+        packed._norm_idxs.update(self._norm_idxs)
+        return packed
+
+    def face_fvrts(self, face_idx):
+        "The range of FVRT indices used by a face."
+        first = self.face_first[face_idx]
+        return range(first, first + self.face_nverts[face_idx])
+
+    def vertex(self, vert_idx):
+        return tuple(self.verts[vert_idx * 3:vert_idx * 3 + 3])
+
+    def __str__(self):
+        return "PackedLOD ({} vertices, {} faces)".format(
+            self.num_verts, self.num_faces)
+
+
 class MeshLODForm(iff.IffForm):
     "A LOD mesh."
 
@@ -337,6 +510,32 @@ class MeshLODForm(iff.IffForm):
         form_name = "{!s:0>4}".format(self.lod_lev)
         super().__init__(form_name, [self._mesh_form])
 
+    @classmethod
+    def from_packed(cls, lod_lev, packed, name=None, sphere=None,
+                    version=12):
+        "Make a LOD mesh from a PackedLOD."
+        lod = cls(lod_lev, version)
+        if name is not None:
+            lod.set_name(name)
+        if sphere is not None:
+            lod.set_cntradi(sphere)
+        verts = packed.verts
+        for vidx in range(0, len(verts), 3):
+            lod.add_vertex(verts[vidx], verts[vidx + 1], verts[vidx + 2])
+        norms = packed.norms
+        for nidx in range(0, len(norms), 3):
+            lod.add_vert_normal(norms[nidx], norms[nidx + 1], norms[nidx + 2])
+        uvs = packed.fvrt_uvs
+        for fvidx, (vert_idx, norm_idx) in enumerate(
+                zip(packed.fvrt_verts, packed.fvrt_norms)):
+            lod.add_fvrt(vert_idx, norm_idx, uvs[fvidx * 2],
+                         uvs[fvidx * 2 + 1])
+        for face in zip(packed.face_norms, packed.face_dplanes,
+                        packed.face_texnums, packed.face_first,
+                        packed.face_nverts, packed.face_lflags):
+            lod.add_face(*face)
+        return lod
+
     def set_name(self, name):
         "Set the name of this LOD mesh."
         # Check data types before adding to respective chunks
@@ -21,13 +21,20 @@
 import bpy
 import struct
 import array
-from . import iff_read, iff_mesh, mat_read
+import warnings
+from . import iff_read, iff_mesh, mat_read, texbuild, workers
 from mathutils import Matrix
-from itertools import starmap, count
+from concurrent.futures import ThreadPoolExecutor
+from itertools import starmap, count, repeat
+from operator import truediv
 from os import sep as dirsep, listdir
 from collections import OrderedDict
 
 MAX_NUM_LODS = 7
+# Custom properties of placeholder images for deferred MATs
+DEFERRED_PATH_KEY = "wcp_mat_path"
+DEFERRED_SIZE_KEY = "wcp_mat_size"
+PLACEHOLDER_COLOUR = (0.5, 0.5, 0.5, 1.0)
 # MAIN_LOD_NAMES = ["detail-" + str(lod) for lod in range(MAX_NUM_LODS)]
 CHLD_LOD_NAMES = ["{{0}}-lod{0:d}".format(lod) for lod in range(MAX_NUM_LODS)]
 
@@ -36,20 +43,111 @@ class ValueWarning(Warning):
     pass
 
 
+def decode_mat(matfpath):
+    """Decode a MAT to Blender image pixels.
+
+    The MAT is decoded a row at a time, bottom row first, like Blender
+    stores images. Returns the width, height, and an array of floats."""
+    with mat_read.MATStream(matfpath) as mat_stream:
+        pixels = array.array("f")
+        for row in mat_stream.rows(flip=True):
+            pixels.extend(map(truediv, row, repeat(255)))
+        return mat_stream.width, mat_stream.height, pixels
+
+
+def deferred_images(bl_objects=None):
+    """Get the placeholder images whose MATs have not been decoded yet.
+
+    If bl_objects is given, only the images used by their materials are
+    included."""
+    if bl_objects is None:
+        bl_images = bpy.data.images
+    else:
+        bl_images = set()
+        for bl_obj in bl_objects:
+            for bl_mat in getattr(bl_obj.data, "materials", ()):
+                if bl_mat is None:
+                    continue
+                for bl_mtexslot in bl_mat.texture_slots:
+                    if bl_mtexslot is not None and bl_mtexslot.texture:
+                        bl_images.add(getattr(bl_mtexslot.texture, "image",
+                                              None))
+    return [bl_img for bl_img in bl_images
+            if bl_img is not None and DEFERRED_PATH_KEY in bl_img]
+
+
+class TextureLoader:
+    """Decodes the MATs of placeholder images in background threads.
+
+    bpy is not thread safe, so the threads only decode the MATs, and the
+    pixels are copied to the images by upload, which must be called from
+    the main thread (ex. from a modal operator's timer events)."""
+
+    def __init__(self, num_threads=0):
+        self.executor = ThreadPoolExecutor(workers.num_workers(num_threads))
+        self.pending = OrderedDict()  # Image name -> future
+        self.failed = 0  # Number of MATs that could not be decoded
+
+    def request(self, bl_img):
+        "Start decoding the MAT of a placeholder image."
+        if bl_img.name not in self.pending and DEFERRED_PATH_KEY in bl_img:
+            self.pending[bl_img.name] = self.executor.submit(
+                decode_mat, bl_img[DEFERRED_PATH_KEY])
+
+    def upload(self):
+        """Copy the pixels of the decoded MATs to their images.
+
+        Returns the number of MATs that are still being decoded. MATs that
+        cannot be decoded are left as placeholders, with a warning, and
+        counted in failed."""
+        for name, future in list(self.pending.items()):
+            if not future.done():
+                continue
+            del self.pending[name]
+            bl_img = bpy.data.images.get(name)
+            if bl_img is None:
+                continue  # Deleted while its MAT was decoded
+            try:
+                width, height, pixels = future.result()
+            except Exception as err:
+                self.failed += 1
+                warnings.warn("Could not decode {}: {}".format(
+                    bl_img[DEFERRED_PATH_KEY], err), ValueWarning)
+                continue
+            bl_img.scale(width, height)
+            bl_img.pixels[:] = pixels
+            del bl_img[DEFERRED_PATH_KEY]
+            del bl_img[DEFERRED_SIZE_KEY]
+        return len(self.pending)
+
+    def close(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.executor.shutdown(wait=False)
+        self.pending.clear()
+
+
 class MaterialManager:
 
     instance = None
     mfilepath = ""
+    lazy_textures = False
 
     def __init__(self):
         self.mtimages = {}  # Texnum -> Blender image
         self.mtexs = {}  # Texnum -> Blender texture
         self.materials = {}  # texnum, lf -> Blender material
+        # MAT folder -> downscaled texnum -> full size texnum
+        self.base_texnums = {}
 
     @classmethod
     def set_mfilepath(self, mfilepath):
         self.mfilepath = mfilepath
 
+    @classmethod
+    def set_lazy_textures(self, lazy_textures):
+        self.lazy_textures = lazy_textures
+
     @classmethod
     def get_instance(self):
         if self.instance is None:
@@ -79,8 +177,19 @@ class MaterialManager:
                     isfile(join(abs_dir, dirent))):
                 return normpath(join(abs_dir, dirent))
 
+    def base_texnum(self, texnum):
+        """Get the texture number of the full size texture, if texnum is a
+        downscaled texture the exporter built for a distant LOD."""
+        mfiledir = self.mfilepath[:self.mfilepath.rfind(dirsep)]
+        matdir = texbuild.mat_dir(mfiledir)
+        if matdir not in self.base_texnums:
+            self.base_texnums[matdir] = texbuild.BuildCache(
+                matdir).base_texnums()
+        return self.base_texnums[matdir].get(texnum, texnum)
+
     def get_teximg(self, texnum):
         from os.path import join
+        texnum = self.base_texnum(texnum)
         if texnum in self.mtimages:
             return self.mtimages[texnum]
 
@@ -116,27 +225,32 @@ class MaterialManager:
             self.mtimages[texnum] = None
             return None
 
-        if mat_fname.lower().endswith("mat"):
-            mat_reader = mat_read.MATReader(mat_fname)
-            mat_reader.read()
-            mat_reader.flip_y()
+        if mat_fname.lower().endswith("mat") and self.lazy_textures:
+            # Use a one pixel placeholder, and decode the MAT later
+            with mat_read.MATStream(mat_fname) as mat_stream:
+                size = mat_stream.width, mat_stream.height
+            bl_img = bpy.data.images.new(
+                mat_fname[mat_fname.rfind(dirsep):], 1, 1, True)
+            bl_img.pixels[:] = PLACEHOLDER_COLOUR
+            bl_img[DEFERRED_PATH_KEY] = mat_fname
+            bl_img[DEFERRED_SIZE_KEY] = size
+            self.mtimages[texnum] = bl_img
+        elif mat_fname.lower().endswith("mat"):
+            width, height, pixels = decode_mat(mat_fname)
             bl_img = bpy.data.images.new(
-                mat_fname[mat_fname.rfind(dirsep):],
-                mat_reader.img_width,
-                mat_reader.img_height,
-                True
-            )
-            bl_img.pixels = [
-                x / 255 for x in mat_reader.pixels.tolist()]
+                mat_fname[mat_fname.rfind(dirsep):], width, height, True)
+            bl_img.pixels[:] = pixels
             self.mtimages[texnum] = bl_img
         else:
-            # mat_fname is not a MAT.
+            # mat_fname is not a MAT. Blender only reads the pixels of
+            # loaded images when they are first used.
             bl_img = bpy.data.images.load(mat_fname)
             self.mtimages[texnum] = bl_img
 
         return bl_img
 
     def get_material(self, texnum, light_flags):
+        texnum = self.base_texnum(texnum)
         if (texnum, light_flags) in self.materials:
             return self.materials[(texnum, light_flags)]
 
@@ -184,7 +298,8 @@ class ImportBackend:
                  reorient_matrix,
                  # import_all_lods=False,
                  # use_facetex=False,
-                 import_bsp=False):
+                 import_bsp=False,
+                 lazy_textures=False):
 
         self.mfilepath = filepath
         self.texmats = {}
@@ -199,6 +314,7 @@ class ImportBackend:
         self.lod_meshes = []
         self.base_name = filepath[filepath.rfind(dirsep) + 1:-4]
         MaterialManager.set_mfilepath(filepath)  # Setup MaterialManager
+        MaterialManager.set_lazy_textures(lazy_textures)
 
 
 class LODMesh:
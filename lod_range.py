@@ -0,0 +1,352 @@
+# -*- coding: utf8 -*-
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+
+# LOD range (RANG) selection based on the geometric error of each LOD.
+#
+# The error of a LOD is its Hausdorff distance from LOD 0, estimated by
+# sampling points on each surface, and finding the closest point on the
+# other surface using a uniform grid of triangles. The LOD range is the
+# distance at which that error is smaller than a given number of pixels on
+# screen.
+import time
+from math import sqrt, tan, radians, floor
+
+try:
+    from . import iff_mesh
+except ImportError:
+    # Not imported as part of the add-on (ex. by the unit tests)
+    import iff_mesh
+
+
+def packed_tris(packed):
+    "Split the faces of a PackedLOD into a list of triangles (3 points)."
+    if not isinstance(packed, iff_mesh.PackedLOD):
+        raise TypeError("packed must be a PackedLOD!")
+    tris = []
+    for face_idx in range(packed.num_faces):
+        pts = [packed.vertex(packed.fvrt_verts[fvrt])
+               for fvrt in packed.face_fvrts(face_idx)]
+        for corner in range(1, len(pts) - 1):
+            tris.append((pts[0], pts[corner], pts[corner + 1]))
+    return tris
+
+
+def _tri_area(tri):
+    a, b, c = tri
+    abx, aby, abz = b[0] - a[0], b[1] - a[1], b[2] - a[2]
+    acx, acy, acz = c[0] - a[0], c[1] - a[1], c[2] - a[2]
+    cx = aby * acz - abz * acy
+    cy = abz * acx - abx * acz
+    cz = abx * acy - aby * acx
+    return sqrt(cx * cx + cy * cy + cz * cz) / 2
+
+
+def closest_point_dist2(pt, tri):
+    """Squared distance from a point to a triangle.
+
+    From "Real-Time Collision Detection" by Christer Ericson."""
+    a, b, c = tri
+    px, py, pz = pt
+    abx, aby, abz = b[0] - a[0], b[1] - a[1], b[2] - a[2]
+    acx, acy, acz = c[0] - a[0], c[1] - a[1], c[2] - a[2]
+    apx, apy, apz = px - a[0], py - a[1], pz - a[2]
+    d1 = abx * apx + aby * apy + abz * apz
+    d2 = acx * apx + acy * apy + acz * apz
+    if d1 <= 0 and d2 <= 0:
+        return apx * apx + apy * apy + apz * apz  # Vertex A
+
+    bpx, bpy, bpz = px - b[0], py - b[1], pz - b[2]
+    d3 = abx * bpx + aby * bpy + abz * bpz
+    d4 = acx * bpx + acy * bpy + acz * bpz
+    if d3 >= 0 and d4 <= d3:
+        return bpx * bpx + bpy * bpy + bpz * bpz  # Vertex B
+
+    vc = d1 * d4 - d3 * d2
+    if vc <= 0 and d1 >= 0 and d3 <= 0:
+        v = d1 / (d1 - d3)  # Edge AB
+        qx, qy, qz = a[0] + abx * v, a[1] + aby * v, a[2] + abz * v
+        return (px - qx) ** 2 + (py - qy) ** 2 + (pz - qz) ** 2
+
+    cpx, cpy, cpz = px - c[0], py - c[1], pz - c[2]
+    d5 = abx * cpx + aby * cpy + abz * cpz
+    d6 = acx * cpx + acy * cpy + acz * cpz
+    if d6 >= 0 and d5 <= d6:
+        return cpx * cpx + cpy * cpy + cpz * cpz  # Vertex C
+
+    vb = d5 * d2 - d1 * d6
+    if vb <= 0 and d2 >= 0 and d6 <= 0:
+        w = d2 / (d2 - d6)  # Edge AC
+        qx, qy, qz = a[0] + acx * w, a[1] + acy * w, a[2] + acz * w
+        return (px - qx) ** 2 + (py - qy) ** 2 + (pz - qz) ** 2
+
+    va = d3 * d6 - d5 * d4
+    if va <= 0 and (d4 - d3) >= 0 and (d5 - d6) >= 0:
+        w = (d4 - d3) / ((d4 - d3) + (d5 - d6))  # Edge BC
+        qx = b[0] + (c[0] - b[0]) * w
+        qy = b[1] + (c[1] - b[1]) * w
+        qz = b[2] + (c[2] - b[2]) * w
+        return (px - qx) ** 2 + (py - qy) ** 2 + (pz - qz) ** 2
+
+    denom = 1 / (va + vb + vc)  # Inside the triangle
+    v = vb * denom
+    w = vc * denom
+    qx = a[0] + abx * v + acx * w
+    qy = a[1] + aby * v + acy * w
+    qz = a[2] + abz * v + acz * w
+    return (px - qx) ** 2 + (py - qy) ** 2 + (pz - qz) ** 2
+
+
+class TriangleGrid:
+    """A sparse uniform grid of triangles, for closest point queries.
+
+    Each triangle is added to every cell that its bounding box overlaps.
+    The cell size is about twice the average triangle size."""
+
+    # Maximum number of cells along each axis
+    MAX_DIM = 128
+
+    def __init__(self, tris):
+        self.tris = tris
+        if len(tris) == 0:
+            raise ValueError("Cannot make a triangle grid with no triangles!")
+        lo = [min(min(pt[ax] for pt in tri) for tri in tris)
+              for ax in range(3)]
+        hi = [max(max(pt[ax] for pt in tri) for tri in tris)
+              for ax in range(3)]
+        max_extent = max(max(hi[ax] - lo[ax] for ax in range(3)), 1e-6)
+        avg_area = sum(map(_tri_area, tris)) / len(tris)
+        self.cell_size = max(2 * sqrt(avg_area), max_extent / self.MAX_DIM)
+        self.origin = tuple(lo)
+        self.dims = tuple(int((hi[ax] - lo[ax]) // self.cell_size) + 1
+                          for ax in range(3))
+
+        # Bounding sphere (centroid and radius) of each triangle, used to
+        # skip triangles that cannot be closer than the closest one so far.
+        self.bounds = []
+        for a, b, c in tris:
+            cen = tuple((a[ax] + b[ax] + c[ax]) / 3 for ax in range(3))
+            rad2 = max(sum((pt[ax] - cen[ax]) ** 2 for ax in range(3))
+                       for pt in (a, b, c))
+            self.bounds.append(cen + (sqrt(rad2),))
+
+        self.cells = {}
+        for tri_idx, tri in enumerate(tris):
+            c0 = self.cell_of(tuple(min(pt[ax] for pt in tri)
+                                    for ax in range(3)))
+            c1 = self.cell_of(tuple(max(pt[ax] for pt in tri)
+                                    for ax in range(3)))
+            for i in range(c0[0], c1[0] + 1):
+                for j in range(c0[1], c1[1] + 1):
+                    for k in range(c0[2], c1[2] + 1):
+                        self.cells.setdefault((i, j, k), []).append(tri_idx)
+
+    def cell_of(self, pt):
+        "Grid coordinates of the cell containing a point (may be outside)."
+        return tuple(int(floor((pt[ax] - self.origin[ax]) / self.cell_size))
+                     for ax in range(3))
+
+    def _shell(self, centre, radius):
+        "Occupied cells at a Chebyshev distance of radius from centre."
+        ci, cj, ck = centre
+        for i in range(ci - radius, ci + radius + 1):
+            edge_i = i == ci - radius or i == ci + radius
+            for j in range(cj - radius, cj + radius + 1):
+                edge_j = edge_i or j == cj - radius or j == cj + radius
+                if edge_j:
+                    krange = range(ck - radius, ck + radius + 1)
+                else:
+                    krange = (ck - radius, ck + radius)
+                for k in krange:
+                    tri_idxs = self.cells.get((i, j, k))
+                    if tri_idxs is not None:
+                        yield tri_idxs
+
+    def distance(self, pt):
+        """Distance from a point to the closest triangle.
+
+        Cells are searched in shells around the point's cell, and the search
+        stops once the closest triangle is closer than any cell outside of
+        the shells searched so far."""
+        centre = self.cell_of(pt)
+        # Shell radius at which the whole grid has been searched
+        max_radius = max(
+            max(abs(centre[ax]), abs(centre[ax] - self.dims[ax] + 1))
+            for ax in range(3))
+        px, py, pz = pt
+        # Bounds of the point's cell
+        lo = [self.origin[ax] + centre[ax] * self.cell_size
+              for ax in range(3)]
+        hi = [coord + self.cell_size for coord in lo]
+        best = float("inf")
+        best2 = best
+        tested = set()
+        radius = 0
+        while radius <= max_radius:
+            for tri_idxs in self._shell(centre, radius):
+                for tri_idx in tri_idxs:
+                    if tri_idx in tested:
+                        continue
+                    tested.add(tri_idx)
+                    cx, cy, cz, crad = self.bounds[tri_idx]
+                    cdist = sqrt((px - cx) ** 2 + (py - cy) ** 2 +
+                                 (pz - cz) ** 2)
+                    if cdist - crad >= best:
+                        continue
+                    dist2 = closest_point_dist2(pt, self.tris[tri_idx])
+                    if dist2 < best2:
+                        best2 = dist2
+                        best = sqrt(dist2)
+            # Distance from the point to the nearest cell outside this shell
+            margin = min(min(pt[ax] - lo[ax], hi[ax] - pt[ax])
+                         for ax in range(3)) + radius * self.cell_size
+            if best <= margin:
+                break
+            radius += 1
+        return best
+
+
+def surface_samples(tris, max_samples=4000):
+    """Sample points on a triangle surface.
+
+    The samples are the vertices, the centroids, and three points inside
+    each triangle. If there are more than max_samples, an evenly spaced
+    subset is used, so the result is deterministic."""
+    samples = set()
+    for tri in tris:
+        samples.update(tri)
+    interior = []
+    for a, b, c in tris:
+        for wa, wb, wc in ((1 / 3, 1 / 3, 1 / 3), (2 / 3, 1 / 6, 1 / 6),
+                           (1 / 6, 2 / 3, 1 / 6), (1 / 6, 1 / 6, 2 / 3)):
+            interior.append(tuple(a[ax] * wa + b[ax] * wb + c[ax] * wc
+                                  for ax in range(3)))
+    samples = sorted(samples) + interior
+    num = len(samples)
+    if num <= max_samples:
+        return samples
+    return [samples[i * num // max_samples] for i in range(max_samples)]
+
+
+def hausdorff(tris_a, tris_b, grid_a=None, grid_b=None, max_samples=4000):
+    """Estimate the symmetric Hausdorff distance between two surfaces.
+
+    grid_a and grid_b are TriangleGrids for tris_a and tris_b; they are
+    made if they are not given."""
+    if grid_a is None:
+        grid_a = TriangleGrid(tris_a)
+    if grid_b is None:
+        grid_b = TriangleGrid(tris_b)
+    dist = 0.0
+    for pt in surface_samples(tris_a, max_samples):
+        dist = max(dist, grid_b.distance(pt))
+    for pt in surface_samples(tris_b, max_samples):
+        dist = max(dist, grid_a.distance(pt))
+    return dist
+
+
+def range_for_error(error, pixel_tolerance, fov, resolution):
+    """Distance at which a geometric error is pixel_tolerance pixels wide.
+
+    fov is the vertical field of view in degrees, and resolution is the
+    vertical screen resolution in pixels."""
+    if pixel_tolerance <= 0:
+        raise ValueError("The pixel tolerance must be positive!")
+    if not 0 < fov < 180:
+        raise ValueError("The field of view must be between 0 and 180 "
+                         "degrees!")
+    return error * resolution / (2 * tan(radians(fov) / 2) * pixel_tolerance)
+
+
+class RangeSolver:
+    """Calculates LOD ranges from the geometric error of each LOD.
+
+    lods is a list of PackedLODs, with None for empty LODs."""
+
+    def __init__(self, lods, pixel_tolerance=1.0, fov=60.0, resolution=768,
+                 max_samples=4000):
+        if len(lods) == 0 or lods[0] is None:
+            raise ValueError("LOD 0 must be a mesh!")
+        self.pixel_tolerance = pixel_tolerance
+        self.fov = fov
+        self.resolution = resolution
+        start = time.perf_counter()
+        lod0_tris = packed_tris(lods[0])
+        lod0_grid = TriangleGrid(lod0_tris)
+        self.errors = [0.0]
+        for lod in lods[1:]:
+            if lod is None:
+                self.errors.append(None)
+                continue
+            lod_tris = packed_tris(lod)
+            if len(lod_tris) == 0:
+                self.errors.append(None)
+                continue
+            self.errors.append(hausdorff(lod0_tris, lod_tris, lod0_grid,
+                                         max_samples=max_samples))
+        self.solve_time = time.perf_counter() - start
+
+    def ranges(self, fixed=None):
+        """Get the LOD ranges.
+
+        fixed is an optional list of LOD ranges, with None for the LODs
+        that should get a calculated range. Fixed ranges are kept as they
+        are. Each calculated range is the distance at which the LOD's error
+        is within the pixel tolerance, but never less than the range of
+        the LOD before it, or more than a fixed range after it. Empty LODs
+        get the range of the LOD before them, unless they are fixed."""
+        if fixed is None:
+            fixed = [None] * len(self.errors)
+        dranges = []
+        for lod_idx, error in enumerate(self.errors):
+            if lod_idx == 0:
+                drange = 0.0
+            elif fixed[lod_idx] is not None:
+                drange = float(fixed[lod_idx])
+            elif error is None:
+                drange = dranges[-1]
+            else:
+                drange = max(dranges[-1], range_for_error(
+                    error, self.pixel_tolerance, self.fov, self.resolution))
+            dranges.append(drange)
+        # Calculated ranges must not go past a fixed range after them.
+        limit = None
+        for lod_idx in range(len(dranges) - 1, 0, -1):
+            if fixed[lod_idx] is not None:
+                limit = dranges[lod_idx]
+            elif limit is not None:
+                dranges[lod_idx] = min(dranges[lod_idx], limit)
+        return dranges
+
+    def fmt_report(self, dranges=None):
+        "Format the errors and ranges of each LOD as a string."
+        if dranges is None:
+            dranges = self.ranges()
+        lines = ["LOD ranges for {:.1f} pixels at {:.0f} degrees FOV, {} "
+                 "pixels high:".format(self.pixel_tolerance, self.fov,
+                                       self.resolution)]
+        for lod_idx, (error, drange) in enumerate(zip(self.errors, dranges)):
+            if error is None:
+                lines.append("LOD {}: empty, range {:.1f}".format(
+                    lod_idx, drange))
+            else:
+                lines.append("LOD {}: error {:.4f}, range {:.1f}".format(
+                    lod_idx, error, drange))
+        lines.append("Solved in {:.2f} seconds".format(self.solve_time))
+        return "\n".join(lines)
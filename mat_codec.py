@@ -0,0 +1,102 @@
+# -*- coding: utf8 -*-
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+
+
+# MAT and palette codec
+#
+# Decodes and encodes the data of the chunks that make up MATs and palettes
+# (CMAP, NAME, PXLS, and ALPH). It is shared by the importer, the exporter,
+# and the utilities. Pixels are converted with bytes.translate and slice
+# assignment, which work on a whole image at once, instead of one pixel at
+# a time in Python.
+
+_INVERT = bytes(range(255, -1, -1))
+_OPAQUE = b"\x00" + b"\xff" * 255  # Palette index -> default alpha
+
+# Placeholder palette for MATs whose palette cannot be found
+GRAYSCALE = bytes(value for value in range(256) for chan in range(3))
+
+
+def read_cstr(data, offset=0):
+    "Read a null terminated ASCII string."
+    data = bytes(data)
+    end = data.find(b"\x00", offset)
+    if end < 0:
+        end = len(data)
+    return data[offset:end].decode("ascii", "ignore")
+
+
+def parse_cmap(data):
+    """Get the colours from the data of a CMAP chunk.
+
+    Returns 768 bytes (R, G, B for each colour). Missing colours are
+    black."""
+    return bytes(data[:768]).ljust(768, b"\x00")
+
+
+def palette_name(data):
+    "Get the palette name from the data of a NAME chunk."
+    return read_cstr(data).strip(" \t")
+
+
+def channel(cmap, chan):
+    "Get the table that maps palette indices to one channel of a colour."
+    return bytes(cmap[chan::3]).ljust(256, b"\x00")
+
+
+def default_alpha(indices):
+    "Get the alpha of each pixel of a MAT without an ALPH chunk."
+    return bytes(indices).translate(_OPAQUE)
+
+
+def decode_alph(data):
+    """Get the alpha of each pixel from the data of an ALPH chunk.
+
+    ALPH values are inverted: 0 is opaque, and 255 is transparent."""
+    return bytes(data).translate(_INVERT)
+
+
+def encode_alph(alpha):
+    "Get the data of an ALPH chunk from the alpha of each pixel."
+    return bytes(alpha).translate(_INVERT)
+
+
+def decode_rgb(indices, cmap):
+    "Get the RGB bytes of each pixel from the data of a PXLS chunk."
+    indices = bytes(indices)
+    rgb = bytearray(len(indices) * 3)
+    for chan in range(3):
+        rgb[chan::3] = indices.translate(channel(cmap, chan))
+    return bytes(rgb)
+
+
+def decode_rgba(indices, cmap, alph=None):
+    """Get the RGBA bytes of each pixel from the data of a PXLS chunk.
+
+    Colour 0 is transparent, unless the data of the ALPH chunk is given."""
+    indices = bytes(indices)
+    rgba = bytearray(len(indices) * 4)
+    for chan in range(3):
+        rgba[chan::4] = indices.translate(channel(cmap, chan))
+    if alph is None:
+        rgba[3::4] = default_alpha(indices)
+    else:
+        rgba[3::4] = decode_alph(alph)
+    return bytes(rgba)
@@ -21,9 +21,16 @@
 # MAT reader
 import struct
 import array
+import mmap
 import os
 import os.path
-from . import iff_read
+
+try:
+    from . import iff_read, mat_codec
+except ImportError:
+    # Not imported as part of the add-on (ex. by the unit tests)
+    import iff_read
+    import mat_codec
 
 
 class MATReader:
@@ -32,6 +39,7 @@ class MATReader:
         self.matfpath = matfpath
         self.iff_reader = iff_read.IffReader(matfpath)
         self.palette = None  # To be initialized in read_palette
+        self.palette_path = None  # Path of the external palette, if any
         self.pixels = None  # To be initialized in read_info
 
     def look_for(self, fname, in_dir, par_dir=True):
@@ -62,15 +70,16 @@ class MATReader:
         self.img_width, self.img_height = dimensions
         # Image width * height * 4 channels per pixel (RGB + Alpha)
         self.pixels = array.array(
-            'B', [0 for x in range(self.img_width * self.img_height * 4)])
+            'B', bytes(self.img_width * self.img_height * 4))
 
     def read_palette(self, cmap_chunk):
         # Each colour is three bytes (R, G, B)
         if cmap_chunk["name"] == b"CMAP":
-            self.palette = array.array("B", cmap_chunk["data"])
+            self.palette = array.array(
+                "B", mat_codec.parse_cmap(cmap_chunk["data"]))
             return self.palette
         elif cmap_chunk["name"] == b"NAME":
-            palname = cmap_chunk["data"].decode("ascii").strip(" \x00\t")
+            palname = mat_codec.palette_name(cmap_chunk["data"])
             palname = palname.lower() + ".pal"
             palpath = self.look_for(palname, "pal")
             if palpath is not None:
@@ -78,32 +87,31 @@ class MATReader:
                 palform = palreader.read_data()
                 if palform["type"] == "form" and palform["name"] == b"PAL ":
                     paldata = palreader.read_data()
-                    self.palette = array.array("B", paldata["data"])
+                    self.palette = array.array(
+                        "B", mat_codec.parse_cmap(paldata["data"]))
+                    self.palette_path = palpath
                     return self.palette
 
-        # Generate placeholder grayscale palette
-        gspal = []
-        for x in range(256): gspal.extend([x] * 3)
-        self.palette = array.array("B", gspal)
+        # Use a placeholder grayscale palette
+        self.palette = array.array("B", mat_codec.GRAYSCALE)
         return self.palette
 
     def read_pxls(self, pxls_chunk):
-        # One byte references a colour in the palette
-        for cpxl in range(pxls_chunk["length"]):
-            palref = struct.unpack_from(
-                "<B", pxls_chunk["data"], cpxl)[0]
-
-            self.pixels[cpxl * 4:cpxl * 4 + 3] = (
-                self.palette[palref * 3:palref * 3 + 3])
-            # Colour at index 0 is transparent by default.
-            self.pixels[cpxl * 4 + 3] = 0 if palref == 0 else 255
+        # One byte references a colour in the palette. Colour at index 0 is
+        # transparent by default.
+        palette = self.palette
+        if palette is None:
+            palette = mat_codec.GRAYSCALE
+        rgba = mat_codec.decode_rgba(
+            pxls_chunk["data"][:self.img_width * self.img_height], palette)
+        self.pixels[:len(rgba)] = array.array("B", rgba)
 
     def read_alph(self, alph_chunk):
         # One byte for each pixel. The alpha channel is inverted,
         # so 255 would be fully transparent, and 0 is fully opaque
-        for apxl in range(alph_chunk["length"]):
-            self.pixels[apxl * 4 + 3] = 255 - (struct.unpack_from(
-                "<B", alph_chunk["data"], apxl)[0])
+        alpha = mat_codec.decode_alph(
+            alph_chunk["data"][:self.img_width * self.img_height])
+        self.pixels[3:len(alpha) * 4:4] = array.array("B", alpha)
 
     def read(self):
         root_form = self.iff_reader.read_data()
@@ -155,3 +163,146 @@ class MATReader:
 
         for row in reversed(img_rows):
             self.pixels.extend(row)
+
+
+class MATStream:
+    """Decodes the pixels of a MAT a few rows at a time.
+
+    Only the small chunks (INFO and the palette) are read when the MAT is
+    opened. The PXLS and ALPH data is read from a memory map of the file,
+    or from the file itself if it cannot be mapped, as each row or tile is
+    decoded, so the whole image is never held in memory. Use it as a
+    context manager, or call close when done with it.
+
+    palettes is an optional dict, shared between streams, that caches the
+    external palettes found for each folder, so they are only looked up
+    and read once."""
+
+    def __init__(self, matfpath, palettes=None):
+        self.matfpath = matfpath
+        self.width = self.height = self.wrap = None
+        self.palette = None
+        self.palette_path = None  # Path of the external palette, if any
+        self.palettes = palettes
+        self._pxls = None  # Offset of the PXLS data
+        self._alph = None  # Offset of the ALPH data, if there is one
+        self._file = open(matfpath, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self._map = None
+        try:
+            self._scan()
+        except Exception:
+            self.close()
+            raise
+
+    def _read(self, offset, size):
+        if self._map is not None:
+            return self._map[offset:offset + size]
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def _header(self, offset):
+        "Read the ID and length of the chunk or form at an offset."
+        head = self._read(offset, 8)
+        if len(head) < 8:
+            raise TypeError("{} is truncated!".format(self.matfpath))
+        return head[:4], struct.unpack(">I", head[4:])[0]
+
+    def _scan(self):
+        "Find the chunks of the MAT."
+        for offset, name in ((0, b"BITM"), (12, b"FRAM")):
+            head, length = self._header(offset)
+            if head != b"FORM" or self._read(offset + 8, 4) != name:
+                raise TypeError("Invalid texture! (expected form {})".format(
+                                name))
+        end = 20 + length
+        offset = 24
+        while offset < end:
+            head, length = self._header(offset)
+            if head == b"FORM" and self._read(offset + 8, 4) == b"PAL ":
+                pal_head, pal_length = self._header(offset + 12)
+                self._read_palette({
+                    "name": pal_head,
+                    "data": self._read(offset + 20, pal_length)})
+            elif head == b"INFO":
+                self.width, self.height, self.wrap = struct.unpack_from(
+                    "<III", self._read(offset + 8, 12).ljust(12, b"\x00"))
+            elif head == b"PXLS":
+                self._pxls = offset + 8, length
+            elif head == b"ALPH":
+                self._alph = offset + 8, length
+            offset += 8 + length + (length & 1)
+        if self.width is None or self._pxls is None:
+            raise TypeError("Invalid texture! (no INFO or PXLS chunk)")
+        num_pixels = self.width * self.height
+        if (self._pxls[1] < num_pixels or
+                self._alph is not None and self._alph[1] < num_pixels):
+            raise TypeError("{} is truncated!".format(self.matfpath))
+        if self.palette is None:
+            self._read_palette({"name": None})  # Grayscale palette
+
+    def _read_palette(self, cmap_chunk):
+        "Read the palette like MATReader does, looking up external ones."
+        key = None
+        if cmap_chunk["name"] == b"NAME" and self.palettes is not None:
+            key = (os.path.dirname(os.path.abspath(self.matfpath)),
+                   mat_codec.palette_name(cmap_chunk["data"]).lower())
+            if key in self.palettes:
+                self.palette, self.palette_path = self.palettes[key]
+                return
+        reader = MATReader(self.matfpath)
+        try:
+            self.palette = reader.read_palette(cmap_chunk)
+        finally:
+            reader.iff_reader.close()
+        self.palette_path = reader.palette_path
+        if key is not None:
+            self.palettes[key] = self.palette, self.palette_path
+
+    def decode(self, offsets, count):
+        """Decode runs of count pixels, starting at each offset (in pixels
+        from the top left corner). Returns their RGBA bytes."""
+        indices = b"".join(self._read(self._pxls[0] + offset, count)
+                           for offset in offsets)
+        alph = None
+        if self._alph is not None:
+            alph = b"".join(self._read(self._alph[0] + offset, count)
+                            for offset in offsets)
+        return mat_codec.decode_rgba(indices, self.palette, alph)
+
+    def rows(self, start=0, stop=None, flip=False):
+        """Yield the RGBA bytes of each row from start to stop.
+
+        The rows are yielded from the top down, or from the bottom up (like
+        Blender images) if flip is True."""
+        stop = self.height if stop is None else min(stop, self.height)
+        order = range(start, stop)
+        for row in (reversed(order) if flip else order):
+            yield self.decode((row * self.width,), self.width)
+
+    def tiles(self, tile_width, tile_height):
+        """Yield the (x, y, width, height, RGBA bytes) of each tile.
+
+        Tiles at the right and bottom edges may be smaller."""
+        for top in range(0, self.height, tile_height):
+            height = min(tile_height, self.height - top)
+            for left in range(0, self.width, tile_width):
+                width = min(tile_width, self.width - left)
+                yield left, top, width, height, self.decode(
+                    [row * self.width + left
+                     for row in range(top, top + height)], width)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,274 @@
+# -*- coding: utf8 -*-
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+
+# MAT writer
+#
+# Converts RGBA images to 256 colour MAT textures. Each pixel is mapped to
+# the nearest colour in the palette through a colour cube: the RGB colour
+# space is split into 32x32x32 cells, and the palette index for each cell
+# is worked out the first time a pixel falls in it, from a short list of
+# candidate colours for the 16x16x16 box the cell is in. Palette colours map
+# to themselves exactly.
+import array
+import os
+import sys
+from itertools import compress, repeat
+from operator import add, le
+
+try:
+    from . import iff, iff_read, mat_codec
+except ImportError:
+    # Not imported as part of the add-on (ex. by the unit tests)
+    import iff
+    import iff_read
+    import mat_codec
+
+# Pixels are handled as 32-bit integers (R | G << 8 | B << 16 | A << 24)
+_KEY_TYPE = "I" if array.array("I").itemsize == 4 else "L"
+_OPAQUE = b"\x00" + b"\x01" * 255  # Alpha -> 1 if the pixel is visible
+
+CELL_BITS = 5  # Bits per channel for the colour cube cells
+BOX_BITS = 4  # Bits per channel for the boxes the candidate lists are for
+_TO_CELL = bytes(value >> (8 - CELL_BITS) for value in range(256))
+
+
+def pixel_keys(rgba):
+    "Get an array of 32-bit pixel values from RGBA bytes."
+    keys = array.array(_KEY_TYPE)
+    keys.frombytes(bytes(rgba))
+    if sys.byteorder == "big":
+        keys.byteswap()
+    return keys
+
+
+def key_bytes(keys):
+    "Get RGBA bytes from 32-bit pixel values. The reverse of pixel_keys."
+    keys = array.array(_KEY_TYPE, keys)
+    if sys.byteorder == "big":
+        keys.byteswap()
+    return keys.tobytes()
+
+
+def cell_keys(rgba):
+    """Get the colour cube cell of each pixel.
+
+    Returns the same 32-bit values as pixel_keys, except that each channel
+    is reduced to CELL_BITS bits, and alpha is 1 if the pixel is visible,
+    and 0 if it is transparent."""
+    rgba = bytes(rgba)
+    cells = bytearray(len(rgba))
+    for chan in range(3):
+        cells[chan::4] = rgba[chan::4].translate(_TO_CELL)
+    cells[3::4] = rgba[3::4].translate(_OPAQUE)
+    return pixel_keys(cells)
+
+
+def _axis_dists(values, low, high):
+    """Minimum and maximum squared distances from each value to an interval.
+
+    The interval is [low, high]."""
+    dmins = []
+    dmaxs = []
+    for value in values:
+        if value < low:
+            dmin = low - value
+        elif value > high:
+            dmin = value - high
+        else:
+            dmin = 0
+        dmax = max(value - low, high - value)
+        dmins.append(dmin * dmin)
+        dmaxs.append(dmax * dmax)
+    return dmins, dmaxs
+
+
+class Palette:
+    """A 256 colour palette.
+
+    cmap holds the R, G, and B values of each colour. If name is given, MATs
+    using this palette refer to the external palette <name>.pal instead of
+    embedding the colours. Colour 0 is used for transparent pixels."""
+
+    def __init__(self, cmap, name=None):
+        cmap = bytes(cmap)
+        if len(cmap) != 768:
+            raise ValueError("A palette must have 256 colours!")
+        if name is not None and not 0 < len(name) <= 8:
+            raise ValueError("Palette names must be 1 to 8 characters long!")
+        self.cmap = cmap
+        self.name = name
+        self.colours = [tuple(cmap[idx:idx + 3]) for idx in range(0, 768, 3)]
+        self._exact = {}  # Opaque pixel key -> index of that colour
+        for idx in range(255, 0, -1):
+            red, green, blue = self.colours[idx]
+            self._exact[red | green << 8 | blue << 16 | 0xFF000000] = idx
+        # Distances from colours 1-255 to each box, along each axis
+        size = 1 << (8 - BOX_BITS)
+        self._axes = [[_axis_dists(cmap[3 + axis::3], box * size,
+                                   box * size + size - 1)
+                       for box in range(1 << BOX_BITS)] for axis in range(3)]
+        self._boxes = {}  # Box -> candidate palette indices
+        self._cells = {}  # Cell key -> palette index
+
+    @classmethod
+    def from_pal_file(cls, palpath, name=None):
+        "Read the colours from a .pal file."
+        reader = iff_read.IffReader(palpath)
+        try:
+            pal_form = reader.read_data()
+            cmap_chunk = reader.read_data()
+        finally:
+            reader.close()
+        if (pal_form["type"] != "form" or pal_form["name"] != b"PAL " or
+                cmap_chunk["name"] != b"CMAP"):
+            raise TypeError("{} is not a valid palette!".format(palpath))
+        return cls(cmap_chunk["data"][:768], name)
+
+    def candidates(self, box):
+        """Get the palette indices that can be nearest to a colour in a box.
+
+        The box is an (R, G, B) tuple of the top BOX_BITS bits of each
+        channel. A colour can only be nearest to a point in the box if its
+        minimum distance to the box is not more than the smallest maximum
+        distance of any colour to the box."""
+        cands = self._boxes.get(box)
+        if cands is not None:
+            return cands
+        (rmins, rmaxs), (gmins, gmaxs), (bmins, bmaxs) = (
+            axis[chan] for axis, chan in zip(self._axes, box))
+        limit = min(map(add, map(add, rmaxs, gmaxs), bmaxs))
+        dmins = map(add, map(add, rmins, gmins), bmins)
+        cands = self._boxes[box] = list(compress(
+            range(1, 256), map(le, dmins, repeat(limit))))
+        return cands
+
+    def nearest(self, red, green, blue):
+        "Get the index of the nearest colour, other than colour 0."
+        shift = 8 - BOX_BITS
+        colours = self.colours
+        best = best_dist = None
+        for idx in self.candidates((red >> shift, green >> shift,
+                                    blue >> shift)):
+            pred, pgreen, pblue = colours[idx]
+            dist = ((pred - red) * (pred - red) +
+                    (pgreen - green) * (pgreen - green) +
+                    (pblue - blue) * (pblue - blue))
+            if best_dist is None or dist < best_dist:
+                best, best_dist = idx, dist
+        return best
+
+    def _cell_index(self, cell):
+        "Get the palette index for a cell key."
+        idx = self._cells.get(cell)
+        if idx is None:
+            if cell >> 24 == 0:
+                idx = 0  # Transparent
+            else:
+                # Use the colour nearest to the middle of the cell
+                shift = 8 - CELL_BITS
+                half = 1 << (shift - 1)
+                idx = self.nearest((cell & 0xFF) << shift | half,
+                                   (cell >> 8 & 0xFF) << shift | half,
+                                   (cell >> 16 & 0xFF) << shift | half)
+            self._cells[cell] = idx
+        return idx
+
+    def map_pixels(self, rgba):
+        """Map RGBA pixels to palette indices.
+
+        Returns a bytes object with the palette index of each pixel.
+        Transparent pixels (alpha 0) get colour 0, and opaque pixels that
+        are exactly a palette colour get that colour."""
+        cells = cell_keys(rgba)
+        lookup = {cell: self._cell_index(cell) for cell in set(cells)}
+        indices = bytes(map(lookup.__getitem__, cells))
+        keys = pixel_keys(rgba)
+        if self._exact.keys().isdisjoint(keys):
+            return indices
+        return bytes(map(self._exact.get, keys, indices))
+
+    def to_form(self):
+        "Make the PAL form used in a MAT."
+        pal_form = iff.IffForm("PAL ")
+        if self.name is not None:
+            pal_form.add_member(iff.IffChunk("NAME", [self.name.upper()]))
+        else:
+            pal_form.add_member(iff.IffChunk("CMAP", [self.cmap]))
+        return pal_form
+
+    def write_pal(self, palpath):
+        "Write the colours of this palette to a .pal file."
+        pal_form = iff.IffForm("PAL ", [iff.IffChunk("CMAP", [self.cmap])])
+        with open(palpath, "wb") as pal_file:
+            pal_file.write(pal_form.to_bytes())
+
+
+class MATWriter:
+    """Writes an RGBA image to a MAT file.
+
+    rgba holds four bytes (R, G, B, A) for each pixel, starting with the top
+    row. The ALPH chunk is only written if alpha is True, or, if alpha is
+    None, if any pixel is partially transparent."""
+
+    def __init__(self, matfpath, width, height, rgba, palette, wrap=0,
+                 alpha=None):
+        if not isinstance(palette, Palette):
+            raise TypeError("palette must be a Palette!")
+        if width <= 0 or height <= 0:
+            raise ValueError("MAT dimensions must be positive!")
+        if len(rgba) != width * height * 4:
+            raise ValueError("Expected {} bytes of RGBA data, got {}!".format(
+                width * height * 4, len(rgba)))
+        self.matfpath = matfpath
+        self.width = width
+        self.height = height
+        self.rgba = bytes(rgba)
+        self.palette = palette
+        self.wrap = wrap
+        self.alpha = alpha
+
+    def alpha_bytes(self):
+        "The inverted alpha values for the ALPH chunk, or None."
+        if self.alpha is False:
+            return None
+        alpha = self.rgba[3::4]
+        if self.alpha is None and not alpha.translate(None, b"\x00\xff"):
+            return None  # Colour 0 is enough to make pixels transparent
+        return mat_codec.encode_alph(alpha)
+
+    def to_form(self):
+        "Make the BITM form."
+        fram_form = iff.IffForm("FRAM")
+        fram_form.add_member(iff.IffChunk(
+            "INFO", [self.width, self.height, self.wrap]))
+        fram_form.add_member(self.palette.to_form())
+        fram_form.add_member(iff.IffChunk(
+            "PXLS", [self.palette.map_pixels(self.rgba)]))
+        alpha = self.alpha_bytes()
+        if alpha is not None:
+            fram_form.add_member(iff.IffChunk("ALPH", [alpha]))
+        return iff.IffForm("BITM", [fram_form])
+
+    def write(self):
+        "Write the MAT file."
+        tmp_path = self.matfpath + ".tmp"
+        with open(tmp_path, "wb") as mat_file:
+            mat_file.write(self.to_form().to_bytes())
+        os.replace(tmp_path, self.matfpath)
@@ -0,0 +1,733 @@
+# -*- coding: utf8 -*-
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+
+# Export-time optimization passes for LOD meshes.
+#
+# Each pass takes a PackedLOD, and returns a new PackedLOD, along with a
+# dict of statistics that can be formatted with fmt_stats.
+import array
+from itertools import product
+from math import sqrt, cos, radians, degrees, acos
+
+try:
+    from . import iff_mesh
+except ImportError:
+    # Not imported as part of the add-on (ex. by the unit tests)
+    import iff_mesh
+
+# Maximum number of vertices in a merged face
+MAX_FACE_VERTS = 32
+
+# How far the UV coordinates of merged faces may be from a shared mapping
+UV_EPSILON = 1e-4
+
+# Number of vertices in the simulated vertex cache used for statistics
+CACHE_SIZE = 16
+
+# Size of each VERT, VTNM, FVRT, and FACE record, in bytes
+VERT_SIZE = 12
+VTNM_SIZE = 12
+FVRT_SIZE = 16
+FACE_SIZE = 28
+
+
+def _newell_normal(pts):
+    "Unit normal of a polygon, or None if it has no area."
+    nx = ny = nz = 0.0
+    npts = len(pts)
+    for i in range(npts):
+        x1, y1, z1 = pts[i]
+        x2, y2, z2 = pts[(i + 1) % npts]
+        nx += (y1 - y2) * (z1 + z2)
+        ny += (z1 - z2) * (x1 + x2)
+        nz += (x1 - x2) * (y1 + y2)
+    nlen = sqrt(nx * nx + ny * ny + nz * nz)
+    if nlen < 1e-12:
+        return None
+    return nx / nlen, ny / nlen, nz / nlen
+
+
+def _check_packed(packed):
+    if not isinstance(packed, iff_mesh.PackedLOD):
+        raise TypeError("The mesh to optimize must be a PackedLOD!")
+
+
+class HalfEdgeMesh:
+    """Half-edge connectivity for the faces of a PackedLOD.
+
+    Half-edges are stored in parallel arrays. Half-edge h starts at the
+    vertex of FVRT he_fvrt[h], and goes to the start of he_next[h]. Its
+    twin (the same edge in the opposite direction, in the adjacent face) is
+    he_twin[h], or -1 on a border or non-manifold edge. face_he[f] is one
+    of the half-edges of face f, or -1 if the face has been removed."""
+
+    def __init__(self, packed):
+        _check_packed(packed)
+        self.packed = packed
+        self.he_fvrt = array.array("i")
+        self.he_vert = array.array("i")
+        self.he_next = array.array("i")
+        self.he_face = array.array("i")
+        self.face_he = array.array("i")
+        for face_idx in range(packed.num_faces):
+            fvrts = packed.face_fvrts(face_idx)
+            first_he = len(self.he_fvrt)
+            self.face_he.append(first_he)
+            for corner, fvrt in enumerate(fvrts):
+                self.he_fvrt.append(fvrt)
+                self.he_vert.append(packed.fvrt_verts[fvrt])
+                self.he_face.append(face_idx)
+                self.he_next.append(first_he + (corner + 1) % len(fvrts))
+
+        # Edges used by more than one half-edge in the same direction are
+        # non-manifold, and are left without twins.
+        self.he_twin = array.array("i", [-1]) * len(self.he_fvrt)
+        edges = {}
+        for hedge in range(len(self.he_fvrt)):
+            key = (self.he_vert[hedge], self.he_vert[self.he_next[hedge]])
+            edges[key] = hedge if key not in edges else -1
+        for (va, vb), hedge in edges.items():
+            if hedge < 0:
+                continue
+            twin = edges.get((vb, va), -1)
+            if twin >= 0:
+                self.he_twin[hedge] = twin
+
+    def loop(self, face_idx):
+        "Half-edges of a face, in order."
+        first = self.face_he[face_idx]
+        hedges = [first]
+        hedge = self.he_next[first]
+        while hedge != first:
+            hedges.append(hedge)
+            hedge = self.he_next[hedge]
+        return hedges
+
+    def prev(self, hedge):
+        "The half-edge before a half-edge in its face."
+        prev = hedge
+        while self.he_next[prev] != hedge:
+            prev = self.he_next[prev]
+        return prev
+
+    def shared_chain(self, hedge):
+        """The run of consecutive half-edges around hedge that its face shares
+        with the face of its twin, in order. None if hedge has no twin."""
+        twin = self.he_twin[hedge]
+        if twin < 0:
+            return None
+        other = self.he_face[twin]
+        chain = [hedge]
+        limit = len(self.loop(self.he_face[hedge]))
+        # In the other face, the twins are in the opposite order.
+        nxt = self.he_next[hedge]
+        while len(chain) < limit:
+            ntwin = self.he_twin[nxt]
+            if ntwin < 0 or self.he_face[ntwin] != other or (
+                    self.he_next[ntwin] != self.he_twin[chain[-1]]):
+                break
+            chain.append(nxt)
+            nxt = self.he_next[nxt]
+        prv = self.prev(hedge)
+        while len(chain) < limit:
+            ptwin = self.he_twin[prv]
+            if ptwin < 0 or self.he_face[ptwin] != other or (
+                    self.he_next[self.he_twin[chain[0]]] != ptwin):
+                break
+            chain.insert(0, prv)
+            prv = self.prev(prv)
+        return chain
+
+    def merge(self, chain):
+        """Remove a chain of edges between two faces.
+
+        chain is a list of consecutive half-edges, as returned by
+        shared_chain. The face of their twins is merged into their face, and
+        removed. Returns the index of the removed face."""
+        first = chain[0]
+        last = chain[-1]
+        face = self.he_face[first]
+        gone = self.he_face[self.he_twin[first]]
+        for other in self.loop(gone):
+            self.he_face[other] = face
+        h_prev = self.prev(first)
+        t_prev = self.prev(self.he_twin[last])
+        self.he_next[h_prev] = self.he_next[self.he_twin[first]]
+        self.he_next[t_prev] = self.he_next[last]
+        self.face_he[face] = h_prev
+        self.face_he[gone] = -1
+        for hedge in chain:
+            self.he_twin[self.he_twin[hedge]] = -1
+            self.he_twin[hedge] = -1
+        return gone
+
+
+def merge_coplanar(packed, angle=0.5, max_verts=MAX_FACE_VERTS):
+    """Merge adjacent coplanar faces into convex polygons.
+
+    Two faces are merged if they share an edge, have the same texture
+    number, light flags, and shading, their normals are within angle
+    degrees of each other, the FVRTs (normal and UV coordinates) at both
+    ends of the shared edge are the same, the UV coordinates of both faces
+    are the same affine mapping of the plane, and the merged polygon is
+    convex and has no more than max_verts vertices. Each face is greedily
+    merged with its neighbours, in face order.
+
+    The UV mapping has to be shared, because the merged polygon may be
+    triangulated differently, and the UV coordinates are interpolated
+    across each triangle. Otherwise, the texture would be distorted."""
+    _check_packed(packed)
+    mesh = HalfEdgeMesh(packed)
+    min_cos = cos(radians(angle))
+    verts = packed.verts
+    uvs = packed.fvrt_uvs
+
+    def pos(vidx):
+        return verts[vidx * 3], verts[vidx * 3 + 1], verts[vidx * 3 + 2]
+
+    def same_corner(fv_a, fv_b):
+        return (packed.fvrt_norms[fv_a] == packed.fvrt_norms[fv_b] and
+                uvs[fv_a * 2] == uvs[fv_b * 2] and
+                uvs[fv_a * 2 + 1] == uvs[fv_b * 2 + 1])
+
+    def corner_uv(fvrt):
+        return uvs[fvrt * 2], uvs[fvrt * 2 + 1]
+
+    face_normals = [_newell_normal([pos(packed.fvrt_verts[fv])
+                                    for fv in packed.face_fvrts(face_idx)])
+                    for face_idx in range(packed.num_faces)]
+
+    def merge_chain(hedge):
+        "The chain of edges to remove to merge across hedge, or None."
+        twin = mesh.he_twin[hedge]
+        if twin < 0:
+            return None
+        fa = mesh.he_face[hedge]
+        fb = mesh.he_face[twin]
+        if fa == fb:
+            return None
+        if (packed.face_texnums[fa] != packed.face_texnums[fb] or
+                packed.face_lflags[fa] != packed.face_lflags[fb] or
+                packed.face_smooth[fa] != packed.face_smooth[fb]):
+            return None
+        na = face_normals[fa]
+        nb = face_normals[fb]
+        if na is None or nb is None:
+            return None
+        if na[0] * nb[0] + na[1] * nb[1] + na[2] * nb[2] < min_cos:
+            return None
+        chain = mesh.shared_chain(hedge)
+        loop_a = mesh.loop(fa)
+        loop_b = mesh.loop(fb)
+        if len(chain) >= min(len(loop_a), len(loop_b)):
+            return None
+        # FVRTs must match at every vertex along the chain, so the UVs and
+        # normals are continuous across it.
+        for edge in chain:
+            etwin = mesh.he_twin[edge]
+            if not (same_corner(mesh.he_fvrt[edge],
+                                mesh.he_fvrt[mesh.he_next[etwin]]) and
+                    same_corner(mesh.he_fvrt[etwin],
+                                mesh.he_fvrt[mesh.he_next[edge]])):
+                return None
+        # Every corner of face B must be where face A's UV mapping puts it.
+        uv_map = _uv_map([pos(mesh.he_vert[he]) for he in loop_a],
+                         [corner_uv(mesh.he_fvrt[he]) for he in loop_a])
+        if uv_map is None:
+            return None
+        for he in loop_b:
+            u, v = uv_map(pos(mesh.he_vert[he]))
+            uv_b = corner_uv(mesh.he_fvrt[he])
+            if abs(u - uv_b[0]) > UV_EPSILON or abs(v - uv_b[1]) > UV_EPSILON:
+                return None
+        # The merged polygon: the rest of face A, then the rest of face B.
+        # The vertices inside the chain are not part of it.
+        nchain = len(chain)
+        if len(loop_a) + len(loop_b) - 2 * nchain > max_verts:
+            return None
+        ia = loop_a.index(chain[0])
+        ib = loop_b.index(mesh.he_twin[chain[-1]])
+        merged = ((loop_a[ia:] + loop_a[:ia])[nchain:] +
+                  (loop_b[ib:] + loop_b[:ib])[nchain:])
+        merged_verts = [mesh.he_vert[he] for he in merged]
+        if len(set(merged_verts)) != len(merged_verts):
+            return None  # The merged face would have a hole in it
+        if not _is_convex([pos(vidx) for vidx in merged_verts], na):
+            return None
+        return chain
+
+    for face_idx in range(packed.num_faces):
+        if mesh.face_he[face_idx] < 0:
+            continue
+        merged_any = True
+        while merged_any:
+            merged_any = False
+            for hedge in mesh.loop(face_idx):
+                chain = merge_chain(hedge)
+                if chain is not None:
+                    mesh.merge(chain)
+                    merged_any = True
+                    break
+
+    result = packed.empty_copy()
+    for face_idx in range(packed.num_faces):
+        if mesh.face_he[face_idx] < 0:
+            continue
+        loop = mesh.loop(face_idx)
+        # Start at the face's original first FVRT if it is still there.
+        first = packed.face_first[face_idx]
+        for corner, hedge in enumerate(loop):
+            if mesh.he_fvrt[hedge] == first:
+                loop = loop[corner:] + loop[:corner]
+                break
+        _add_face_from(result, packed, face_idx,
+                       [mesh.he_fvrt[hedge] for hedge in loop])
+
+    stats = {
+        "pass": "Coplanar face merge",
+        "faces": (packed.num_faces, result.num_faces),
+        "fvrts": (len(packed.fvrt_verts), len(result.fvrt_verts)),
+    }
+    return result, stats
+
+
+def _is_convex(pts, normal, eps=1e-6):
+    "Check whether a polygon is convex, when viewed along its normal."
+    npts = len(pts)
+    for i in range(npts):
+        a = pts[i - 1]
+        b = pts[i]
+        c = pts[(i + 1) % npts]
+        ab = (b[0] - a[0], b[1] - a[1], b[2] - a[2])
+        bc = (c[0] - b[0], c[1] - b[1], c[2] - b[2])
+        cross = (ab[1] * bc[2] - ab[2] * bc[1],
+                 ab[2] * bc[0] - ab[0] * bc[2],
+                 ab[0] * bc[1] - ab[1] * bc[0])
+        turn = (cross[0] * normal[0] + cross[1] * normal[1] +
+                cross[2] * normal[2])
+        scale = sqrt((ab[0] ** 2 + ab[1] ** 2 + ab[2] ** 2) *
+                     (bc[0] ** 2 + bc[1] ** 2 + bc[2] ** 2))
+        if turn < -eps * scale:
+            return False
+    return True
+
+
+def _uv_map(pts, uv_pts):
+    """The affine mapping from the plane of a polygon to its UV coordinates.
+
+    The mapping is worked out from three corners of the polygon that are
+    far apart, and returned as a function from a point on the plane to a
+    (U, V) tuple. Returns None if the polygon has no area."""
+    def sub(a, b):
+        return a[0] - b[0], a[1] - b[1], a[2] - b[2]
+
+    def dot(a, b):
+        return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+    def cross_len2(a, b):
+        cx = a[1] * b[2] - a[2] * b[1]
+        cy = a[2] * b[0] - a[0] * b[2]
+        cz = a[0] * b[1] - a[1] * b[0]
+        return cx * cx + cy * cy + cz * cz
+
+    origin = pts[0]
+    i1 = max(range(len(pts)),
+             key=lambda i: dot(sub(pts[i], origin), sub(pts[i], origin)))
+    edge1 = sub(pts[i1], origin)
+    i2 = max(range(len(pts)),
+             key=lambda i: cross_len2(edge1, sub(pts[i], origin)))
+    edge2 = sub(pts[i2], origin)
+    d11 = dot(edge1, edge1)
+    d12 = dot(edge1, edge2)
+    d22 = dot(edge2, edge2)
+    det = d11 * d22 - d12 * d12
+    if det <= 1e-12 * d11 * d22 or det == 0:
+        return None
+    u0, v0 = uv_pts[0]
+    du1, dv1 = uv_pts[i1][0] - u0, uv_pts[i1][1] - v0
+    du2, dv2 = uv_pts[i2][0] - u0, uv_pts[i2][1] - v0
+
+    def uv_at(pt):
+        offset = sub(pt, origin)
+        b1 = dot(offset, edge1)
+        b2 = dot(offset, edge2)
+        s = (d22 * b1 - d12 * b2) / det
+        t = (d11 * b2 - d12 * b1) / det
+        return u0 + s * du1 + t * du2, v0 + s * dv1 + t * dv2
+    return uv_at
+
+
+def _add_face_from(result, packed, face_idx, fvrts):
+    """Add a face to result, using the FACE data of a face in packed.
+
+    fvrts is a list of FVRT indices in packed. The D-Plane is recalculated
+    from the first vertex, since it may have changed."""
+    norm_idx = packed.face_norms[face_idx]
+    nx, ny, nz = packed.norms[norm_idx * 3:norm_idx * 3 + 3]
+    vidx = packed.fvrt_verts[fvrts[0]]
+    vx, vy, vz = packed.verts[vidx * 3:vidx * 3 + 3]
+    dplane = -(nx * vx + ny * vy + nz * vz)
+    uvs = packed.fvrt_uvs
+    result.add_face(
+        norm_idx, dplane, packed.face_texnums[face_idx],
+        [(packed.fvrt_verts[fv], packed.fvrt_norms[fv], uvs[fv * 2],
+          uvs[fv * 2 + 1]) for fv in fvrts],
+        packed.face_lflags[face_idx], packed.face_smooth[face_idx])
+
+
+def mesh_bytes(packed):
+    "Size of the VERT, VTNM, FVRT, and FACE chunk data of a PackedLOD."
+    return (packed.num_verts * VERT_SIZE +
+            len(packed.norms) // 3 * VTNM_SIZE +
+            len(packed.fvrt_verts) * FVRT_SIZE +
+            packed.num_faces * FACE_SIZE)
+
+
+def weld_map(verts, distance):
+    """Map each vertex to the first vertex within distance of it.
+
+    verts is a flat sequence of coordinates, like PackedLOD.verts. Vertices
+    are bucketed in a spatial hash with cells distance units wide, so only
+    the vertices in the 27 cells around each vertex are compared. If
+    distance is 0, only vertices at exactly the same position are welded."""
+    num_verts = len(verts) // 3
+    if distance <= 0:
+        first_at = {}
+        return [first_at.setdefault(tuple(verts[vidx * 3:vidx * 3 + 3]),
+                                    vidx)
+                for vidx in range(num_verts)]
+    dist2 = distance * distance
+    cells = {}
+    remap = []
+    for vidx in range(num_verts):
+        vx, vy, vz = verts[vidx * 3:vidx * 3 + 3]
+        cx = int(vx // distance)
+        cy = int(vy // distance)
+        cz = int(vz // distance)
+        target = vidx
+        for ox in (cx - 1, cx, cx + 1):
+            for oy in (cy - 1, cy, cy + 1):
+                for oz in (cz - 1, cz, cz + 1):
+                    for other in cells.get((ox, oy, oz), ()):
+                        dx = verts[other * 3] - vx
+                        dy = verts[other * 3 + 1] - vy
+                        dz = verts[other * 3 + 2] - vz
+                        if (dx * dx + dy * dy + dz * dz <= dist2 and
+                                other < target):
+                            target = other
+        if target == vidx:
+            cells.setdefault((cx, cy, cz), []).append(vidx)
+        remap.append(target)
+    return remap
+
+
+def compact(packed, weld_distance=0.0):
+    """Remove unused and duplicate data from a PackedLOD.
+
+    Vertices within weld_distance of each other are welded, and vertices
+    and normals that are not used by any face are removed. Faces that
+    become degenerate after welding are removed, and faces with the same
+    FVRTs share them, since a FACE only refers to a range of FVRTs. The
+    D-Plane of each face is recalculated from its first vertex, since
+    welding may have moved it, like in _add_face_from."""
+    _check_packed(packed)
+    remap = weld_map(packed.verts, weld_distance)
+
+    # Remap the corners of each face, and drop the ones that collapsed.
+    faces = []
+    used_verts = set()
+    used_norms = set()
+    for face_idx in range(packed.num_faces):
+        corners = []
+        for fvrt in packed.face_fvrts(face_idx):
+            vidx = remap[packed.fvrt_verts[fvrt]]
+            if corners and corners[-1][0] == vidx:
+                continue
+            corners.append((vidx, fvrt))
+        while len(corners) > 1 and corners[0][0] == corners[-1][0]:
+            corners.pop()
+        if len(corners) < 3:
+            continue
+        faces.append((face_idx, corners))
+        used_verts.update(vidx for vidx, fvrt in corners)
+        used_norms.update(packed.fvrt_norms[fvrt] for vidx, fvrt in corners)
+        used_norms.add(packed.face_norms[face_idx])
+
+    result = iff_mesh.PackedLOD()
+    new_vert = {}
+    for vidx in sorted(used_verts):
+        new_vert[vidx] = result.add_vertex(*packed.vertex(vidx))
+    new_norm = {}
+    for nidx in sorted(used_norms):
+        new_norm[nidx] = result.add_normal(
+            *packed.norms[nidx * 3:nidx * 3 + 3])
+
+    uvs = packed.fvrt_uvs
+    fvrt_runs = {}
+    for face_idx, corners in faces:
+        run = tuple((new_vert[vidx], new_norm[packed.fvrt_norms[fvrt]],
+                     uvs[fvrt * 2], uvs[fvrt * 2 + 1])
+                    for vidx, fvrt in corners)
+        first = fvrt_runs.get(run)
+        if first is None:
+            first = len(result.fvrt_verts)
+            fvrt_runs[run] = first
+            for vidx, nidx, uv_x, uv_y in run:
+                result.fvrt_verts.append(vidx)
+                result.fvrt_norms.append(nidx)
+                result.fvrt_uvs.extend((uv_x, uv_y))
+        norm_idx = packed.face_norms[face_idx]
+        nx, ny, nz = packed.norms[norm_idx * 3:norm_idx * 3 + 3]
+        vx, vy, vz = packed.vertex(corners[0][0])
+        result.face_norms.append(new_norm[norm_idx])
+        result.face_dplanes.append(-(nx * vx + ny * vy + nz * vz))
+        result.face_texnums.append(packed.face_texnums[face_idx])
+        result.face_first.append(first)
+        result.face_nverts.append(len(run))
+        result.face_lflags.append(packed.face_lflags[face_idx])
+        result.face_smooth.append(packed.face_smooth[face_idx])
+
+    stats = {
+        "pass": "Compaction",
+        "verts": (packed.num_verts, result.num_verts),
+        "norms": (len(packed.norms) // 3, len(result.norms) // 3),
+        "fvrts": (len(packed.fvrt_verts), len(result.fvrt_verts)),
+        "faces": (packed.num_faces, result.num_faces),
+        "bytes": (mesh_bytes(packed), mesh_bytes(result)),
+    }
+    return result, stats
+
+
+def cluster_normals(packed, tolerance=1.0):
+    """Merge normals that are within tolerance degrees of each other.
+
+    Face normals are kept as they are, since the D-Plane of each face is
+    calculated from them, and the other normals are replaced by the first
+    face normal or other normal within tolerance degrees of them. Normals
+    are bucketed in a 3D grid of cubes tolerance radians wide. Two unit
+    vectors within tolerance of each other are less than tolerance apart
+    along each axis, so only the normals in the 27 cubes around each normal
+    have to be compared. Unlike a 2D projection of the sphere, the grid has
+    no seams for nearby normals to fall on opposite sides of."""
+    _check_packed(packed)
+    norms = packed.norms
+    num_norms = len(norms) // 3
+    min_cos = cos(radians(tolerance))
+    cell_size = max(radians(tolerance), 1e-6)
+    cells = {}
+    remap = [None] * num_norms
+    max_error = 1.0  # Cosine of the largest angle between merged normals
+
+    def normal(nidx):
+        nx, ny, nz = norms[nidx * 3:nidx * 3 + 3]
+        nlen = sqrt(nx * nx + ny * ny + nz * nz) or 1.0
+        return nx / nlen, ny / nlen, nz / nlen
+
+    def cell_of(nvec):
+        return tuple(int(coord // cell_size) for coord in nvec)
+
+    def add_rep(nidx):
+        nvec = normal(nidx)
+        cells.setdefault(cell_of(nvec), []).append((nidx, nvec))
+        remap[nidx] = nidx
+
+    for nidx in packed.face_norms:
+        if remap[nidx] is None:
+            add_rep(nidx)
+    for nidx in range(num_norms):
+        if remap[nidx] is not None:
+            continue
+        nvec = normal(nidx)
+        cx, cy, cz = cell_of(nvec)
+        best = None
+        best_cos = min_cos
+        for cell in product((cx - 1, cx, cx + 1), (cy - 1, cy, cy + 1),
+                            (cz - 1, cz, cz + 1)):
+            for other, ovec in cells.get(cell, ()):
+                ncos = (nvec[0] * ovec[0] + nvec[1] * ovec[1] +
+                        nvec[2] * ovec[2])
+                if ncos >= best_cos:
+                    best = other
+                    best_cos = ncos
+        if best is None:
+            add_rep(nidx)
+        else:
+            remap[nidx] = best
+            max_error = min(max_error, best_cos)
+
+    result = iff_mesh.PackedLOD()
+    result.verts.extend(packed.verts)
+    new_norm = {}
+    for nidx in range(num_norms):
+        if remap[nidx] == nidx:
+            new_norm[nidx] = result.add_normal(*norms[nidx * 3:nidx * 3 + 3])
+    result.fvrt_verts.extend(packed.fvrt_verts)
+    result.fvrt_norms.extend(new_norm[remap[nidx]]
+                             for nidx in packed.fvrt_norms)
+    result.fvrt_uvs.extend(packed.fvrt_uvs)
+    result.face_norms.extend(new_norm[nidx] for nidx in packed.face_norms)
+    result.face_dplanes.extend(packed.face_dplanes)
+    result.face_texnums.extend(packed.face_texnums)
+    result.face_first.extend(packed.face_first)
+    result.face_nverts.extend(packed.face_nverts)
+    result.face_lflags.extend(packed.face_lflags)
+    result.face_smooth.extend(packed.face_smooth)
+
+    stats = {
+        "pass": "Normal clustering",
+        "norms": (num_norms, len(result.norms) // 3),
+        "max error (degrees)": degrees(acos(min(1.0, max_error))),
+    }
+    return result, stats
+
+
+def texnum_runs(packed):
+    "Number of runs of faces with the same texture number and light flags."
+    runs = 0
+    last = None
+    for face in zip(packed.face_texnums, packed.face_lflags):
+        if face != last:
+            runs += 1
+            last = face
+    return runs
+
+
+def cache_misses(packed, cache_size=CACHE_SIZE):
+    """Average number of vertex cache misses per face.
+
+    The cache is simulated as a FIFO of the last cache_size vertices."""
+    if packed.num_faces == 0:
+        return 0.0
+    cache = []
+    cached = set()
+    misses = 0
+    for face_idx in range(packed.num_faces):
+        for fvrt in packed.face_fvrts(face_idx):
+            vidx = packed.fvrt_verts[fvrt]
+            if vidx in cached:
+                continue
+            misses += 1
+            cache.append(vidx)
+            cached.add(vidx)
+            if len(cache) > cache_size:
+                cached.discard(cache.pop(0))
+    return misses / packed.num_faces
+
+
+def _morton3(x, y, z):
+    "Interleave the bits of three 10-bit integers."
+    code = 0
+    for bit in range(10):
+        code |= (((x >> bit) & 1) << (bit * 3) |
+                 ((y >> bit) & 1) << (bit * 3 + 1) |
+                 ((z >> bit) & 1) << (bit * 3 + 2))
+    return code
+
+
+def reorder_faces(packed):
+    """Sort faces by texture, and then by position.
+
+    Faces are grouped by texture number and light flags, in the order each
+    group first appears, so the renderer switches textures as few times as
+    possible. Within each group, faces are sorted by the Morton code of
+    their centers, so nearby faces are drawn together. The FVRTs are
+    rewritten in the new face order, and vertices are renumbered in the
+    order they are first used."""
+    _check_packed(packed)
+    centers = []
+    for face_idx in range(packed.num_faces):
+        fvrts = packed.face_fvrts(face_idx)
+        center = [0.0, 0.0, 0.0]
+        for fvrt in fvrts:
+            vidx = packed.fvrt_verts[fvrt]
+            for axis in range(3):
+                center[axis] += packed.verts[vidx * 3 + axis]
+        centers.append([coord / len(fvrts) for coord in center])
+    if centers:
+        lo = [min(center[axis] for center in centers) for axis in range(3)]
+        hi = [max(center[axis] for center in centers) for axis in range(3)]
+        scale = [1023 / (hi[axis] - lo[axis]) if hi[axis] > lo[axis] else 0
+                 for axis in range(3)]
+
+    group_order = {}
+    sort_keys = []
+    for face_idx in range(packed.num_faces):
+        group = (packed.face_texnums[face_idx], packed.face_lflags[face_idx])
+        group_idx = group_order.setdefault(group, len(group_order))
+        cell = [int((centers[face_idx][axis] - lo[axis]) * scale[axis])
+                for axis in range(3)]
+        sort_keys.append((group_idx, _morton3(*cell), face_idx))
+    sort_keys.sort()
+
+    result = iff_mesh.PackedLOD()
+    result.norms.extend(packed.norms)
+    result._norm_idxs.update(packed._norm_idxs)
+    new_vert = {}
+    new_first = {}  # Faces that shared FVRTs still share them.
+    for group_idx, code, face_idx in sort_keys:
+        first = packed.face_first[face_idx]
+        if first not in new_first:
+            new_first[first] = len(result.fvrt_verts)
+            for fvrt in packed.face_fvrts(face_idx):
+                vidx = packed.fvrt_verts[fvrt]
+                if vidx not in new_vert:
+                    new_vert[vidx] = result.add_vertex(*packed.vertex(vidx))
+                result.fvrt_verts.append(new_vert[vidx])
+                result.fvrt_norms.append(packed.fvrt_norms[fvrt])
+                result.fvrt_uvs.extend(packed.fvrt_uvs[fvrt * 2:fvrt * 2 + 2])
+        result.face_norms.append(packed.face_norms[face_idx])
+        result.face_dplanes.append(packed.face_dplanes[face_idx])
+        result.face_texnums.append(packed.face_texnums[face_idx])
+        result.face_first.append(new_first[first])
+        result.face_nverts.append(packed.face_nverts[face_idx])
+        result.face_lflags.append(packed.face_lflags[face_idx])
+        result.face_smooth.append(packed.face_smooth[face_idx])
+    # Keep the vertices that no face uses, at the end.
+    for vidx in range(packed.num_verts):
+        if vidx not in new_vert:
+            new_vert[vidx] = result.add_vertex(*packed.vertex(vidx))
+
+    stats = {
+        "pass": "Face reordering",
+        "texnum runs": (texnum_runs(packed), texnum_runs(result)),
+        "cache misses/face": "{:.3f} -> {:.3f}".format(
+            cache_misses(packed), cache_misses(result)),
+    }
+    return result, stats
+
+
+def fmt_stats(stats):
+    "Format the statistics of an optimization pass as a string."
+    parts = []
+    for key, value in sorted(stats.items()):
+        if key == "pass":
+            continue
+        if isinstance(value, tuple):
+            before, after = value
+            if before:
+                parts.append("{} {} -> {} ({:+.1%})".format(
+                    key, before, after, after / before - 1))
+            else:
+                parts.append("{} {} -> {}".format(key, before, after))
+        elif isinstance(value, float):
+            parts.append("{} {:.4f}".format(key, value))
+        else:
+            parts.append("{} {}".format(key, value))
+    return "{}: {}".format(stats["pass"], ", ".join(parts))
@@ -0,0 +1,261 @@
+# -*- coding: utf8 -*-
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+
+# Palette builder
+#
+# Builds one 256 colour palette for a set of textures. The visible pixels of
+# each image are sampled into a reservoir of bounded size, so memory use
+# stays the same however many images there are. The samples are quantized
+# with median cut, and the colours are refined with a few k-means passes.
+import heapq
+import random
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from itertools import accumulate, compress, count, groupby
+from math import exp, floor, log, log1p, sqrt
+from operator import mul
+
+try:
+    from . import mat_write
+except ImportError:
+    # Not imported as part of the add-on (ex. by the unit tests)
+    import mat_write
+
+SAMPLE_SIZE = 65536  # Pixels sampled from all of the images
+ERROR_SAMPLE_SIZE = 4096  # Pixels sampled from each image to measure error
+
+
+class Reservoir:
+    """A uniform random sample of at most size items from a stream.
+
+    Uses Li's "Algorithm L", which works out how many items to skip before
+    the next one to keep, so it needs far fewer random numbers than there
+    are items."""
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.items = []
+        self.seen = 0  # Number of items in the stream so far
+        self.rng = rng
+        self._weight = None
+        self._next = None  # Index of the next item to keep
+
+    def _random(self):
+        return 1.0 - self.rng.random()  # Never 0, so it has a logarithm
+
+    def _skip(self):
+        "Pick the index of the next item to keep."
+        self._weight *= exp(log(self._random()) / self.size)
+        if self._weight <= 0.0:
+            self._next = float("inf")
+        else:
+            self._next += floor(
+                log(self._random()) / log1p(-self._weight)) + 1
+
+    def add_all(self, items):
+        "Add a sequence of items to the stream."
+        start = 0
+        if len(self.items) < self.size:
+            start = min(self.size - len(self.items), len(items))
+            self.items.extend(items[:start])
+            self.seen += start
+            if len(self.items) == self.size:
+                self._weight = 1.0
+                self._next = self.seen - 1
+                self._skip()
+        first = self.seen - start  # Index of items[0] in the stream
+        self.seen += len(items) - start
+        while self._next is not None and self._next < self.seen:
+            self.items[self.rng.randrange(self.size)] = items[
+                self._next - first]
+            self._skip()
+
+
+class Box:
+    """A box of colours for median cut.
+
+    chans holds the red, green, and blue values of the colours in the box,
+    as one list per channel, and counts holds the number of pixels that
+    have each colour. Keeping each channel in its own list lets the box be
+    measured, sorted, and averaged by built-in functions."""
+
+    def __init__(self, chans, counts):
+        self.chans = chans
+        self.counts = counts
+        self.weight = sum(counts)
+        ranges = [max(chan) - min(chan) for chan in chans]
+        self.axis = ranges.index(max(ranges))
+        # Boxes with many pixels and a wide range of colours are split first
+        self.priority = self.weight * ranges[self.axis]
+
+    def split(self):
+        "Split the box in two at the median of its widest channel."
+        chan = self.chans[self.axis]
+        order = sorted(range(len(chan)), key=chan.__getitem__)
+        chans = [[values[idx] for idx in order] for values in self.chans]
+        counts = [self.counts[idx] for idx in order]
+        split = bisect_left(list(accumulate(counts)), self.weight / 2) + 1
+        split = min(split, len(counts) - 1)
+        return (Box([values[:split] for values in chans], counts[:split]),
+                Box([values[split:] for values in chans], counts[split:]))
+
+    def mean(self):
+        "Get the average colour of the pixels in the box."
+        return tuple(int(sum(map(mul, values, self.counts)) / self.weight +
+                         0.5) for values in self.chans)
+
+
+def _columns(keys):
+    "Split 24-bit colour keys into a list of values for each channel."
+    return [[key >> shift & 0xFF for key in keys] for shift in (0, 8, 16)]
+
+
+def median_cut(counts, num_colours):
+    """Quantize colours with median cut.
+
+    counts maps 24-bit colour keys (R | G << 8 | B << 16) to the number of
+    pixels that have each colour. Returns a list of up to num_colours
+    (R, G, B) tuples."""
+    if not counts:
+        raise ValueError("There are no colours to quantize!")
+    heap = []
+    order = count()  # Tie breaker, so boxes are never compared
+
+    def push(box):
+        heapq.heappush(heap, (-box.priority, next(order), box))
+
+    push(Box(_columns(counts.keys()), list(counts.values())))
+    while len(heap) < num_colours and heap[0][0] < 0:
+        for box in heapq.heappop(heap)[2].split():
+            push(box)
+    return [box.mean() for priority, order_, box in heap]
+
+
+def make_cmap(colours):
+    """Make a palette's colour map from 1 to 255 colours.
+
+    Colour 0 is black, and is used for transparent pixels. Unused colours
+    are copies of colour 1, so no pixel is ever mapped to them."""
+    colours = list(colours[:255])
+    colours += colours[:1] * (255 - len(colours))
+    return bytes(3) + b"".join(map(bytes, colours))
+
+
+def refine(counts, colours, passes):
+    """Improve quantized colours with k-means passes.
+
+    Each pass moves every colour to the average of the sampled colours
+    that are mapped to it."""
+    colours = list(colours)
+    chans = _columns(counts.keys())
+    weights = list(counts.values())
+    rgba = mat_write.key_bytes(
+        [key | 0xFF000000 for key in counts.keys()])
+    for kpass in range(passes):
+        indices = mat_write.Palette(make_cmap(colours)).map_pixels(rgba)
+        # Sort the sampled colours by palette index, so each cluster is a
+        # slice of the sorted lists.
+        order = sorted(range(len(indices)), key=indices.__getitem__)
+        sorted_chans = [[values[idx] for idx in order] for values in chans]
+        sorted_weights = [weights[idx] for idx in order]
+        start = 0
+        for idx, cluster in groupby(indices[idx] for idx in order):
+            end = start + sum(1 for sample in cluster)
+            colours[idx - 1] = Box(
+                [values[start:end] for values in sorted_chans],
+                sorted_weights[start:end]).mean()
+            start = end
+    return colours
+
+
+class PaletteBuilder:
+    """Builds a palette for a set of images.
+
+    Add each image with add_image, and then call build to get the palette,
+    and errors to see how well each image fits it."""
+
+    def __init__(self, sample_size=SAMPLE_SIZE, seed=0):
+        self.rng = random.Random(seed)
+        self.samples = Reservoir(sample_size, self.rng)
+        self.image_samples = OrderedDict()  # Image name -> pixel keys
+
+    def add_image(self, name, rgba):
+        "Sample the visible pixels of an image, given as RGBA bytes."
+        rgba = bytes(rgba)
+        keys = list(compress(mat_write.pixel_keys(rgba), rgba[3::4]))
+        self.samples.add_all(keys)
+        image_sample = Reservoir(ERROR_SAMPLE_SIZE, self.rng)
+        image_sample.add_all(keys)
+        self.image_samples[name] = image_sample.items
+
+    def build(self, name=None, num_colours=255, passes=2):
+        "Build the palette. Colour 0 is kept for transparent pixels."
+        if not 1 <= num_colours <= 255:
+            raise ValueError("A palette can have 1 to 255 colours!")
+        if not self.samples.items:
+            raise ValueError("The images have no visible pixels!")
+        counts = Counter(key & 0xFFFFFF for key in self.samples.items)
+        colours = median_cut(counts, num_colours)
+        colours = refine(counts, colours, passes)
+        return mat_write.Palette(make_cmap(sorted(colours)), name)
+
+    def errors(self, palette):
+        """Measure how well each image fits a palette.
+
+        Returns a dict mapping each image name to the root mean square
+        distance between its sampled pixels and their palette colours."""
+        errors = OrderedDict()
+        cmap = palette.cmap
+        for name, keys in self.image_samples.items():
+            if not keys:
+                errors[name] = 0.0
+                continue
+            rgba = mat_write.key_bytes(keys)
+            total = 0
+            for pxl, idx in enumerate(palette.map_pixels(rgba)):
+                for chan in range(3):
+                    diff = rgba[pxl * 4 + chan] - cmap[idx * 3 + chan]
+                    total += diff * diff
+            errors[name] = sqrt(total / len(keys))
+        return errors
+
+
+def palette_for_images(images, name=None):
+    """Build a palette for a set of images.
+
+    images is an iterable of (name, RGBA bytes) pairs. Returns the palette,
+    and the errors of each image (see PaletteBuilder.errors), or (None,
+    None) if none of the images have any visible pixels."""
+    builder = PaletteBuilder()
+    for img_name, rgba in images:
+        builder.add_image(img_name, rgba)
+    if not builder.samples.seen:
+        return None, None
+    palette = builder.build(name)
+    return palette, builder.errors(palette)
+
+
+def fmt_errors(errors):
+    "Format the quantization errors of each image as a table."
+    if not errors:
+        return ""
+    width = max(map(len, errors.keys()))
+    return "\n".join("{:{}} RMS error {:.2f}".format(name, width, error)
+                     for name, error in errors.items())
@@ -0,0 +1,224 @@
+# -*- coding: utf8 -*-
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+
+# Serialization phase of the exporter.
+#
+# The exporter first extracts everything it needs from Blender into a
+# ModelJob for each model file. ModelJobs only contain plain Python data
+# (PackedLODs, hardpoints, colliders, etc.), so they can be written by
+# worker processes while Blender is no longer needed.
+import array
+import hashlib
+import time
+
+try:
+    from . import iff_mesh, bounds, decimate, lod_range, mesh_opt, workers
+except ImportError:
+    # Not imported as part of the add-on (ex. by the unit tests)
+    import iff_mesh
+    import bounds
+    import decimate
+    import lod_range
+    import mesh_opt
+    import workers
+
+
+class ModelJob:
+    """Everything needed to write a model file.
+
+    filepath: Path of the model file, without the .iff extension
+    packed_lods: PackedLOD for each LOD, or None for empty LODs
+    dranges, dsphrs: LOD ranges and CNTR/RADI spheres for each LOD
+    drange_fixed: LOD ranges set by the user, with None for the others
+    opt_passes: (function, keyword arguments) for each mesh_opt pass
+    lod_texnums: Texture numbers to replace in each LOD, mapped to the
+    texture numbers to use instead (ex. downscaled textures)"""
+
+    def __init__(self, filepath, modelname, far_chunk, collider, hardpoints,
+                 packed_lods, dranges, dsphrs, drange_fixed=None,
+                 num_gen_lods=0, auto_lod_ratio=0.5, range_solver=False,
+                 pixel_tolerance=1.0, lod_fov=60.0, lod_resolution=768,
+                 opt_passes=(), test_run=False, lod_texnums=()):
+        if not all(packed is None or isinstance(packed, iff_mesh.PackedLOD)
+                   for packed in packed_lods):
+            raise TypeError("Each LOD must be a PackedLOD or None!")
+        self.filepath = filepath
+        self.modelname = modelname
+        self.far_chunk = far_chunk
+        self.collider = collider
+        self.hardpoints = list(hardpoints)
+        self.packed_lods = list(packed_lods)
+        self.dranges = list(dranges)
+        self.dsphrs = list(dsphrs)
+        self.drange_fixed = drange_fixed
+        self.num_gen_lods = num_gen_lods
+        self.auto_lod_ratio = auto_lod_ratio
+        self.range_solver = range_solver
+        self.pixel_tolerance = pixel_tolerance
+        self.lod_fov = lod_fov
+        self.lod_resolution = lod_resolution
+        self.opt_passes = list(opt_passes)
+        self.test_run = test_run
+        self.lod_texnums = list(lod_texnums)
+
+    def digest(self):
+        """A hash of everything written to the model file except its name.
+
+        ModelJobs with the same digest write identical model files."""
+        digest = hashlib.sha1()
+
+        def add(*values):
+            digest.update(repr(values).encode("utf-8"))
+
+        add(self.modelname, self.far_chunk, self.dranges, self.drange_fixed,
+            [sphere and sphere.to_tuple() for sphere in self.dsphrs],
+            self.num_gen_lods, self.auto_lod_ratio, self.range_solver,
+            self.pixel_tolerance, self.lod_fov, self.lod_resolution,
+            [(opt_pass.__name__, sorted(kwargs.items()))
+             for opt_pass, kwargs in self.opt_passes],
+            [sorted(texnums.items()) for texnums in self.lod_texnums])
+        for hardpt in self.hardpoints:
+            digest.update(hardpt.to_chunk().to_bytes())
+        if self.collider is not None:
+            digest.update(self.collider.to_coll_form().to_bytes())
+        for packed in self.packed_lods:
+            if packed is None:
+                add(None)
+                continue
+            for data in (packed.verts, packed.norms, packed.fvrt_verts,
+                         packed.fvrt_norms, packed.fvrt_uvs,
+                         packed.face_norms, packed.face_dplanes,
+                         packed.face_texnums, packed.face_first,
+                         packed.face_nverts, packed.face_lflags,
+                         packed.face_smooth):
+                add(len(data))
+                digest.update(data.tobytes())
+        return digest.hexdigest()
+
+    def generate_lods(self):
+        "Add the generated LODs, simplified from LOD 0."
+        packed_lods = self.packed_lods
+        ratios = [self.auto_lod_ratio ** (lodi + 1)
+                  for lodi in range(self.num_gen_lods)]
+        gen_lods = decimate.make_lods(packed_lods[0], ratios)
+        print(decimate.fmt_lod_report(packed_lods[0], gen_lods))
+        for packed, error, elapsed in gen_lods:
+            lodi = len(packed_lods)
+            packed_lods.append(packed)
+            if self.dsphrs[lodi] is None:
+                self.dsphrs[lodi] = iff_mesh.Sphere(
+                    *bounds.exact_sphere(packed.verts))
+
+    def solve_ranges(self):
+        "Calculate the LOD ranges that were not given from the LOD errors."
+        # Empty LODs keep the ranges they were given in setup.
+        fixed = [drange if packed is not None else self.dranges[lodi]
+                 for lodi, (drange, packed) in enumerate(
+                     zip(self.drange_fixed, self.packed_lods))]
+        solver = lod_range.RangeSolver(
+            self.packed_lods, self.pixel_tolerance, self.lod_fov,
+            self.lod_resolution)
+        self.dranges = solver.ranges(fixed)
+        print(solver.fmt_report(self.dranges))
+
+    def retexture_lod(self, lodi, packed):
+        "Replace the texture numbers of a packed LOD mesh."
+        if lodi < len(self.lod_texnums) and self.lod_texnums[lodi]:
+            texnums = self.lod_texnums[lodi]
+            packed.face_texnums = array.array("i", map(
+                texnums.get, packed.face_texnums, packed.face_texnums))
+        return packed
+
+    def optimize_lod(self, lodi, packed):
+        "Run the optimization passes on a packed LOD mesh."
+        for opt_pass, kwargs in self.opt_passes:
+            packed, stats = opt_pass(packed, **kwargs)
+            print("LOD {}: {}".format(lodi, mesh_opt.fmt_stats(stats)))
+        return packed
+
+    def to_model(self):
+        "Build the ModelIff for this model."
+        modelfile = iff_mesh.ModelIff(self.filepath, self.far_chunk)
+
+        modelfile.set_collider(self.collider)
+        for hardpt in self.hardpoints:
+            modelfile.add_hardpt(hardpt)
+
+        if self.num_gen_lods > 0:
+            self.generate_lods()
+        if self.range_solver and self.packed_lods[0] is not None:
+            self.solve_ranges()
+
+        for drange, lodi in zip(self.dranges, range(len(self.packed_lods))):
+            packed = self.packed_lods[lodi]
+            if packed is not None:
+                packed = self.retexture_lod(lodi, packed)
+                packed = self.optimize_lod(lodi, packed)
+                ilodm = iff_mesh.MeshLODForm.from_packed(
+                    lodi, packed, self.modelname, self.dsphrs[lodi])
+            else:
+                ilodm = iff_mesh.EmptyLODForm(lodi)
+
+            modelfile.add_lod(ilodm, drange)
+        return modelfile
+
+    def run(self):
+        """Build and write the model file.
+
+        Returns the number of seconds it took."""
+        start = time.perf_counter()
+        modelfile = self.to_model()
+        if not self.test_run:
+            modelfile.write_file_bin()
+        return time.perf_counter() - start
+
+
+def dedupe_jobs(jobs):
+    """Find the ModelJobs that write identical model files.
+
+    Returns the unique jobs, in order, and a dict mapping the filepath of
+    each duplicate job to the filepath of the job that is kept instead."""
+    unique = []
+    aliases = {}
+    kept = {}
+    for job in jobs:
+        digest = job.digest()
+        if digest in kept:
+            aliases[job.filepath] = kept[digest].filepath
+        else:
+            kept[digest] = job
+            unique.append(job)
+    return unique, aliases
+
+
+def _run_job(job):
+    return job.run()
+
+
+def write_models(jobs, num_workers=1):
+    """Write the model files for a sequence of ModelJobs.
+
+    The jobs are run by num_workers worker processes (0 = one per CPU), and
+    the time each of them took is returned, in order. Other jobs with a run
+    method, like texbuild.TextureJobs, can be mixed in with the ModelJobs."""
+    jobs = list(jobs)
+    num_workers = min(workers.num_workers(num_workers), max(1, len(jobs)))
+    with workers.WorkerPool(num_workers) as pool:
+        return pool.map(_run_job, jobs)
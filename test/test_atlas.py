@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+class TestAtlas(unittest.TestCase):
+
+    def check_atlas(self, tex_atlas, sizes, max_size):
+        "Check that the images in an atlas fit, and do not overlap."
+        pad = tex_atlas.padding
+        for size in (tex_atlas.width, tex_atlas.height):
+            self.assertLessEqual(size, max_size)
+            self.assertEqual(size & (size - 1), 0)
+        rects = list(tex_atlas.placements.items())
+        for idx, (image, (left, top, width, height)) in enumerate(rects):
+            self.assertEqual((width, height), sizes[image])
+            self.assertGreaterEqual(min(left, top), pad)
+            self.assertLessEqual(left + width + pad, tex_atlas.width)
+            self.assertLessEqual(top + height + pad, tex_atlas.height)
+            for other, (oleft, otop, owidth, oheight) in rects[idx + 1:]:
+                self.assertTrue(
+                    left + width + pad <= oleft - pad or
+                    oleft + owidth + pad <= left - pad or
+                    top + height + pad <= otop - pad or
+                    otop + oheight + pad <= top - pad,
+                    "{} overlaps {}".format(image, other))
+
+    def test_pack(self):
+        "Images are packed into power of two atlases without overlapping."
+        import random
+        import atlas
+        from collections import OrderedDict
+        rng = random.Random(0)
+        sizes = OrderedDict(
+            ("image{}.png".format(idx),
+             (rng.choice((8, 16, 32, 64, 128)), rng.choice((8, 16, 64))))
+            for idx in range(40))
+        sizes["huge.png"] = (256, 256)
+        atlases = atlas.pack_atlases(sizes, 256, 2)
+        self.assertGreater(len(atlases), 1)
+        packed = set()
+        for tex_atlas in atlases:
+            self.check_atlas(tex_atlas, sizes, 256)
+            packed.update(tex_atlas.placements.keys())
+        # The huge image does not fit with its padding.
+        self.assertEqual(packed, set(sizes.keys()) - {"huge.png"})
+
+        atlases = atlas.pack_atlases(
+            OrderedDict((("a", (32, 32)), ("b", (16, 16)))), 1024, 2)
+        self.assertEqual(len(atlases), 1)
+        self.assertEqual((atlases[0].width, atlases[0].height), (64, 64))
+        self.assertEqual(atlas.pack_atlases({"a": (32, 32)}), [])
+        with self.assertRaises(ValueError):
+            atlas.pack_atlases(sizes, 1000)
+
+    def test_remap(self):
+        "Face UVs are moved into the atlas, unless they wrap."
+        import atlas
+        import iff_mesh
+        packed = iff_mesh.PackedLOD()
+        for coords in ((0, 0, 0), (1, 0, 0), (0, 1, 0)):
+            packed.add_vertex(*coords)
+        norm = packed.add_normal(0, 0, 1)
+        uvs = ((0.0, 0.0), (1.0, 0.0), (0.5, 1.0))
+        wrap_uvs = ((0.0, 0.0), (2.0, 0.0), (1.0, 1.0))
+        packed.add_face(norm, 0, 22000, [(idx, norm) + uv for idx, uv in
+                                         enumerate(uvs)], 0)
+        packed.add_face(norm, 0, 22000, [(idx, norm) + uv for idx, uv in
+                                         enumerate(wrap_uvs)], 0)
+        packed.add_face(norm, 0, 22001, [(idx, norm) + uv for idx, uv in
+                                         enumerate(uvs)], 0)
+        tex_atlas = atlas.Atlas(128, 64, 2)
+        tex_atlas.placements["a.png"] = (66, 2, 32, 16)
+        remap = {22000: (22005, tex_atlas.uv_transform("a.png"))}
+        self.assertEqual(atlas.remap_faces(packed, remap), (1, 1))
+        self.assertEqual(list(packed.face_texnums), [22005, 22000, 22001])
+        expected = [66 / 128, 2 / 64, 98 / 128, 2 / 64, 82 / 128, 18 / 64]
+        for value, expect in zip(packed.fvrt_uvs[:6], expected):
+            self.assertAlmostEqual(value, expect)
+        self.assertEqual(list(packed.fvrt_uvs[6:]),
+                         [value for uv in wrap_uvs + uvs for value in uv])
+
+    def test_atlas_job(self):
+        "Atlas MATs hold each image, with its edges copied into the padding."
+        import array
+        import mat_write
+        import texbuild
+        from test_mat_write import make_palette, make_image
+        cmap = make_palette()
+        images = [make_image(cmap, 4, 2, 1), make_image(cmap, 2, 3, 2)]
+        places = [(2, 2, 4, 2), (10, 2, 2, 3)]
+        parts = []
+        for (left, top, width, height), rgba in zip(places, images):
+            # Blender images start with the bottom row
+            rows = [rgba[start:start + width * 4]
+                    for start in range(0, len(rgba), width * 4)]
+            pixels = array.array("f", [value / 255 for row in reversed(rows)
+                                       for value in row])
+            parts.append((left, top, width, height, pixels))
+        job = texbuild.AtlasJob("atlas.mat", 16, 8, parts,
+                                mat_write.Palette(cmap), 2)
+        rgba = job.rgba()
+
+        def pixel(x, y):
+            return rgba[(y * 16 + x) * 4:(y * 16 + x) * 4 + 4]
+
+        for (left, top, width, height), image in zip(places, images):
+            for y in range(height):
+                for x in range(width):
+                    start = (y * width + x) * 4
+                    self.assertEqual(pixel(left + x, top + y),
+                                     image[start:start + 4])
+            self.assertEqual(pixel(left - 2, top - 2), image[:4])
+            self.assertEqual(pixel(left + width + 1, top + height + 1),
+                             image[-4:])
+        self.assertEqual(pixel(15, 7), bytes(4))
+
+
+if __name__ == "__main__":
+    unittest.main()
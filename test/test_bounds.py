@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+class TestBoundingSpheres(unittest.TestCase):
+
+    def setUp(self):
+        from random import Random
+        rnd = Random(42)
+        # Box corners, plus some random points inside the box.
+        self.box = [1.0, 1.0, 1.0, -1.0, 1.0, 1.0, 1.0, -1.0, 1.0,
+                    -1.0, -1.0, 1.0, 1.0, 1.0, -1.0, -1.0, 1.0, -1.0,
+                    1.0, -1.0, -1.0, -1.0, -1.0, -1.0]
+        self.box.extend(rnd.uniform(-1, 1) for x in range(300))
+        # Points on a flat disc, offset from the origin.
+        self.disc = []
+        for x in range(64):
+            self.disc.extend((rnd.uniform(-3, 3) + 10, 2.0,
+                              rnd.uniform(-3, 3) - 5))
+
+    def test_exact(self):
+        "exact_sphere finds the minimal sphere, and covers every vertex."
+        import bounds
+        x, y, z, r = bounds.exact_sphere(self.box)
+        self.assertAlmostEqual(3 ** 0.5, r, 5,
+                               'Box bounding sphere radius is wrong!')
+        for c in (x, y, z):
+            self.assertAlmostEqual(0.0, c, 5,
+                                   'Box bounding sphere is not centred!')
+        for coords in (self.box, self.disc):
+            self.assertEqual(0.0, bounds.uncovered(
+                coords, bounds.exact_sphere(coords)),
+                'Some vertices are outside the exact sphere!')
+
+    def test_ritter(self):
+        "ritter_sphere covers every vertex, and is no smaller than exact."
+        import bounds
+        for coords in (self.box, self.disc):
+            ritter = bounds.ritter_sphere(coords)
+            exact = bounds.exact_sphere(coords)
+            self.assertEqual(0.0, bounds.uncovered(coords, ritter),
+                             'Some vertices are outside the Ritter sphere!')
+            self.assertGreaterEqual(ritter[3], exact[3] * (1 - 1e-6),
+                                    'Ritter sphere is smaller than exact!')
+
+
+if __name__ == '__main__':
+    unittest.main()
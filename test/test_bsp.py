@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+class TestBSPTree(unittest.TestCase):
+
+    def setUp(self):
+        # An "L" shaped prism (non-convex), with outward facing polygons.
+        # Cross-section in the XY plane, extruded from z = 0 to z = 1.
+        outline = [(0, 0), (2, 0), (2, 1), (1, 1), (1, 2), (0, 2)]
+        self.coords = []
+        for x, y in outline:
+            self.coords.extend((float(x), float(y), 0.0))
+        for x, y in outline:
+            self.coords.extend((float(x), float(y), 1.0))
+        num = len(outline)
+        self.polys = []
+        for i in range(num):
+            j = (i + 1) % num
+            self.polys.append((i, j, j + num, i + num))
+        # Caps, split into convex pieces.
+        self.polys.append((0, 3, 2, 1))
+        self.polys.append((0, 5, 4, 3))
+        self.polys.append((6, 7, 8, 9))
+        self.polys.append((6, 9, 10, 11))
+
+    def test_inside(self):
+        "BSPTree classifies points inside and outside of the solid."
+        import bsp
+        tree = bsp.BSPTree(self.coords, self.polys)
+        self.assertTrue(tree.point_inside(0.5, 0.5, 0.5))
+        self.assertTrue(tree.point_inside(1.5, 0.5, 0.5))
+        self.assertTrue(tree.point_inside(0.5, 1.5, 0.5))
+        self.assertFalse(tree.point_inside(1.5, 1.5, 0.5),
+                         'Point in the notch of the L is inside!')
+        self.assertFalse(tree.point_inside(0.5, 0.5, 1.5))
+        self.assertFalse(tree.point_inside(-0.5, 0.5, 0.5))
+
+    def test_stats(self):
+        "BSPTree keeps every polygon, and its arrays are consistent."
+        import bsp
+        tree = bsp.BSPTree(self.coords, self.polys)
+        stats = tree.stats()
+        self.assertEqual(len(self.polys), stats["input_polys"])
+        self.assertEqual(stats["output_polys"],
+                         stats["input_polys"] + stats["splits"])
+        self.assertEqual(len(tree.nodes), stats["nodes"])
+        self.assertEqual(sum(poly[1] for poly in tree.polys),
+                         len(tree.pvrts))
+        self.assertEqual(stats["nodes"] + 1, stats["leaves"])
+
+    def test_deterministic(self):
+        "Building the same tree twice gives the same arrays."
+        import bsp
+        tree_a = bsp.BSPTree(self.coords, self.polys)
+        tree_b = bsp.BSPTree(self.coords, self.polys)
+        self.assertEqual(tree_a.nodes, tree_b.nodes)
+        self.assertEqual(tree_a.verts, tree_b.verts)
+        self.assertEqual(tree_a.pvrts, tree_b.pvrts)
+
+    def test_parallel(self):
+        "Subtrees built by worker processes give the same tree."
+        import bsp
+        import iff_mesh
+        sphere = iff_mesh.Sphere(1, 1, 0.5, 1.5)
+        serial = bsp.BSPTree(self.coords, self.polys)
+        parallel = bsp.BSPTree(self.coords, self.polys, workers=2,
+                               parallel_threshold=4)
+        self.assertEqual(serial.num_splits, parallel.num_splits)
+        serial_coll = iff_mesh.Collider("bsp", sphere, serial)
+        parallel_coll = iff_mesh.Collider("bsp", sphere, parallel)
+        self.assertEqual(
+            serial_coll.to_coll_form().to_bytes(),
+            parallel_coll.to_coll_form().to_bytes(),
+            'Parallel BSP tree is different from the serial one!')
+
+    def test_coll_form(self):
+        "A BSP collider has an EXTN form in its COLL form."
+        import bsp
+        import iff_mesh
+        tree = bsp.BSPTree(self.coords, self.polys)
+        collider = iff_mesh.Collider(
+            "bsp", iff_mesh.Sphere(1, 1, 0.5, 1.5), tree)
+        coll_bytes = collider.to_coll_form().to_bytes()
+        self.assertEqual(b"COLL", coll_bytes[8:12])
+        self.assertIn(b"EXTNFORM", coll_bytes)
+        self.assertIn(b"BSP VERT", coll_bytes)
+        self.assertRaises(TypeError, iff_mesh.Collider, "bsp",
+                          iff_mesh.Sphere(1, 1, 0.5, 1.5))
+
+    def test_blockmap(self):
+        "Blockmap region queries find the same hits as a brute force search."
+        import bsp
+        from random import Random
+        tree = bsp.BSPTree(self.coords, self.polys)
+        blockmap = bsp.Blockmap(tree, cell_size=0.5)
+        self.assertEqual([], blockmap.unindexed_polys())
+        self.assertEqual(0, len(blockmap.polys_at(5.0, 5.0, 5.0)))
+        # A segment through the notch of the L hits the inner wall at x = 1
+        t, poly_idx = blockmap.segment_hit((1.5, 1.5, 0.5), (0.5, 1.5, 0.5))
+        self.assertAlmostEqual(0.5, t)
+        self.assertIn(poly_idx, blockmap.polys_at(1.0, 1.5, 0.5))
+        all_polys = range(len(tree.polys))
+        rnd = Random(7)
+        for x in range(200):
+            start = tuple(rnd.uniform(-1, 3) for ax in range(3))
+            end = tuple(rnd.uniform(-1, 3) for ax in range(3))
+            hit = blockmap.segment_hit(start, end)
+            brute = blockmap.segment_hit(start, end, all_polys)
+            if brute is None:
+                self.assertIsNone(hit)
+            else:
+                self.assertAlmostEqual(brute[0], hit[0])
+
+    def test_region_form(self):
+        "A BSP+region collider has a BLKM form after the BSP form."
+        import bsp
+        import iff_mesh
+        tree = bsp.BSPTree(self.coords, self.polys)
+        collider = iff_mesh.Collider(
+            "bsp+region", iff_mesh.Sphere(1, 1, 0.5, 1.5), tree,
+            bsp.Blockmap(tree))
+        coll_bytes = collider.to_coll_form().to_bytes()
+        self.assertGreater(coll_bytes.index(b"BLKMGRID"),
+                           coll_bytes.index(b"BSP VERT"))
+        self.assertRaises(TypeError, iff_mesh.Collider, "bsp+region",
+                          iff_mesh.Sphere(1, 1, 0.5, 1.5), tree)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+def make_grid_box(div):
+    """Make a PackedLOD of a box made of div * div quads per side.
+
+    The top side uses a different texture from the other sides, and each
+    side has its own UV island."""
+    import iff_mesh
+    packed = iff_mesh.PackedLOD()
+    vert_idxs = {}
+
+    def vertex(pt):
+        if pt not in vert_idxs:
+            vert_idxs[pt] = packed.add_vertex(*pt)
+        return vert_idxs[pt]
+
+    # (origin, u axis, v axis) of each side, wound outwards.
+    sides = (((0, 0, 0), (0, 1, 0), (1, 0, 0)),
+             ((0, 0, 1), (1, 0, 0), (0, 1, 0)),
+             ((0, 0, 0), (1, 0, 0), (0, 0, 1)),
+             ((0, 1, 0), (0, 0, 1), (1, 0, 0)),
+             ((0, 0, 0), (0, 0, 1), (0, 1, 0)),
+             ((1, 0, 0), (0, 1, 0), (0, 0, 1)))
+    for side, (origin, u_ax, v_ax) in enumerate(sides):
+        texnum = 22001 if side == 1 else 22000
+        for i in range(div):
+            for j in range(div):
+                fvrts = []
+                for di, dj in ((0, 0), (1, 0), (1, 1), (0, 1)):
+                    u = (i + di) / div
+                    v = (j + dj) / div
+                    pt = tuple(float(origin[ax] + u_ax[ax] * u +
+                                     v_ax[ax] * v) for ax in range(3))
+                    fvrts.append((vertex(pt), 0, u, v))
+                packed.add_face(0, 0.0, texnum, fvrts, 0)
+    return packed
+
+
+class TestDecimate(unittest.TestCase):
+
+    def setUp(self):
+        self.box = make_grid_box(6)
+
+    def test_targets(self):
+        "make_lods reaches its targets, and the error only increases."
+        import decimate
+        lods = decimate.make_lods(self.box, (0.5, 0.25, 0.1))
+        full_tris = decimate.count_tris(self.box)
+        last_error = 0.0
+        for (lod, error, elapsed), ratio in zip(lods, (0.5, 0.25, 0.1)):
+            self.assertLessEqual(decimate.count_tris(lod), full_tris * ratio)
+            self.assertGreaterEqual(error, last_error)
+            last_error = error
+        # A flat-sided box can be simplified without moving any surface.
+        self.assertAlmostEqual(0.0, lods[-1][1], 5)
+
+    def test_features(self):
+        "Simplified LODs stay closed, and keep their box shape and textures."
+        import decimate
+        lod = decimate.make_lods(self.box, (0.1,))[0][0]
+        edge_uses = {}
+        for face_idx in range(lod.num_faces):
+            vidxs = [lod.fvrt_verts[fv] for fv in lod.face_fvrts(face_idx)]
+            for corner in range(len(vidxs)):
+                edge = tuple(sorted((vidxs[corner - 1], vidxs[corner])))
+                edge_uses[edge] = edge_uses.get(edge, 0) + 1
+            if lod.face_texnums[face_idx] == 22001:
+                # Top faces must stay on top.
+                for vidx in vidxs:
+                    self.assertAlmostEqual(1.0, lod.verts[vidx * 3 + 2])
+        self.assertEqual({2}, set(edge_uses.values()),
+                         'Simplified box is not closed!')
+        # The 8 corners of the box must remain.
+        corners = set()
+        for vidx in range(lod.num_verts):
+            pt = lod.vertex(vidx)
+            if all(coord in (0.0, 1.0) for coord in pt):
+                corners.add(pt)
+        self.assertEqual(8, len(corners))
+
+    def test_lod_form(self):
+        "A simplified LOD can be converted to a MeshLODForm."
+        import decimate
+        import iff_mesh
+        lod = decimate.make_lods(self.box, (0.25,))[0][0]
+        lod_form = iff_mesh.MeshLODForm.from_packed(
+            1, lod, "Box", iff_mesh.Sphere(0.5, 0.5, 0.5, 0.87))
+        lod_bytes = lod_form.to_bytes()
+        self.assertIn(b"FVRT", lod_bytes)
+        # 7 members per face in the FACE chunk, 4 bytes each
+        face_ofs = lod_bytes.index(b"FACE")
+        face_len = int.from_bytes(lod_bytes[face_ofs + 4:face_ofs + 8], "big")
+        self.assertEqual(lod.num_faces * 28, face_len)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+class TestExportCache(unittest.TestCase):
+
+    def setUp(self):
+        from tempfile import TemporaryDirectory
+        self.tmpdir = TemporaryDirectory()
+        self.modeldir = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def touch(self, exp_fname):
+        import os
+        with open(os.path.join(self.modeldir, exp_fname + ".iff"), "wb"):
+            pass
+
+    def test_fingerprint(self):
+        import export_cache
+        import array
+        fp_a = export_cache.Fingerprint()
+        fp_a.add("Duhiky", (1.0, 2.0))
+        fp_a.add_bytes(array.array("f", [1.0, 2.0]))
+        fp_b = export_cache.Fingerprint()
+        fp_b.add("Duhiky", (1.0, 2.0))
+        fp_b.add_bytes(array.array("f", [1.0, 2.5]))
+        self.assertNotEqual(fp_a.hexdigest(), fp_b.hexdigest())
+
+    def test_exporter_version(self):
+        "The exporter version includes a hash of the add-on's source."
+        import export_cache
+        version, source_hash = export_cache.exporter_version()
+        self.assertEqual(version, export_cache.EXPORTER_VERSION)
+        self.assertEqual(len(source_hash), 40)
+        self.assertEqual(export_cache.exporter_version(),
+                         (version, source_hash))
+
+    def test_lookup(self):
+        import export_cache
+        cache = export_cache.ExportCache(self.modeldir)
+        self.assertIsNone(cache.lookup("Duhiky", "abc"))
+        cache.update("Duhiky", "abc")
+        cache.update("Duhiky_Turret", "def")
+        cache.update("Duhiky_Turret.001", "def", "Duhiky_Turret")
+        cache.save()
+        # The model file must still exist.
+        cache = export_cache.ExportCache(self.modeldir)
+        self.assertIsNone(cache.lookup("Duhiky", "abc"))
+        self.touch("Duhiky")
+        self.touch("Duhiky_Turret")
+        self.assertEqual(cache.lookup("Duhiky", "abc"), "Duhiky")
+        self.assertIsNone(cache.lookup("Duhiky", "abd"))
+        # A model identical to another one is only up to date if the other
+        # one is.
+        current = {"Duhiky_Turret": "def", "Duhiky_Turret.001": "def"}
+        self.assertEqual(
+            cache.lookup("Duhiky_Turret.001", "def", current),
+            "Duhiky_Turret")
+        current["Duhiky_Turret"] = "xyz"
+        self.assertIsNone(cache.lookup("Duhiky_Turret.001", "def", current))
+
+    def test_bad_file(self):
+        import export_cache
+        import os
+        with open(os.path.join(self.modeldir, export_cache.CACHE_FNAME),
+                  "w") as cache_file:
+            cache_file.write("{not json")
+        cache = export_cache.ExportCache(self.modeldir)
+        self.assertEqual(cache.models, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+def gradient(width, height, flip=False):
+    "An RGBA image that gets brighter to the right (or left)."
+    rgba = bytearray()
+    for y in range(height):
+        for x in range(width):
+            value = (width - 1 - x if flip else x) * 255 // (width - 1)
+            rgba.extend((value, value // 2, (y * 8) % 256, 255))
+    return rgba
+
+
+class TestFindDupeMats(unittest.TestCase):
+
+    def setUp(self):
+        import os
+        from tempfile import TemporaryDirectory
+        self.tmpdir = TemporaryDirectory()
+        self.matdir = os.path.join(self.tmpdir.name, "mat")
+        self.meshdir = os.path.join(self.tmpdir.name, "mesh")
+        os.mkdir(self.matdir)
+        os.mkdir(self.meshdir)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_mat(self, texnum, rgba, width, height, palette):
+        import os
+        import mat_write
+        matfpath = os.path.join(self.matdir, "{:0>8}.mat".format(texnum))
+        mat_write.MATWriter(matfpath, width, height, rgba, palette).write()
+        return matfpath
+
+    def test_bk_tree(self):
+        "The BK-tree finds the same hashes as comparing every pair."
+        import random
+        from util.find_dupe_mats import BKTree, hamming
+        rng = random.Random(0)
+        keys = [rng.getrandbits(16) for x in range(300)]
+        tree = BKTree()
+        for idx, key in enumerate(keys):
+            tree.add(key, idx)
+        for key in keys[:20]:
+            self.assertEqual(
+                sorted(tree.search(key, 3)),
+                [idx for idx, other in enumerate(keys)
+                 if hamming(key, other) <= 3])
+
+    def test_plan(self):
+        "Duplicate MATs are grouped, and remapped to the most used one."
+        import serialize
+        import palgen
+        import mat_read
+        import mat_write
+        from test_serialize import make_jobs
+        from util.find_dupe_mats import (
+            mat_hashes, group_duplicates, mesh_texnums, consolidation_plan)
+        image = gradient(64, 32)
+        builder = palgen.PaletteBuilder()
+        builder.add_image("gradient", image)
+        palette = builder.build()
+        other_palette = mat_write.Palette(palette.cmap[:3] + b"".join(
+            map(bytes, reversed(palette.colours[1:]))))
+        noisy = bytearray(image)
+        noisy[0:3] = b"\xff\x00\xff"
+        fnames = [self.write_mat(22001, image, 64, 32, palette)]
+        # The same pixels, with the palette colours in another order
+        with mat_read.MATStream(fnames[0]) as stream:
+            quantized = b"".join(stream.rows())
+        fnames += [
+            self.write_mat(22000, image, 64, 32, palette),
+            self.write_mat(22002, quantized, 64, 32, other_palette),
+            self.write_mat(22003, noisy, 64, 32, palette),
+            self.write_mat(22004, gradient(64, 32, True), 64, 32, palette),
+            self.write_mat(22005, gradient(32, 16), 32, 16, palette),
+        ]
+        hashes = [mat_hashes(fname) for fname in fnames]
+        self.assertEqual(hashes[0][3], hashes[1][3])
+        self.assertNotEqual(hashes[0][3], hashes[3][3])
+
+        groups = group_duplicates(hashes)
+        self.assertEqual(groups, [fnames[:4]])
+        groups = group_duplicates(hashes, same_size=False)
+        self.assertEqual(groups, [fnames[:4] + fnames[5:]])
+
+        # The mesh uses texture 22001, so that one is kept.
+        serialize.write_models(make_jobs(self.meshdir, 1), 1)
+        mesh_fname = self.meshdir + "/model0.iff"
+        texnums = mesh_texnums(mesh_fname)
+        self.assertEqual(texnums, {22000, 22001})
+        plan = consolidation_plan([fnames[:3]], hashes,
+                                  {22001: [mesh_fname], 22000: []})
+        self.assertEqual(len(plan), 1)
+        self.assertEqual(plan[0]["keep"], fnames[0])
+        self.assertTrue(plan[0]["exact"])
+        self.assertEqual(dict(plan[0]["remap"]),
+                         {"22000": 22001, "22002": 22001})
+        self.assertEqual(plan[0]["meshes"], [mesh_fname])
+
+
+if __name__ == "__main__":
+    unittest.main()
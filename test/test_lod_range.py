@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+def make_pyramid(height):
+    "Make a PackedLOD of a square pyramid with the given height."
+    import iff_mesh
+    packed = iff_mesh.PackedLOD()
+    for pt in ((0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (1.0, 1.0, 0.0),
+               (0.0, 1.0, 0.0), (0.5, 0.5, height)):
+        packed.add_vertex(*pt)
+    for face in ((3, 2, 1, 0), (0, 1, 4), (1, 2, 4), (2, 3, 4), (3, 0, 4)):
+        packed.add_face(0, 0.0, 22000, [(v, 0, 0.0, 0.0) for v in face], 0)
+    return packed
+
+
+class TestLODRanges(unittest.TestCase):
+
+    def test_grid_distance(self):
+        "TriangleGrid.distance matches a brute force search."
+        import lod_range
+        from random import Random
+        tris = lod_range.packed_tris(make_pyramid(1.0))
+        grid = lod_range.TriangleGrid(tris)
+        rnd = Random(3)
+        for x in range(200):
+            pt = tuple(rnd.uniform(-2, 3) for ax in range(3))
+            brute = min(lod_range.closest_point_dist2(pt, tri)
+                        for tri in tris) ** 0.5
+            self.assertAlmostEqual(brute, grid.distance(pt))
+
+    def test_ranges(self):
+        "LOD ranges follow the error, and fixed ranges are kept."
+        import lod_range
+        lods = [make_pyramid(1.0), make_pyramid(0.9), None,
+                make_pyramid(0.5)]
+        solver = lod_range.RangeSolver(lods, 1.0, 90.0, 1000)
+        self.assertAlmostEqual(0.1, solver.errors[1])
+        self.assertAlmostEqual(0.5, solver.errors[3])
+        self.assertIsNone(solver.errors[2])
+        # 1 pixel at 90 degrees FOV and 1000 pixels high is 1/500 of the
+        # distance.
+        self.assertEqual([0.0, 50.0, 50.0, 250.0],
+                         [round(drange, 3) for drange in solver.ranges()])
+        self.assertEqual([0.0, 50.0, 120.0, 250.0], [
+            round(drange, 3)
+            for drange in solver.ranges([None, None, 120.0, None])])
+        self.assertEqual([0.0, 40.0, 40.0, 40.0], [
+            round(drange, 3)
+            for drange in solver.ranges([None, None, None, 40.0])])
+        self.assertAlmostEqual(
+            50.0, lod_range.range_for_error(0.1, 1.0, 90.0, 1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
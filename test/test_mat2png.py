@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+def read_png(pngfpath):
+    "Read an unfiltered 8-bit RGBA PNG. Returns the width, height, and RGBA."
+    import struct
+    import zlib
+    with open(pngfpath, "rb") as png_file:
+        data = png_file.read()
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    offset = 8
+    chunks = {}
+    while offset < len(data):
+        length, = struct.unpack_from(">I", data, offset)
+        name = data[offset + 4:offset + 8]
+        body = data[offset + 8:offset + 8 + length]
+        crc, = struct.unpack_from(">I", data, offset + 8 + length)
+        assert zlib.crc32(name + body) & 0xFFFFFFFF == crc
+        chunks[name] = body
+        offset += 12 + length
+    width, height = struct.unpack_from(">II", chunks[b"IHDR"])
+    assert chunks[b"IHDR"][8:] == b"\x08\x06\x00\x00\x00"
+    scanlines = zlib.decompress(chunks[b"IDAT"])
+    row_size = width * 4 + 1
+    assert scanlines[::row_size] == bytes(height)
+    rgba = b"".join(scanlines[start + 1:start + row_size]
+                    for start in range(0, len(scanlines), row_size))
+    return width, height, rgba
+
+
+class TestMAT2PNG(unittest.TestCase):
+
+    def setUp(self):
+        import os
+        from tempfile import TemporaryDirectory
+        self.tmpdir = TemporaryDirectory()
+        self.matdir = os.path.join(self.tmpdir.name, "mat")
+        self.outdir = os.path.join(self.tmpdir.name, "png")
+        os.mkdir(self.matdir)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_mat(self, fname, width, height, palette, seed=2):
+        import os
+        import mat_write
+        from test_mat_write import make_image
+        rgba = make_image(palette.cmap, width, height, seed)
+        rgba[3] = 0
+        matfpath = os.path.join(self.matdir, fname)
+        mat_write.MATWriter(matfpath, width, height, rgba, palette).write()
+        return matfpath
+
+    def test_encode(self):
+        "PNGs hold the RGBA pixels, one unfiltered row at a time."
+        import os
+        from test_mat_write import make_image, make_palette
+        from util.mat2png import write_png
+        rgba = bytes(make_image(make_palette(), 7, 3))
+        pngfpath = os.path.join(self.outdir, "image.png")
+        write_png(pngfpath, 7, 3, rgba)
+        self.assertEqual(read_png(pngfpath), (7, 3, rgba))
+        with self.assertRaises(ValueError):
+            write_png(pngfpath, 8, 3, rgba)
+
+    def test_convert_all(self):
+        "MATs are converted once, and again only when they change."
+        import os
+        import mat_read
+        import mat_write
+        import workers
+        from test_mat_write import make_palette
+        from util.mat2png import convert_all
+        paldir = os.path.join(self.tmpdir.name, "pal")
+        os.mkdir(paldir)
+        external = mat_write.Palette(make_palette(3), "space")
+        external.write_pal(os.path.join(paldir, "space.pal"))
+        embedded = mat_write.Palette(make_palette())
+        mats = [self.write_mat("00022000.mat", 13, 7, embedded),
+                self.write_mat("00022001.mat", 8, 16, external),
+                self.write_mat("00022002.mat", 4, 4, embedded, 5)]
+        with workers.WorkerPool(1) as pool:
+            self.assertEqual(convert_all(pool, [self.matdir], self.outdir,
+                                         (2, 1), 8), (3, 0, 2))
+            for matfpath in mats:
+                pngfpath = os.path.join(self.outdir, os.path.splitext(
+                    os.path.basename(matfpath))[0] + ".png")
+                with mat_read.MATStream(matfpath) as stream:
+                    self.assertEqual(read_png(pngfpath), (
+                        stream.width, stream.height,
+                        b"".join(stream.rows())))
+            width, height, sheet = read_png(
+                os.path.join(self.outdir, "sheet_000.png"))
+            self.assertEqual((width, height), (22, 12))
+            self.assertEqual(convert_all(pool, [self.matdir], self.outdir,
+                                         (2, 1), 8), (0, 3, 0))
+            # A changed palette changes the MATs that use it
+            changed = mat_write.Palette(make_palette(4), "space")
+            changed.write_pal(os.path.join(paldir, "space.pal"))
+            os.utime(os.path.join(paldir, "space.pal"), ns=(1, 1))
+            self.assertEqual(convert_all(pool, [self.matdir], self.outdir,
+                                         (2, 1), 8), (1, 2, 1))
+            self.assertEqual(convert_all(pool, [self.matdir], self.outdir,
+                                         (2, 1), 8, force=True), (3, 0, 2))
+
+    def test_palette_cache(self):
+        "External palettes are only read once for each folder."
+        import os
+        import mat_read
+        import mat_write
+        from test_mat_write import make_palette
+        paldir = os.path.join(self.tmpdir.name, "pal")
+        os.mkdir(paldir)
+        palpath = os.path.join(paldir, "space.pal")
+        palette = mat_write.Palette(make_palette(3), "space")
+        palette.write_pal(palpath)
+        mats = [self.write_mat("0000000{}.mat".format(idx), 4, 4, palette)
+                for idx in range(2)]
+        palettes = {}
+        with mat_read.MATStream(mats[0], palettes) as stream:
+            self.assertEqual(os.path.normpath(stream.palette_path),
+                             os.path.normpath(palpath))
+        os.remove(palpath)
+        with mat_read.MATStream(mats[1], palettes) as stream:
+            self.assertEqual(bytes(stream.palette), palette.cmap)
+        with mat_read.MATStream(mats[1]) as stream:
+            self.assertIsNone(stream.palette_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
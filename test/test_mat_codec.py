@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+class TestMATCodec(unittest.TestCase):
+
+    def test_decode_rgba(self):
+        "Pixels get their palette colours, and colour 0 is transparent."
+        import mat_codec
+        from test_mat_write import make_palette
+        cmap = make_palette()
+        indices = bytes(range(256)) + bytes([0, 5, 255, 5])
+        rgba = mat_codec.decode_rgba(indices, cmap)
+        expected = bytearray()
+        for idx in indices:
+            expected.extend(cmap[idx * 3:idx * 3 + 3])
+            expected.append(0 if idx == 0 else 255)
+        self.assertEqual(rgba, bytes(expected))
+        self.assertEqual(mat_codec.decode_rgb(indices, cmap),
+                         bytes(expected[chan] for chan in range(len(expected))
+                               if chan % 4 != 3))
+        alph = bytes(range(256)) + bytes(len(indices) - 256)
+        rgba = mat_codec.decode_rgba(indices, cmap, alph)
+        self.assertEqual(rgba[3::4], bytes(255 - value for value in alph))
+
+    def test_alph(self):
+        "ALPH data is inverted, and encoding reverses decoding."
+        import mat_codec
+        alpha = bytes(range(256))
+        self.assertEqual(mat_codec.encode_alph(alpha), alpha[::-1])
+        self.assertEqual(mat_codec.decode_alph(
+            mat_codec.encode_alph(alpha)), alpha)
+
+    def test_short_cmap(self):
+        "Short palettes are padded with black, and the name is cut at NUL."
+        import mat_codec
+        self.assertEqual(mat_codec.parse_cmap(b"\x01\x02\x03"),
+                         b"\x01\x02\x03" + bytes(765))
+        self.assertEqual(mat_codec.decode_rgb(b"\x00\x01", b"\x01\x02\x03"),
+                         b"\x01\x02\x03\x00\x00\x00")
+        self.assertEqual(mat_codec.palette_name(b"SPACE \x00\x00"), "SPACE")
+        self.assertEqual(mat_codec.read_cstr(b"AB\x00CD\x00", 3), "CD")
+        self.assertEqual(mat_codec.read_cstr(b"ABC"), "ABC")
+
+    def test_query_mat(self):
+        "query_mat reads the same pixels as MATReader."
+        import os
+        from tempfile import TemporaryDirectory
+        import mat_read
+        import mat_write
+        from test_mat_write import make_image, make_palette
+        from util.query_mat import IffMatReader
+        palette = mat_write.Palette(make_palette())
+        rgba = make_image(palette.cmap, 9, 5)
+        rgba[3] = 0
+        rgba[11] = 100
+        with TemporaryDirectory() as tmpdir:
+            matfpath = os.path.join(tmpdir, "00022000.mat")
+            mat_write.MATWriter(matfpath, 9, 5, rgba, palette).write()
+            reader = mat_read.MATReader(matfpath)
+            reader.read()
+            query = IffMatReader(matfpath)
+            query.read()
+        pixels = bytes(reader.pixels)
+        self.assertEqual(pixels[3::4], bytes(rgba[3::4]))
+        self.assertEqual(bytes(query.alfd), pixels[3::4])
+        self.assertEqual(bytes(query.pxld),
+                         bytes(pixels[chan] for chan in range(len(pixels))
+                               if chan % 4 != 3))
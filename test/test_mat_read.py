@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+class TestMATStream(unittest.TestCase):
+
+    def setUp(self):
+        import os
+        from tempfile import TemporaryDirectory
+        self.tmpdir = TemporaryDirectory()
+        self.matdir = os.path.join(self.tmpdir.name, "mat")
+        os.mkdir(self.matdir)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_mat(self, fname, width, height, palette, alpha=None):
+        "Write a MAT with some transparent pixels, and return its path."
+        import os
+        import mat_write
+        from test_mat_write import make_image
+        rgba = make_image(palette.cmap, width, height)
+        rgba[3] = 0
+        rgba[7] = 100
+        matfpath = os.path.join(self.matdir, fname)
+        mat_write.MATWriter(matfpath, width, height, rgba, palette,
+                            alpha=alpha).write()
+        return matfpath
+
+    def read_mat(self, matfpath):
+        import mat_read
+        reader = mat_read.MATReader(matfpath)
+        reader.read()
+        return reader
+
+    def test_rows(self):
+        "Rows match the pixels read by MATReader, with and without ALPH."
+        import mat_read
+        import mat_write
+        from test_mat_write import make_palette
+        palette = mat_write.Palette(make_palette())
+        for alpha in (None, False):
+            matfpath = self.write_mat("00022000.mat", 13, 7, palette, alpha)
+            reader = self.read_mat(matfpath)
+            with mat_read.MATStream(matfpath) as stream:
+                self.assertEqual((stream.width, stream.height), (13, 7))
+                self.assertEqual(bytes(stream.palette), palette.cmap)
+                self.assertEqual(b"".join(stream.rows()),
+                                 bytes(reader.pixels))
+                self.assertEqual(list(stream.rows(2, 4)),
+                                 [bytes(reader.pixels[row * 52:
+                                                      row * 52 + 52])
+                                  for row in (2, 3)])
+                reader.flip_y()
+                self.assertEqual(b"".join(stream.rows(flip=True)),
+                                 bytes(reader.pixels))
+
+    def test_tiles(self):
+        "Tiles cover the image, and are smaller at its edges."
+        import mat_read
+        import mat_write
+        from test_mat_write import make_palette
+        matfpath = self.write_mat("00022001.mat", 10, 9,
+                                  mat_write.Palette(make_palette()))
+        pixels = bytes(self.read_mat(matfpath).pixels)
+        with mat_read.MATStream(matfpath) as stream:
+            tiles = list(stream.tiles(4, 4))
+        self.assertEqual(len(tiles), 9)
+        self.assertEqual(tiles[-1][:4], (8, 8, 2, 1))
+        canvas = bytearray(len(pixels))
+        for left, top, width, height, rgba in tiles:
+            for row in range(height):
+                start = ((top + row) * 10 + left) * 4
+                canvas[start:start + width * 4] = rgba[
+                    row * width * 4:(row + 1) * width * 4]
+        self.assertEqual(bytes(canvas), pixels)
+
+    def test_external_palette(self):
+        "External palettes are looked up like MATReader does."
+        import os
+        import mat_read
+        import mat_write
+        from test_mat_write import make_palette
+        paldir = os.path.join(self.tmpdir.name, "pal")
+        os.mkdir(paldir)
+        palette = mat_write.Palette(make_palette(3), "space")
+        palette.write_pal(os.path.join(paldir, "space.pal"))
+        matfpath = self.write_mat("00022002.mat", 8, 8, palette)
+        with mat_read.MATStream(matfpath) as stream:
+            self.assertEqual(bytes(stream.palette), palette.cmap)
+            self.assertEqual(b"".join(stream.rows()),
+                             bytes(self.read_mat(matfpath).pixels))
+
+    def test_truncated(self):
+        "MATs with too few pixels are rejected."
+        import mat_read
+        import mat_write
+        from test_mat_write import make_palette
+        matfpath = self.write_mat("00022003.mat", 8, 8,
+                                  mat_write.Palette(make_palette()), False)
+        with open(matfpath, "rb") as mat_file:
+            data = mat_file.read()
+        with open(matfpath, "wb") as mat_file:
+            mat_file.write(data.replace(b"INFO\x00\x00\x00\x0c\x08",
+                                        b"INFO\x00\x00\x00\x0c\x10"))
+        with self.assertRaises(TypeError):
+            mat_read.MATStream(matfpath)
+
+
+if __name__ == "__main__":
+    unittest.main()
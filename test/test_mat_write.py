@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+def make_palette(seed=1):
+    "A palette of 256 random colours."
+    import random
+    rng = random.Random(seed)
+    return bytes(rng.randrange(256) for x in range(768))
+
+
+def make_image(cmap, width, height, seed=2):
+    "An RGBA image using only colours 1-255 of a palette."
+    import random
+    rng = random.Random(seed)
+    rgba = bytearray()
+    for pxl in range(width * height):
+        idx = rng.randrange(1, 256)
+        rgba.extend(cmap[idx * 3:idx * 3 + 3])
+        rgba.append(255)
+    return rgba
+
+
+class TestMATWrite(unittest.TestCase):
+
+    def setUp(self):
+        import os
+        from tempfile import TemporaryDirectory
+        self.tmpdir = TemporaryDirectory()
+        self.matdir = os.path.join(self.tmpdir.name, "mat")
+        os.mkdir(self.matdir)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read_mat(self, matfpath):
+        import mat_read
+        reader = mat_read.MATReader(matfpath)
+        reader.read()
+        return reader
+
+    def test_round_trip(self):
+        import os
+        import mat_write
+        cmap = make_palette()
+        rgba = make_image(cmap, 24, 16)
+        rgba[3] = 0  # Transparent pixel
+        matfpath = os.path.join(self.matdir, "00022000.mat")
+        writer = mat_write.MATWriter(
+            matfpath, 24, 16, rgba, mat_write.Palette(cmap))
+        writer.write()
+
+        reader = self.read_mat(matfpath)
+        self.assertEqual((reader.img_width, reader.img_height), (24, 16))
+        self.assertEqual(bytes(reader.palette), cmap)
+        rgba[0:3] = cmap[0:3]  # Transparent pixels use colour 0
+        self.assertEqual(bytes(reader.pixels), bytes(rgba))
+
+    def test_alpha(self):
+        import os
+        import mat_write
+        cmap = make_palette()
+        rgba = make_image(cmap, 8, 8)
+        for pxl, alpha in enumerate((0, 17, 128, 254)):
+            rgba[pxl * 4 + 3] = alpha
+        matfpath = os.path.join(self.matdir, "00022001.mat")
+        mat_write.MATWriter(
+            matfpath, 8, 8, rgba, mat_write.Palette(cmap)).write()
+
+        reader = self.read_mat(matfpath)
+        self.assertEqual(bytes(reader.pixels[3::4]), bytes(rgba[3::4]))
+
+    def test_external_palette(self):
+        import os
+        import mat_write
+        cmap = make_palette(3)
+        paldir = os.path.join(self.tmpdir.name, "pal")
+        os.mkdir(paldir)
+        palette = mat_write.Palette(cmap, "space")
+        palette.write_pal(os.path.join(paldir, "space.pal"))
+        self.assertEqual(mat_write.Palette.from_pal_file(
+            os.path.join(paldir, "space.pal")).cmap, cmap)
+
+        rgba = make_image(cmap, 16, 16)
+        matfpath = os.path.join(self.matdir, "00022002.mat")
+        mat_write.MATWriter(matfpath, 16, 16, rgba, palette).write()
+        with open(matfpath, "rb") as mat_file:
+            self.assertNotIn(b"CMAP", mat_file.read())
+
+        reader = self.read_mat(matfpath)
+        self.assertEqual(bytes(reader.palette), cmap)
+        self.assertEqual(bytes(reader.pixels), bytes(rgba))
+
+    def test_nearest(self):
+        import random
+        import mat_write
+        cmap = make_palette(4)
+        palette = mat_write.Palette(cmap)
+        rng = random.Random(5)
+
+        def dist(colour, idx):
+            return sum((chan - pchan) ** 2 for chan, pchan in
+                       zip(colour, palette.colours[idx]))
+
+        for test in range(500):
+            colour = tuple(rng.randrange(256) for chan in range(3))
+            best = min(dist(colour, idx) for idx in range(1, 256))
+            self.assertEqual(dist(colour, palette.nearest(*colour)), best)
+
+        # Colours off the palette map to the nearest colour to their cell
+        rgba = bytearray()
+        for test in range(500):
+            rgba.extend(rng.randrange(256) for chan in range(3))
+            rgba.append(255)
+        indices = palette.map_pixels(rgba)
+        for pxl, idx in enumerate(indices):
+            colour = rgba[pxl * 4:pxl * 4 + 3]
+            cell = tuple(chan & 0xF8 | 4 for chan in colour)
+            self.assertNotEqual(idx, 0)
+            self.assertEqual(dist(cell, idx),
+                             dist(cell, palette.nearest(*cell)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+def make_tri_grid(div, cells=None):
+    """Make a PackedLOD of a flat, triangulated div * div grid on Z = 0.
+
+    Cells on the left half use texture 22000, and the others use 22001.
+    If cells is given, only the (i, j) cells in it are included."""
+    import iff_mesh
+    packed = iff_mesh.PackedLOD()
+    norm_idx = packed.add_normal(0.0, 0.0, 1.0)
+    vert_idxs = {}
+
+    def vertex(pt):
+        if pt not in vert_idxs:
+            vert_idxs[pt] = packed.add_vertex(float(pt[0]), float(pt[1]), 0.0)
+        return vert_idxs[pt]
+
+    for i in range(div):
+        for j in range(div):
+            if cells is not None and (i, j) not in cells:
+                continue
+            texnum = 22000 if i < div // 2 else 22001
+            corners = [(i + di, j + dj)
+                       for di, dj in ((0, 0), (1, 0), (1, 1), (0, 1))]
+            for tri in ((0, 1, 2), (0, 2, 3)):
+                fvrts = [(vertex(corners[c]), norm_idx, corners[c][0] / div,
+                          corners[c][1] / div) for c in tri]
+                packed.add_face(norm_idx, 0.0, texnum, fvrts, 0)
+    return packed
+
+
+class TestCoplanarMerge(unittest.TestCase):
+
+    def test_merge_grid(self):
+        import mesh_opt
+        packed = make_tri_grid(4)
+        merged, stats = mesh_opt.merge_coplanar(packed)
+        self.assertEqual(stats["faces"], (32, 2))
+        self.assertEqual(merged.num_faces, 2)
+        # Each texture keeps its own face.
+        self.assertEqual(sorted(merged.face_texnums), [22000, 22001])
+        for face_idx in range(merged.num_faces):
+            fvrts = merged.face_fvrts(face_idx)
+            self.assertEqual(len(fvrts), 12)
+            # Winding is preserved
+            pts = [merged.vertex(merged.fvrt_verts[fv]) for fv in fvrts]
+            self.assertGreater(mesh_opt._newell_normal(pts)[2], 0.99)
+            self.assertEqual(merged.face_dplanes[face_idx], 0.0)
+        self.assertIn("faces 32 -> 2", mesh_opt.fmt_stats(stats))
+
+    def test_concave(self):
+        import mesh_opt
+        # An L shape can only be merged into two convex faces.
+        packed = make_tri_grid(4, {(0, 0), (1, 0), (0, 1)})
+        merged, stats = mesh_opt.merge_coplanar(packed)
+        self.assertEqual(merged.num_faces, 2)
+
+    def test_uv_seam(self):
+        import mesh_opt
+        packed = make_tri_grid(2, {(0, 0)})
+        # Split the UVs of the cell's second triangle from the first one.
+        for fvrt in packed.face_fvrts(1):
+            packed.fvrt_uvs[fvrt * 2] += 0.5
+        merged, stats = mesh_opt.merge_coplanar(packed)
+        self.assertEqual(merged.num_faces, 2)
+
+    def test_uv_fold(self):
+        "Faces with different UV mappings are not merged."
+        import mesh_opt
+        packed = make_tri_grid(2, {(0, 0)})
+        merged, stats = mesh_opt.merge_coplanar(packed)
+        self.assertEqual(merged.num_faces, 1)
+        # Fold the second triangle's UVs over the shared diagonal, so the
+        # UVs match along it, but not inside the cell.
+        fvrt = packed.face_fvrts(1)[2]
+        self.assertEqual(list(packed.fvrt_uvs[fvrt * 2:fvrt * 2 + 2]),
+                         [0.0, 0.5])
+        packed.fvrt_uvs[fvrt * 2] = 0.5
+        packed.fvrt_uvs[fvrt * 2 + 1] = 0.0
+        merged, stats = mesh_opt.merge_coplanar(packed)
+        self.assertEqual(merged.num_faces, 2)
+
+
+class TestCompact(unittest.TestCase):
+
+    def test_unused_and_welded(self):
+        import mesh_opt
+        packed = make_tri_grid(2)
+        packed.add_vertex(5.0, 5.0, 5.0)  # Unused
+        packed.add_normal(1.0, 0.0, 0.0)  # Unused
+        # A copy of vertex 0, slightly offset, used by the first face.
+        near = packed.add_vertex(0.0, 0.0, 0.00001)
+        packed.fvrt_verts[0] = near
+        packed.face_dplanes[0] = -0.00001
+        compacted, stats = mesh_opt.compact(packed, 0.0001)
+        self.assertEqual(stats["verts"], (11, 9))
+        # The D-Plane follows the welded vertex.
+        self.assertEqual(compacted.face_dplanes[0], 0.0)
+        self.assertEqual(stats["norms"], (2, 1))
+        self.assertEqual(compacted.num_faces, 8)
+        self.assertEqual(compacted.fvrt_verts[0], compacted.fvrt_verts[3])
+        self.assertLess(stats["bytes"][1], stats["bytes"][0])
+        # Without welding, the offset copy is kept.
+        compacted, stats = mesh_opt.compact(packed)
+        self.assertEqual(stats["verts"], (11, 10))
+
+    def test_degenerate_and_shared(self):
+        import mesh_opt
+        packed = make_tri_grid(1)
+        # Collapse the second triangle's last edge, and duplicate the first
+        # triangle with another texture.
+        tri = [(packed.fvrt_verts[fv], packed.fvrt_norms[fv],
+                packed.fvrt_uvs[fv * 2], packed.fvrt_uvs[fv * 2 + 1])
+               for fv in packed.face_fvrts(0)]
+        packed.add_face(0, 0.0, 22002, tri, 0)
+        packed.fvrt_verts[5] = packed.fvrt_verts[4]
+        compacted, stats = mesh_opt.compact(packed)
+        self.assertEqual(stats["faces"], (3, 2))
+        self.assertEqual(stats["fvrts"], (9, 3))
+        self.assertEqual(list(compacted.face_first), [0, 0])
+        self.assertEqual(list(compacted.face_texnums), [22001, 22002])
+
+
+class TestReorder(unittest.TestCase):
+
+    def test_texnum_groups(self):
+        import mesh_opt
+        import iff_mesh
+        from random import Random
+        grid = make_tri_grid(8)
+        # Shuffle the faces, so the textures are interleaved.
+        packed = grid.empty_copy()
+        order = list(range(grid.num_faces))
+        Random(42).shuffle(order)
+        for face_idx in order:
+            packed.add_face(
+                grid.face_norms[face_idx], 0.0, grid.face_texnums[face_idx],
+                [(grid.fvrt_verts[fv], grid.fvrt_norms[fv],
+                  grid.fvrt_uvs[fv * 2], grid.fvrt_uvs[fv * 2 + 1])
+                 for fv in grid.face_fvrts(face_idx)], 0)
+        reordered, stats = mesh_opt.reorder_faces(packed)
+        self.assertEqual(mesh_opt.texnum_runs(reordered), 2)
+        self.assertGreater(stats["texnum runs"][0], 2)
+        self.assertLess(mesh_opt.cache_misses(reordered),
+                        mesh_opt.cache_misses(packed))
+
+        # The faces are the same, with the same winding.
+        def faces(mesh):
+            return sorted(
+                (mesh.face_texnums[face_idx],
+                 min(tuple(mesh.vertex(mesh.fvrt_verts[fv]))
+                     for fv in mesh.face_fvrts(face_idx)),
+                 tuple(tuple(mesh.fvrt_uvs[fv * 2:fv * 2 + 2])
+                       for fv in mesh.face_fvrts(face_idx)))
+                for face_idx in range(mesh.num_faces))
+        self.assertEqual(faces(packed), faces(reordered))
+        self.assertIsInstance(reordered, iff_mesh.PackedLOD)
+
+
+class TestClusterNormals(unittest.TestCase):
+
+    def test_cluster(self):
+        import mesh_opt
+        from math import sin, cos, radians
+        packed = make_tri_grid(2)
+        # Tilt the normal of each FVRT by a different small angle.
+        for fvrt in range(len(packed.fvrt_norms)):
+            angle = radians(0.1 * (fvrt % 5))
+            packed.fvrt_norms[fvrt] = packed.add_normal(
+                sin(angle), 0.0, cos(angle))
+        self.assertEqual(len(packed.norms) // 3, 5)
+        clustered, stats = mesh_opt.cluster_normals(packed, 0.25)
+        self.assertEqual(stats["norms"], (5, 2))
+        self.assertLessEqual(stats["max error (degrees)"], 0.25)
+        # The face normal is kept exactly.
+        nidx = clustered.face_norms[0]
+        self.assertEqual(list(clustered.norms[nidx * 3:nidx * 3 + 3]),
+                         [0.0, 0.0, 1.0])
+        clustered, stats = mesh_opt.cluster_normals(packed, 0.05)
+        self.assertEqual(stats["norms"], (5, 5))
+        self.assertEqual(stats["max error (degrees)"], 0.0)
+
+    def test_cluster_seams(self):
+        "Normals a little apart are merged on the lower hemisphere too."
+        import mesh_opt
+        from math import sin, cos, radians
+        packed = make_tri_grid(2)
+        small = radians(0.3)
+        pairs = [
+            # Straddling -Z
+            ((sin(small), 0.0, -cos(small)),
+             (-sin(small), 0.0, -cos(small))),
+            ((0.0, sin(small), -cos(small)),
+             (0.0, -sin(small), -cos(small))),
+            # Straddling the Y = 0 plane, below the equator
+            ((cos(radians(30)) * cos(small), sin(small),
+              -sin(radians(30))),
+             (cos(radians(30)) * cos(small), -sin(small),
+              -sin(radians(30)))),
+            # Straddling the equator
+            ((0.0, cos(small), sin(small)), (0.0, cos(small), -sin(small))),
+        ]
+        for fvrt in range(len(packed.fvrt_norms)):
+            pair = pairs[fvrt // 2 % len(pairs)]
+            packed.fvrt_norms[fvrt] = packed.add_normal(*pair[fvrt % 2])
+        self.assertEqual(len(packed.norms) // 3, 1 + 2 * len(pairs))
+        clustered, stats = mesh_opt.cluster_normals(packed, 1.0)
+        # The -Z pairs are all within a degree of each other.
+        self.assertEqual(stats["norms"], (9, 4))
+        self.assertLessEqual(stats["max error (degrees)"], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+class TestPaletteBuilder(unittest.TestCase):
+
+    def test_reservoir(self):
+        "Reservoir samples stay bounded, and are roughly uniform."
+        import random
+        import palgen
+        hits = [0] * 100
+        for trial in range(1000):
+            sample = palgen.Reservoir(10, random.Random(trial))
+            for start in range(0, 100, 7):
+                sample.add_all(list(range(start, min(start + 7, 100))))
+            self.assertEqual(sample.seen, 100)
+            self.assertEqual(len(set(sample.items)), 10)
+            for item in sample.items:
+                hits[item] += 1
+        # Each item is expected to be picked 100 times.
+        self.assertGreater(min(hits), 60)
+        self.assertLess(max(hits), 140)
+
+    def test_few_colours(self):
+        "Images with fewer colours than the palette are matched exactly."
+        import mat_write
+        import palgen
+        from test_mat_write import make_palette
+        cmap = make_palette()
+        colours = [cmap[idx:idx + 3] for idx in range(3, 3 + 40 * 3, 3)]
+        builder = palgen.PaletteBuilder(sample_size=5000)
+        for img in range(3):
+            rgba = bytearray()
+            for pxl in range(64 * 64):
+                rgba.extend(colours[(pxl * 7 + img * 13) % len(colours)])
+                rgba.append(0 if pxl % 50 == 0 else 255)
+            builder.add_image("image{}".format(img), rgba)
+        palette = builder.build()
+        errors = builder.errors(palette)
+        self.assertEqual(list(errors.keys()), ["image0", "image1", "image2"])
+        self.assertEqual(list(errors.values()), [0.0] * 3)
+        self.assertEqual(palette.cmap[:3], bytes(3))
+        self.assertIsInstance(palette, mat_write.Palette)
+
+    def test_no_visible_pixels(self):
+        "No palette is built without any visible pixels to build it from."
+        import palgen
+        from test_mat_write import make_image, make_palette
+        self.assertEqual(palgen.palette_for_images([]), (None, None))
+        transparent = make_image(make_palette(), 8, 8)
+        transparent[3::4] = bytes(64)
+        self.assertEqual(palgen.palette_for_images(
+            [("clear", transparent)]), (None, None))
+        palette, errors = palgen.palette_for_images(
+            [("clear", transparent),
+             ("visible", make_image(make_palette(), 8, 8))], "test")
+        self.assertEqual(palette.name, "test")
+        self.assertEqual(list(errors.keys()), ["clear", "visible"])
+
+    def test_many_colours(self):
+        "Images with many colours are approximated closely."
+        import random
+        import palgen
+        rng = random.Random(1)
+        builder = palgen.PaletteBuilder(sample_size=20000)
+        rgba = bytearray()
+        for y in range(128):
+            for x in range(128):
+                rgba.extend((x * 2, y * 2, rng.randrange(100, 120), 255))
+        builder.add_image("gradient", rgba)
+        palette = builder.build(num_colours=255)
+        self.assertLess(builder.errors(palette)["gradient"], 10.0)
+        self.assertIn("gradient", palgen.fmt_errors(builder.errors(palette)))
+
+    def test_pal_file(self):
+        "Built palettes can be read by MATReader and pal2gpl."
+        import os
+        import mat_read
+        import mat_write
+        import palgen
+        from tempfile import TemporaryDirectory
+        from test_mat_write import make_palette, make_image
+        from util.pal2gpl import IffPalReader
+        cmap = make_palette()
+        builder = palgen.PaletteBuilder()
+        rgba = make_image(cmap, 32, 32)
+        builder.add_image("image", rgba)
+        palette = builder.build("SHIP")
+        with TemporaryDirectory() as root:
+            os.mkdir(os.path.join(root, "pal"))
+            os.mkdir(os.path.join(root, "mat"))
+            palpath = os.path.join(root, "pal", "ship.pal")
+            palette.write_pal(palpath)
+
+            pal_reader = IffPalReader(palpath)
+            pal_reader.read()
+            self.assertEqual(pal_reader.pal, "embedded")
+            self.assertEqual(bytes(pal_reader.pald), palette.cmap)
+
+            matfpath = os.path.join(root, "mat", "00022000.mat")
+            mat_write.MATWriter(matfpath, 32, 32, rgba, palette).write()
+            reader = mat_read.MATReader(matfpath)
+            reader.read()
+            self.assertEqual(bytes(reader.palette), palette.cmap)
+
+
+if __name__ == "__main__":
+    unittest.main()
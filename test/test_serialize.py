@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+def make_jobs(outdir, count):
+    "Make ModelJobs for some boxes, with generated LODs and a BSP collider."
+    import iff_mesh
+    import bsp
+    import mesh_opt
+    import serialize
+    from test_decimate import make_grid_box
+    jobs = []
+    for model in range(count):
+        packed = make_grid_box(model + 2)
+        packed.add_normal(0.0, 0.0, 1.0)
+        polys = [tuple(packed.fvrt_verts[fv]
+                       for fv in packed.face_fvrts(face_idx))
+                 for face_idx in range(packed.num_faces)]
+        sphere = iff_mesh.Sphere(0.5, 0.5, 0.5, 0.9)
+        collider = iff_mesh.Collider(
+            "bsp", sphere, bsp.BSPTree(packed.verts, polys))
+        hardpoint = iff_mesh.Hardpoint(
+            ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0)),
+            (0.0, 1.0, 0.0), "Gun")
+        jobs.append(serialize.ModelJob(
+            "{}/model{}".format(outdir, model), "Box", True, collider,
+            [hardpoint], [packed, None], [0.0, 500.0, None],
+            [sphere, None, None], [0.0, 500.0, None], num_gen_lods=1,
+            range_solver=True, opt_passes=[(mesh_opt.compact, {})]))
+    return jobs
+
+
+class TestSerialize(unittest.TestCase):
+
+    def test_parallel_identical(self):
+        "Model files written by worker processes match serial ones."
+        import os
+        import serialize
+        import workers
+        from tempfile import TemporaryDirectory
+        if not workers.can_fork():
+            self.skipTest("Worker processes are not available")
+        with TemporaryDirectory() as serial_dir, \
+                TemporaryDirectory() as parallel_dir:
+            times = serialize.write_models(make_jobs(serial_dir, 3), 1)
+            self.assertEqual(len(times), 3)
+            serialize.write_models(make_jobs(parallel_dir, 3), 2)
+            for model in range(3):
+                fname = "model{}.iff".format(model)
+                with open(os.path.join(serial_dir, fname), "rb") as f:
+                    serial = f.read()
+                with open(os.path.join(parallel_dir, fname), "rb") as f:
+                    parallel = f.read()
+                self.assertGreater(len(serial), 0)
+                self.assertEqual(serial, parallel)
+
+    def test_dedupe(self):
+        "Jobs that would write identical files are only written once."
+        import serialize
+        jobs = make_jobs("a", 2) + make_jobs("b", 2)
+        unique, aliases = serialize.dedupe_jobs(jobs)
+        self.assertEqual([job.filepath for job in unique],
+                         ["a/model0", "a/model1"])
+        self.assertEqual(aliases, {"b/model0": "a/model0",
+                                   "b/model1": "a/model1"})
+        # A different hardpoint makes the model different.
+        jobs[2].hardpoints[0].name = "Missile"
+        unique, aliases = serialize.dedupe_jobs(jobs)
+        self.assertEqual(len(unique), 3)
+        self.assertEqual(aliases, {"b/model1": "a/model1"})
+
+    def test_lod_texnums(self):
+        "LODs can use other textures, including generated LODs."
+        job = make_jobs("a", 1)[0]
+        plain_digest = job.digest()
+        job.lod_texnums = [{}, {}, {22000: 22010}]
+        self.assertNotEqual(job.digest(), plain_digest)
+        job.to_model()
+        self.assertEqual(set(job.packed_lods[0].face_texnums), {22000, 22001})
+        self.assertEqual(set(job.packed_lods[2].face_texnums), {22010, 22001})
+
+    def test_bad_lod(self):
+        import serialize
+        with self.assertRaises(TypeError):
+            serialize.ModelJob("model", "Box", True, None, [], ["LOD"],
+                               [0.0], [None])
+
+
+if __name__ == "__main__":
+    unittest.main()
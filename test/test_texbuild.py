@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+class TestTextureBuild(unittest.TestCase):
+
+    def setUp(self):
+        import os
+        from tempfile import TemporaryDirectory
+        self.tmpdir = TemporaryDirectory()
+        self.modeldir = os.path.join(self.tmpdir.name, "mesh")
+        os.mkdir(self.modeldir)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_rgba_bytes(self):
+        "Blender pixels are converted to bytes, and flipped vertically."
+        import array
+        import texbuild
+        pixels = array.array("f", [1.0, 0.5, 0.0, 1.0, 2.0, -1.0, 0.0, 0.0,
+                                   0.0, 0.0, 1.0, 1.0, 0.2, 0.4, 0.6, 0.8])
+        self.assertEqual(texbuild.rgba_bytes(pixels, 2, 2), bytes(
+            [0, 0, 255, 255, 51, 102, 153, 204,
+             255, 128, 0, 255, 255, 0, 0, 0]))
+
+    def test_downscale(self):
+        "Images are halved with a box filter weighted by alpha."
+        import texbuild
+        rgba = bytes([10, 20, 30, 255, 0, 0, 0, 0, 200, 100, 50, 255,
+                      0, 0, 0, 0, 1, 2, 3, 255, 1, 2, 3, 255])
+        small, width, height = texbuild.downscale(rgba, 3, 2)
+        self.assertEqual((width, height), (2, 1))
+        # The transparent pixels are left out, and alpha stays binary.
+        self.assertEqual(small, bytes([6, 11, 17, 255, 101, 51, 27, 255]))
+        rgba = bytes([0, 0, 0, 255, 0, 0, 0, 255, 0, 0, 0, 51, 0, 0, 0, 0])
+        small, width, height = texbuild.downscale(rgba, 2, 2)
+        self.assertEqual(small, bytes([0, 0, 0, 140]))
+        self.assertEqual(texbuild.variant_level(64, 32, 5), 2)
+        self.assertEqual(texbuild.variant_level(256, 256, 3), 3)
+        self.assertEqual(texbuild.variant_level(8, 8, 1), 0)
+
+    def test_downscaled_mat(self):
+        "Downscaled MATs use the same palette, and are noted in the cache."
+        import array
+        import os
+        import mat_read
+        import mat_write
+        import texbuild
+        from test_mat_write import make_palette, make_image
+        cmap = make_palette()
+        palette = mat_write.Palette(cmap)
+        matdir = texbuild.mat_dir(self.modeldir)
+        os.mkdir(matdir)
+        rgba = make_image(cmap, 16, 8, 0)
+        pixels = array.array("f", [value / 255 for value in rgba])
+        job = texbuild.TextureJob(os.path.join(matdir, "00022010.mat"),
+                                  16, 8, pixels, palette, scale=2)
+        job.run()
+        reader = mat_read.MATReader(job.matfpath)
+        reader.read()
+        self.assertEqual((reader.img_width, reader.img_height), (4, 2))
+        self.assertEqual(bytes(reader.palette), cmap)
+
+        cache = texbuild.BuildCache(matdir)
+        cache.variants["00022010.mat"] = "00022000.mat"
+        cache.save()
+        self.assertEqual(texbuild.BuildCache(matdir).base_texnums(),
+                         {22010: 22000})
+
+    def test_build_with_models(self):
+        "MATs are built alongside model files, and cached."
+        import array
+        import os
+        import mat_read
+        import mat_write
+        import serialize
+        import texbuild
+        from test_mat_write import make_palette, make_image
+        from test_serialize import make_jobs
+        cmap = make_palette()
+        palette = mat_write.Palette(cmap)
+        matdir = texbuild.mat_dir(self.modeldir)
+        self.assertEqual(matdir, os.path.join(self.tmpdir.name, "mat"))
+        os.mkdir(matdir)
+
+        images = [make_image(cmap, 8, 4, seed) for seed in range(3)]
+        tex_jobs = []
+        cache = texbuild.BuildCache(matdir)
+        for texnum, rgba in enumerate(images, 22000):
+            pixels = array.array("f", [value / 255 for value in rgba])
+            key = texbuild.build_key(str(texnum), palette)
+            fname = texbuild.mat_fname(texnum)
+            self.assertFalse(cache.lookup(fname, key))
+            tex_jobs.append(texbuild.TextureJob(
+                os.path.join(matdir, fname), 8, 4, pixels, palette))
+            cache.update(fname, key)
+        serialize.write_models(make_jobs(self.modeldir, 2) + tex_jobs, 2)
+        cache.save()
+
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.modeldir, "model1.iff")))
+        for texnum, rgba in enumerate(images, 22000):
+            reader = mat_read.MATReader(
+                os.path.join(matdir, texbuild.mat_fname(texnum)))
+            reader.read()
+            reader.flip_y()
+            self.assertEqual(bytes(reader.pixels), bytes(rgba))
+
+        cache = texbuild.BuildCache(matdir)
+        key = texbuild.build_key("22000", palette)
+        self.assertTrue(cache.lookup("00022000.mat", key))
+        self.assertFalse(cache.lookup("00022000.mat", texbuild.build_key(
+            "22000", mat_write.Palette(cmap, "space"))))
+        self.assertFalse(cache.lookup("00022000.mat", texbuild.build_key(
+            "22000", palette, ("downscale",))))
+
+
+if __name__ == "__main__":
+    unittest.main()
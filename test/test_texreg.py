@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+def allocate_textures(args):
+    "Get texture numbers for some images, in a separate export."
+    import texreg
+    reg_path, img_paths = args
+    with texreg.TextureRegistry(reg_path) as registry:
+        return [registry.texnum_for(path)[0] for path in img_paths]
+
+
+class TestTextureRegistry(unittest.TestCase):
+
+    def setUp(self):
+        import os
+        from tempfile import TemporaryDirectory
+        self.tmpdir = TemporaryDirectory()
+        self.root = self.tmpdir.name
+        os.mkdir(os.path.join(self.root, "models"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def image(self, name, data):
+        import os
+        path = os.path.join(self.root, name)
+        with open(path, "wb") as image_file:
+            image_file.write(data)
+        return path
+
+    def test_stable(self):
+        import texreg
+        import os
+        reg_path = texreg.find_registry(os.path.join(self.root, "models"))
+        self.assertEqual(os.path.dirname(reg_path),
+                         os.path.join(self.root, "models"))
+        hull = self.image("hull.png", b"hull")
+        wing = self.image("wing.png", b"wing")
+        with texreg.TextureRegistry(reg_path) as registry:
+            registry.reserve(22001)
+            self.assertEqual(
+                registry.texnum_for(hull, texreg.file_hash(hull)),
+                (22000, texreg.TEX_NEW))
+            self.assertEqual(
+                registry.texnum_for(wing, texreg.file_hash(wing)),
+                (22002, texreg.TEX_NEW))
+        # The registry is found from a subfolder.
+        subdir = os.path.join(self.root, "models", "capships")
+        os.mkdir(subdir)
+        self.assertEqual(texreg.find_registry(subdir), reg_path)
+        # Numbers stay the same, even if a texture is no longer used, and
+        # moved or changed textures keep their numbers.
+        wing2 = self.image("wing2.png", b"wing")
+        os.remove(wing)
+        self.image("hull.png", b"new hull")
+        with texreg.TextureRegistry(reg_path) as registry:
+            self.assertEqual(
+                registry.texnum_for(wing2, texreg.file_hash(wing2)),
+                (22002, texreg.TEX_MOVED))
+            self.assertEqual(
+                registry.texnum_for(hull, texreg.file_hash(hull)),
+                (22000, texreg.TEX_CHANGED))
+            self.assertEqual(
+                registry.texnum_for(hull, texreg.file_hash(hull)),
+                (22000, texreg.TEX_SAME))
+            new = self.image("new.png", b"new")
+            self.assertEqual(registry.texnum_for(new)[0], 22001)
+        with texreg.TextureRegistry(reg_path, read_only=True) as registry:
+            self.assertEqual(registry.texnum_for(new)[1], texreg.TEX_SAME)
+
+    def test_names(self):
+        "Textures made by the exporter are stored by name."
+        import os
+        import texreg
+        reg_path = os.path.join(self.root, texreg.REGISTRY_FNAME)
+        names = ["//atlas_0123456789abcdef", "//hull.png.half1"]
+        with texreg.TextureRegistry(reg_path) as registry:
+            self.assertEqual(
+                [registry.texnum_for_name(name) for name in names],
+                [(22000, texreg.TEX_NEW), (22001, texreg.TEX_NEW)])
+        with texreg.TextureRegistry(reg_path) as registry:
+            self.assertEqual(registry.textures[22000]["path"], names[0])
+            self.assertEqual(
+                [registry.texnum_for_name(name) for name in names],
+                [(22000, texreg.TEX_SAME), (22001, texreg.TEX_SAME)])
+
+    def test_next_free(self):
+        "The next free texture number is kept in the registry."
+        import os
+        import texreg
+        reg_path = os.path.join(self.root, texreg.REGISTRY_FNAME)
+        with texreg.TextureRegistry(reg_path) as registry:
+            for img in range(100):
+                registry.texnum_for_name("//{}.png.half1".format(img))
+        with texreg.TextureRegistry(reg_path) as registry:
+            self.assertEqual(registry.next_free, 22100)
+            self.assertEqual(registry.texnum_for_name("//new.png.half1"),
+                             (22100, texreg.TEX_NEW))
+        # A different starting number does not use the saved one.
+        with texreg.TextureRegistry(reg_path, 21000) as registry:
+            self.assertEqual(registry.next_free, 21000)
+            self.assertEqual(registry.texnum_for_name("//old.png.half1"),
+                             (21000, texreg.TEX_NEW))
+
+    def test_concurrent(self):
+        "Concurrent exports never give two images the same number."
+        import os
+        import texreg
+        import workers
+        if not workers.can_fork():
+            self.skipTest("Worker processes are not available")
+        reg_path = os.path.join(self.root, texreg.REGISTRY_FNAME)
+        jobs = [(reg_path, [os.path.join(self.root, "{}_{}.png".format(
+            export, img)) for img in range(20)]) for export in range(4)]
+        with workers.WorkerPool(4) as pool:
+            results = pool.map(allocate_textures, jobs)
+        texnums = [texnum for result in results for texnum in result]
+        self.assertEqual(len(set(texnums)), 80)
+        with texreg.TextureRegistry(reg_path, read_only=True) as registry:
+            self.assertEqual(len(registry.textures), 80)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+# -*- coding: utf8 -*-
+
+import unittest
+
+
+def _read_sum(task):
+    import workers
+    descriptor, start, stop = task
+    return sum(workers.read_shared(descriptor, start, stop))
+
+
+class TestMemoryWatch(unittest.TestCase):
+
+    def test_growth(self):
+        "Memory growth is measured from when the MemoryWatch was made."
+        import workers
+        watch = workers.MemoryWatch()
+        if watch.start is None:
+            self.skipTest("Memory use cannot be measured here")
+        self.assertEqual(watch.growth, 0.0)
+        data = bytearray(64 * 1048576)
+        for page in range(0, len(data), 4096):
+            data[page] = 1  # Make sure the pages are really allocated
+        watch.sample()
+        del data
+        watch.sample()
+        self.assertGreaterEqual(watch.growth, 32.0)
+
+
+class TestSharedArray(unittest.TestCase):
+
+    def test_read_slices(self):
+        "Slices of a shared array are read back, until it is closed."
+        import array
+        import workers
+        data = array.array("f", (idx * 0.5 for idx in range(1000)))
+        with workers.SharedArray(data) as shared:
+            descriptor = shared.descriptor
+            self.assertEqual(workers.read_shared(shared.descriptor), data)
+            self.assertEqual(workers.read_shared(shared.descriptor, 10, 20),
+                             data[10:20])
+            if workers.can_fork():
+                with workers.WorkerPool(2) as pool:
+                    self.assertEqual(pool.map(_read_sum, [
+                        (shared.descriptor, 0, 500),
+                        (shared.descriptor, 500, 1000)]),
+                        [sum(data[:500]), sum(data[500:])])
+        with self.assertRaises(ValueError):
+            workers.read_shared(descriptor)
+        empty = workers.SharedArray(array.array("i"))
+        self.assertEqual(len(workers.read_shared(empty.descriptor)), 0)
+        empty.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,284 @@
+# -*- coding: utf8 -*-
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+
+# Texture build stage of the exporter.
+#
+# Converts the texture images used by the exported models to MATs in the
+# "mat" folder next to the export folder. The build cache in that folder
+# maps each MAT to a hash of the image, palette, and settings it was built
+# from, so unchanged textures are not converted again. Texture atlases are
+# put together from their images, and built the same way.
+#
+# Distant LODs can use downscaled copies of the textures ("variants"), which
+# are halved once for each LOD after the first one that uses them.
+import hashlib
+import json
+import os
+import time
+from itertools import repeat
+from operator import add, floordiv, mul
+
+try:
+    from . import mat_write
+except ImportError:
+    # Not imported as part of the add-on (ex. by the unit tests)
+    import mat_write
+
+CACHE_FNAME = "wcp_mat_cache.json"
+CACHE_VERSION = 1
+BUILD_VERSION = 1  # Change this when MATs would be built differently
+MIN_VARIANT_SIZE = 8  # Textures are not downscaled below this size
+# Alpha -> 0 or 255, to keep the transparency of a texture binary
+_THRESHOLD = bytes(0 if value < 128 else 255 for value in range(256))
+
+
+def mat_dir(modeldir):
+    "The folder MATs are built in, next to the export folder."
+    return os.path.join(os.path.dirname(os.path.abspath(modeldir)), "mat")
+
+
+def mat_fname(texnum):
+    "The filename of the MAT for a texture number."
+    return "{!s:0>8}.mat".format(texnum)
+
+
+def build_key(content_hash, palette, settings=()):
+    """Hash of everything a MAT is built from.
+
+    content_hash is a hash of the image, and settings are any other values
+    that affect the MAT."""
+    digest = hashlib.sha1()
+    digest.update(repr((BUILD_VERSION, content_hash, palette.name,
+                        tuple(settings))).encode("utf-8"))
+    digest.update(palette.cmap)
+    return digest.hexdigest()
+
+
+def palette_key(content_hashes, settings=()):
+    "Hash of everything a palette built from a set of images depends on."
+    digest = hashlib.sha1()
+    digest.update(repr((BUILD_VERSION, sorted(content_hashes),
+                        tuple(settings))).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def rgba_bytes(pixels, width, height):
+    """Convert Blender image pixels to RGBA bytes.
+
+    Blender stores each channel as a float from 0 to 1, starting with the
+    bottom row, while MATs start with the top row."""
+    if len(pixels) != width * height * 4:
+        raise ValueError("Expected {} pixel values, got {}!".format(
+            width * height * 4, len(pixels)))
+    values = map(round, map(mul, pixels, repeat(255.0)))
+    rgba = bytes(map(min, map(max, values, repeat(0)), repeat(255)))
+    row = width * 4
+    return b"".join(rgba[start:start + row]
+                    for start in range(len(rgba) - row, -1, -row))
+
+
+def _weighted_mean(total, weight):
+    return (total + weight // 2) // weight if weight else 0
+
+
+def downscale(rgba, width, height):
+    """Halve the size of an RGBA image with a 2x2 box filter.
+
+    Colours are weighted by alpha, so transparent pixels do not bleed into
+    visible ones, and images that are only fully opaque or fully
+    transparent stay that way. Odd sizes are rounded up, by repeating the
+    last row or column. Returns the RGBA bytes, width, and height of the
+    smaller image."""
+    rgba = bytes(rgba)
+    row_size = width * 4
+    rows = [rgba[start:start + row_size]
+            for start in range(0, len(rgba), row_size)]
+    if width % 2:
+        rows = [row + row[-4:] for row in rows]
+    if height % 2:
+        rows.append(rows[-1])
+    top = b"".join(rows[0::2])
+    bottom = b"".join(rows[1::2])
+    # The four pixels of each 2x2 box, as (data, offset) pairs
+    corners = [(src, offset) for src in (top, bottom) for offset in (0, 4)]
+    alphas = [src[offset + 3::8] for src, offset in corners]
+    weights = list(map(sum, zip(*alphas)))
+    small = bytearray(len(weights) * 4)
+    for chan in range(3):
+        totals = map(sum, zip(*(
+            map(mul, src[offset + chan::8], alpha)
+            for (src, offset), alpha in zip(corners, alphas))))
+        small[chan::4] = bytes(map(_weighted_mean, totals, weights))
+    alpha = bytes(map(floordiv, map(add, weights, repeat(2)), repeat(4)))
+    if not rgba[3::4].translate(None, b"\x00\xff"):
+        alpha = alpha.translate(_THRESHOLD)
+    small[3::4] = alpha
+    return bytes(small), (width + 1) // 2, (height + 1) // 2
+
+
+def variant_level(width, height, level):
+    """Limit how many times a texture is halved.
+
+    Returns the largest number of times, up to level, that the texture can
+    be halved without either side being less than MIN_VARIANT_SIZE."""
+    for cur_level in range(level):
+        width, height = (width + 1) // 2, (height + 1) // 2
+        if min(width, height) < MIN_VARIANT_SIZE:
+            return cur_level
+    return level
+
+
+def variant_name(name, level):
+    """The texture filename for a texture halved level times.
+
+    The name never ends in a number, so it is not taken for a numeric
+    texture."""
+    return "{}.half{}".format(name, level)
+
+
+def is_variant_name(name):
+    "Whether a texture filename was made by variant_name."
+    ext = name.rpartition(".")[2]
+    return ext.startswith("half") and ext[4:].isdigit()
+
+
+class TextureJob:
+    """Everything needed to build a MAT.
+
+    pixels are the pixels of the image, as Blender stores them. The image
+    is halved scale times before it is converted. Like serialize.ModelJob,
+    it only holds plain Python data, so it can be run by a worker
+    process."""
+
+    def __init__(self, matfpath, width, height, pixels, palette,
+                 test_run=False, scale=0):
+        self.matfpath = matfpath
+        self.width = width
+        self.height = height
+        self.pixels = pixels
+        self.palette = palette
+        self.test_run = test_run
+        self.scale = scale
+
+    def rgba(self):
+        "Get the RGBA bytes of the MAT."
+        return rgba_bytes(self.pixels, self.width, self.height)
+
+    def run(self):
+        """Build and write the MAT.
+
+        Returns the number of seconds it took."""
+        start = time.perf_counter()
+        rgba, width, height = self.rgba(), self.width, self.height
+        for level in range(self.scale):
+            rgba, width, height = downscale(rgba, width, height)
+        writer = mat_write.MATWriter(
+            self.matfpath, width, height, rgba, self.palette)
+        if self.test_run:
+            writer.to_form()  # Convert the image, but don't write the MAT
+        else:
+            writer.write()
+        return time.perf_counter() - start
+
+
+class AtlasJob(TextureJob):
+    """Everything needed to build the MAT for a texture atlas.
+
+    parts holds the (x, y, width, height, pixels) of each image in the
+    atlas, as in atlas.Atlas.placements. The padding around each image is
+    filled with the pixels at its edges, so they do not bleed into each
+    other when the texture is filtered."""
+
+    def __init__(self, matfpath, width, height, parts, palette, padding=0,
+                 test_run=False, scale=0):
+        super().__init__(matfpath, width, height, None, palette, test_run,
+                         scale)
+        self.parts = parts
+        self.padding = padding
+
+    def rgba(self):
+        "Put the images together."
+        canvas = bytearray(self.width * self.height * 4)
+        pad = self.padding
+        for left, top, width, height, pixels in self.parts:
+            image = rgba_bytes(pixels, width, height)
+            row_size = width * 4
+            rows = []
+            for start in range(0, len(image), row_size):
+                row = image[start:start + row_size]
+                rows.append(row[:4] * pad + row + row[-4:] * pad)
+            rows = rows[:1] * pad + rows + rows[-1:] * pad
+            offset = ((top - pad) * self.width + left - pad) * 4
+            for row in rows:
+                canvas[offset:offset + len(row)] = row
+                offset += self.width * 4
+        return bytes(canvas)
+
+
+class BuildCache:
+    """The texture build cache for a MAT folder.
+
+    MATs, and palettes built for them, are looked up and stored by their
+    path relative to the MAT folder. variants maps the filename of each
+    downscaled MAT to the filename of the full size MAT, so the importer
+    can use the full size texture instead."""
+
+    def __init__(self, matdir):
+        self.matdir = matdir
+        self.path = os.path.join(matdir, CACHE_FNAME)
+        self.mats = {}
+        self.variants = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as cache_file:
+                data = json.load(cache_file)
+        except (OSError, ValueError):
+            data = None
+        if isinstance(data, dict) and data.get("version") == CACHE_VERSION:
+            self.mats = data.get("mats", {})
+            self.variants = data.get("variants", {})
+
+    def lookup(self, fname, key):
+        "Check whether a file was built from the data with the given key."
+        return (self.mats.get(fname) == key and
+                os.path.isfile(os.path.join(self.matdir, fname)))
+
+    def update(self, fname, key):
+        "Record the key a file was built from."
+        self.mats[fname] = key
+
+    def base_texnums(self):
+        "Map the texture number of each downscaled MAT to the full size one."
+        texnums = {}
+        for variant, base in self.variants.items():
+            try:
+                texnums[int(variant[:-4])] = int(base[:-4])
+            except ValueError:
+                continue
+        return texnums
+
+    def save(self):
+        "Write the cache file."
+        os.makedirs(self.matdir, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as cache_file:
+            json.dump({"version": CACHE_VERSION, "mats": self.mats,
+                       "variants": self.variants},
+                      cache_file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,270 @@
+# -*- coding: utf8 -*-
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+
+# Persistent texture number registry.
+#
+# The registry is a JSON file shared by every model in a mod's folder tree.
+# It remembers the texture number given to each texture image, by its path
+# and by a hash of its contents, so that a texture keeps its number between
+# exports, even if other textures are added or removed, or it is moved.
+# Textures made by the exporter, like atlases, are remembered by name.
+import hashlib
+import json
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+REGISTRY_FNAME = "wcp_textures.json"
+REGISTRY_VERSION = 1
+
+# Texture status, as returned by TextureRegistry.texnum_for
+TEX_NEW = "new"  # Not in the registry before
+TEX_CHANGED = "changed"  # Same path, different contents
+TEX_MOVED = "moved"  # Same contents, different path
+TEX_SAME = "same"  # Same path and contents
+
+
+def find_registry(modeldir):
+    """Find the registry file for a folder.
+
+    The folder and its parents are searched for an existing registry. If
+    none is found, the registry is made in the folder itself."""
+    folder = os.path.abspath(modeldir)
+    while True:
+        path = os.path.join(folder, REGISTRY_FNAME)
+        if os.path.isfile(path):
+            return path
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            return os.path.join(os.path.abspath(modeldir), REGISTRY_FNAME)
+        folder = parent
+
+
+def file_hash(path):
+    "SHA-1 hash of the contents of a file, or None if it cannot be read."
+    digest = hashlib.sha1()
+    try:
+        with open(path, "rb") as image_file:
+            for block in iter(lambda: image_file.read(1 << 16), b""):
+                digest.update(block)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+class TextureRegistry:
+    """Maps texture images to stable texture numbers.
+
+    Use it as a context manager to lock the registry file, so that several
+    exports can share it safely. The registry is loaded when the lock is
+    acquired, and saved when it is released, unless read_only is True."""
+
+    LOCK_TIMEOUT = 30.0  # Seconds to wait for another export's lock
+
+    def __init__(self, path, start_texnum=22000, read_only=False):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.start_texnum = start_texnum
+        self.read_only = read_only
+        self._lock_fd = None
+        self._clear()
+
+    def _clear(self):
+        self.textures = {}  # texnum -> {"path": ..., "hash": ...}
+        self.by_path = {}
+        self.by_hash = {}
+        self.reserved = set()  # Numbers used by numeric texture filenames
+        self.next_free = self.start_texnum
+        self.free = []  # Unused numbers below next_free, in order
+
+    def load(self):
+        "Load the registry file, if it exists."
+        self._clear()
+        try:
+            with open(self.path, "r", encoding="utf-8") as reg_file:
+                data = json.load(reg_file)
+        except OSError:
+            return
+        except ValueError:
+            raise ValueError("The texture registry {} is corrupt!".format(
+                self.path))
+        if data.get("version") != REGISTRY_VERSION:
+            raise ValueError("Unknown texture registry version in {}!".format(
+                self.path))
+        for texnum, entry in data["textures"].items():
+            self._set(int(texnum), entry["path"], entry.get("hash"))
+        # Numbers below next_free are all taken, except for the ones in
+        # free, unless the registry was last used with a different starting
+        # texture number.
+        if data.get("start_texnum") == self.start_texnum:
+            self.next_free = max(self.start_texnum,
+                                 data.get("next_free", self.start_texnum))
+            self.free = [texnum for texnum in data.get("free", [])
+                         if texnum not in self.textures]
+
+    def save(self):
+        "Write the registry file."
+        data = {
+            "version": REGISTRY_VERSION,
+            "start_texnum": self.start_texnum,
+            "next_free": self.next_free,
+            "free": self.free,
+            "textures": {str(texnum): entry for texnum, entry in
+                         sorted(self.textures.items())},
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as reg_file:
+            json.dump(data, reg_file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def _set(self, texnum, path, content_hash):
+        old = self.textures.get(texnum)
+        if old is not None:
+            if self.by_path.get(old["path"]) == texnum:
+                del self.by_path[old["path"]]
+            if old["hash"] and self.by_hash.get(old["hash"]) == texnum:
+                del self.by_hash[old["hash"]]
+        self.textures[texnum] = {"path": path, "hash": content_hash}
+        self.by_path[path] = texnum
+        if content_hash:
+            self.by_hash.setdefault(content_hash, texnum)
+
+    def reserve(self, texnum):
+        "Keep a texture number from being given to a new texture."
+        self.reserved.add(texnum)
+
+    def _allocate(self):
+        """Get the lowest unused texture number.
+
+        next_free only moves forward, and is saved in the registry along
+        with the numbers it skipped because they were reserved, so
+        allocating a number does not depend on how many textures are
+        already in the registry."""
+        for idx, texnum in enumerate(self.free):
+            if texnum not in self.reserved:
+                del self.free[idx]
+                return texnum
+        while (self.next_free in self.textures or
+               self.next_free in self.reserved):
+            if self.next_free not in self.textures:
+                self.free.append(self.next_free)
+            self.next_free += 1
+        texnum = self.next_free
+        self.next_free += 1
+        return texnum
+
+    def _rel_path(self, path):
+        "Path of a file relative to the registry, with / separators."
+        rel_path = os.path.relpath(os.path.abspath(path), self.root)
+        return rel_path.replace(os.sep, "/")
+
+    def texnum_for(self, path, content_hash=None):
+        """Get the texture number for a texture image.
+
+        Images are stored by their path relative to the registry, so the
+        registry can be moved along with the mod folder. Returns the texture
+        number, and its status (TEX_NEW, TEX_CHANGED, TEX_MOVED, or
+        TEX_SAME)."""
+        path = self._rel_path(path)
+        texnum = self.by_path.get(path)
+        if texnum is not None and texnum not in self.reserved:
+            old_hash = self.textures[texnum]["hash"]
+            if content_hash is None or old_hash == content_hash:
+                return texnum, TEX_SAME
+            self._set(texnum, path, content_hash)
+            return texnum, TEX_CHANGED
+        texnum = self.by_hash.get(content_hash) if content_hash else None
+        if (texnum is not None and texnum not in self.reserved and
+                not os.path.exists(os.path.join(
+                    self.root, self.textures[texnum]["path"]))):
+            # The texture was moved or renamed.
+            self._set(texnum, path, content_hash)
+            return texnum, TEX_MOVED
+        texnum = self._allocate()
+        self._set(texnum, path, content_hash)
+        return texnum, TEX_NEW
+
+    def texnum_for_name(self, name):
+        """Get the texture number for a texture made by the exporter.
+
+        These textures, like atlases and halved textures, are not image
+        files, so they are stored by name, without a hash. Returns the
+        texture number, and its status (TEX_NEW or TEX_SAME)."""
+        texnum = self.by_path.get(name)
+        if texnum is not None and texnum not in self.reserved:
+            return texnum, TEX_SAME
+        texnum = self._allocate()
+        self._set(texnum, name, None)
+        return texnum, TEX_NEW
+
+    def _lock(self):
+        lock_path = self.path + ".lock"
+        self._lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT)
+        deadline = time.monotonic() + self.LOCK_TIMEOUT
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                elif msvcrt is not None:
+                    msvcrt.locking(self._lock_fd, msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    os.close(self._lock_fd)
+                    self._lock_fd = None
+                    raise TimeoutError("Timed out waiting for the lock on the "
+                                       "texture registry {}!".format(
+                                           self.path))
+                time.sleep(0.05)
+
+    def _unlock(self):
+        if self._lock_fd is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+        elif msvcrt is not None:
+            os.lseek(self._lock_fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._lock_fd, msvcrt.LK_UNLCK, 1)
+        os.close(self._lock_fd)
+        self._lock_fd = None
+
+    def __enter__(self):
+        self._lock()
+        try:
+            self.load()
+        except Exception:
+            self._unlock()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None and not self.read_only:
+                self.save()
+        finally:
+            self._unlock()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# BSP tree builder benchmark
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+# -*- coding: utf8 -*-
+
+import argparse
+from math import sin, cos, pi
+from random import Random
+from os import getcwd
+from os.path import abspath
+from sys import path
+path.append(abspath(getcwd() + "/.."))
+
+
+def make_hull(num_polys, seed=0):
+    """Make a test "hull" with roughly num_polys polygons.
+
+    The hull is a stretched, lumpy ellipsoid made of quads, with triangle
+    fans at the poles. Returns a flat vertex array and a list of polygons."""
+    rnd = Random(seed)
+    rings = max(4, int((num_polys / 2) ** 0.5))
+    segs = max(3, num_polys // (2 * rings))
+    coords = [0.0, -4.0, 0.0]  # South pole
+    for ring in range(1, rings):
+        lat = pi * ring / rings - pi / 2
+        for seg in range(segs):
+            lon = 2 * pi * seg / segs
+            lump = 1 + rnd.uniform(-0.02, 0.02)
+            coords.extend((cos(lat) * cos(lon) * 10 * lump,
+                           sin(lat) * 4 * lump,
+                           cos(lat) * sin(lon) * 40 * lump))
+    coords.extend((0.0, 4.0, 0.0))  # North pole
+    north = len(coords) // 3 - 1
+
+    def ring_vert(ring, seg):
+        return 1 + (ring - 1) * segs + seg % segs
+
+    polys = []
+    for seg in range(segs):
+        polys.append((0, ring_vert(1, seg), ring_vert(1, seg + 1)))
+        polys.append((north, ring_vert(rings - 1, seg + 1),
+                      ring_vert(rings - 1, seg)))
+    for ring in range(1, rings - 1):
+        for seg in range(segs):
+            # Lumpy quads are not planar, so split them into triangles.
+            a = ring_vert(ring, seg)
+            b = ring_vert(ring + 1, seg)
+            c = ring_vert(ring + 1, seg + 1)
+            d = ring_vert(ring, seg + 1)
+            polys.append((a, b, c))
+            polys.append((a, c, d))
+    return coords, polys
+
+
+if __name__ == '__main__':
+
+    argp = argparse.ArgumentParser(
+        description="Benchmark the BSP tree builder on a generated hull.")
+
+    argp.add_argument('-n', '--polys', action='store', type=int,
+                      default=10000, dest='polys',
+                      help="Approximate number of polygons in the hull.")
+
+    argp.add_argument('-r', '--runs', action='store', type=int, default=1,
+                      dest='runs', help="Number of times to build the tree.")
+
+    argp.add_argument('-w', '--workers', action='store', default="1,2,4,8",
+                      dest='workers', help="Comma-separated list of worker "
+                      "process counts to build the tree with.")
+
+    args = argp.parse_args()
+
+    import bsp
+
+    coords, polys = make_hull(args.polys)
+    print("Hull: {} vertices, {} polygons".format(len(coords) // 3,
+                                                  len(polys)))
+    serial_time = None
+    serial_tree = None
+    for num_workers in map(int, args.workers.split(",")):
+        times = []
+        for run in range(args.runs):
+            tree = bsp.BSPTree(coords, polys, workers=num_workers)
+            print(tree.fmt_stats())
+            times.append(tree.build_time)
+        best = min(times)
+        if serial_time is None:
+            serial_time = best
+            serial_tree = tree
+        same = ((tree.verts, tree.nodes, tree.polys, tree.pvrts) ==
+                (serial_tree.verts, serial_tree.nodes, serial_tree.polys,
+                 serial_tree.pvrts))
+        print("{} workers: best {:.3f} seconds, {:.2f}x speedup, {}".format(
+            num_workers, best, serial_time / best,
+            "identical" if same else "DIFFERENT TREE!"))
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# VISION engine palette builder
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+# -*- coding: utf8 -*-
+
+import argparse
+import os
+import struct
+import zlib
+from os import getcwd
+from os.path import abspath
+from sys import path
+path.append(abspath(getcwd() + "/.."))
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}  # Colour type -> channels
+
+
+def paeth(left, up, upleft):
+    estimate = left + up - upleft
+    dleft = abs(estimate - left)
+    dup = abs(estimate - up)
+    dupleft = abs(estimate - upleft)
+    if dleft <= dup and dleft <= dupleft:
+        return left
+    elif dup <= dupleft:
+        return up
+    return upleft
+
+
+def unfilter(ftype, line, prev, bpp):
+    "Undo the filter on a row of a PNG image, in place."
+    if ftype == 0:
+        return
+    elif ftype == 2:
+        line[:] = bytes((cur + up) & 0xFF for cur, up in zip(line, prev))
+        return
+    for idx in range(len(line)):
+        left = line[idx - bpp] if idx >= bpp else 0
+        if ftype == 1:
+            line[idx] = (line[idx] + left) & 0xFF
+        elif ftype == 3:
+            line[idx] = (line[idx] + (left + prev[idx]) // 2) & 0xFF
+        elif ftype == 4:
+            upleft = prev[idx - bpp] if idx >= bpp else 0
+            line[idx] = (line[idx] + paeth(left, prev[idx], upleft)) & 0xFF
+        else:
+            raise ValueError("Unknown PNG filter type {}!".format(ftype))
+
+
+def read_png(fname):
+    """Read an 8-bit, non-interlaced PNG image.
+
+    Returns the width and height of the image, and its pixels as RGBA
+    bytes, starting with the top row."""
+    with open(fname, "rb") as png_file:
+        data = png_file.read()
+    if data[:8] != PNG_SIGNATURE:
+        raise TypeError("{} is not a PNG image!".format(fname))
+    pos = 8
+    idat = bytearray()
+    plte = b""
+    trns = b""
+    while pos < len(data):
+        length, ctype = struct.unpack_from(">I4s", data, pos)
+        body = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if ctype == b"IHDR":
+            (width, height, depth, colour, compression, filter_method,
+             interlace) = struct.unpack(">IIBBBBB", body)
+        elif ctype == b"PLTE":
+            plte = body
+        elif ctype == b"tRNS":
+            trns = body
+        elif ctype == b"IDAT":
+            idat.extend(body)
+        elif ctype == b"IEND":
+            break
+    if depth != 8 or interlace != 0:
+        raise ValueError("{}: Only 8-bit, non-interlaced PNG images are "
+                         "supported!".format(fname))
+
+    bpp = PNG_CHANNELS[colour]
+    stride = width * bpp
+    raw = zlib.decompress(bytes(idat))
+    pixels = bytearray()
+    prev = bytearray(stride)
+    for row in range(height):
+        start = row * (stride + 1)
+        line = bytearray(raw[start + 1:start + 1 + stride])
+        unfilter(raw[start], line, prev, bpp)
+        pixels.extend(line)
+        prev = line
+
+    num_pixels = width * height
+    if colour == 6:
+        return width, height, bytes(pixels)
+    rgba = bytearray(num_pixels * 4)
+    rgba[3::4] = b"\xff" * num_pixels
+    if colour == 2:
+        for chan in range(3):
+            rgba[chan::4] = pixels[chan::3]
+    elif colour in (0, 4):
+        for chan in range(3):
+            rgba[chan::4] = pixels[0::bpp]
+        if colour == 4:
+            rgba[3::4] = pixels[1::2]
+    elif colour == 3:
+        plte = plte.ljust(768, b"\x00")
+        for chan in range(3):
+            rgba[chan::4] = bytes(pixels).translate(plte[chan::3])
+        rgba[3::4] = bytes(pixels).translate(trns.ljust(256, b"\xff"))
+    return width, height, bytes(rgba)
+
+
+def read_mat(fname):
+    "Read a MAT, and return its width, height, and RGBA pixels."
+    from mat_read import MATStream
+    with MATStream(fname) as stream:
+        return stream.width, stream.height, b"".join(stream.rows())
+
+
+READERS = {".png": read_png, ".mat": read_mat}
+
+
+def find_images(paths):
+    "Find the images in a list of files and folders."
+    for fpath in paths:
+        if os.path.isdir(fpath):
+            for dirpath, dirnames, fnames in os.walk(fpath):
+                dirnames.sort()
+                for fname in sorted(fnames):
+                    if os.path.splitext(fname)[1].lower() in READERS:
+                        yield os.path.join(dirpath, fname)
+        else:
+            yield fpath
+
+
+if __name__ == '__main__':
+    import palgen
+
+    argp = argparse.ArgumentParser(
+        description="Build a VISION engine palette (.pal) for a set of MAT "
+        "or PNG images.")
+
+    argp.add_argument('images', action='store', nargs='+', metavar='IMAGE',
+                      help="The images, or folders of images, to build the "
+                      "palette for.")
+
+    argp.add_argument('-o', '--out-file', action='store', metavar='FILE',
+                      dest='out_file', default='palette.pal',
+                      help="The palette file to write.")
+
+    argp.add_argument('-n', '--colours', action='store', type=int,
+                      dest='colours', default=255,
+                      help="The number of colours to use, not counting "
+                      "colour 0, which is used for transparent pixels.")
+
+    argp.add_argument('-s', '--sample-size', action='store', type=int,
+                      dest='sample_size', default=palgen.SAMPLE_SIZE,
+                      help="The number of pixels to sample from the images.")
+
+    args = argp.parse_args()
+
+    builder = palgen.PaletteBuilder(args.sample_size)
+    for img_fname in find_images(args.images):
+        ext = os.path.splitext(img_fname)[1].lower()
+        if ext not in READERS:
+            print("Skipping {}: unknown image format".format(img_fname))
+            continue
+        width, height, rgba = READERS[ext](img_fname)
+        builder.add_image(img_fname, rgba)
+
+    palette = builder.build(num_colours=args.colours)
+    print(palgen.fmt_errors(builder.errors(palette)))
+    palette.write_pal(args.out_file)
+    print("Wrote {}".format(args.out_file))
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# VISION engine duplicate texture finder
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+# -*- coding: utf8 -*-
+
+# Finds MATs that look the same, even if their palettes or pixels differ
+# slightly, and works out which texture numbers the meshes could use
+# instead. Each MAT gets an exact hash of its decoded pixels, and a
+# difference hash (dHash) of a 9x8 grayscale thumbnail. Hashes within a few
+# bits of each other are found with a BK-tree.
+import argparse
+import hashlib
+import json
+import os
+import struct
+from collections import OrderedDict
+from operator import mul
+from os import getcwd
+from os.path import abspath
+from sys import path
+path.append(abspath(getcwd() + "/.."))
+
+HASH_WIDTH = 9  # The dHash compares 8 pairs of cells in each of 8 rows
+HASH_HEIGHT = 8
+FACE_FMT = "<if5i"
+DEFAULT_ALT_MAT = 0x7F0096FF  # Alternate material of faces without one
+
+
+def cell_bounds(size, cells):
+    "Split size pixels into cells, each at least one pixel wide."
+    bounds = []
+    for cell in range(cells):
+        start = cell * size // cells
+        bounds.append((start, max((cell + 1) * size // cells, start + 1)))
+    return bounds
+
+
+def mat_hashes(fname):
+    """Hash a MAT.
+
+    Returns the filename, width, height, SHA-1 hash of the RGBA pixels, and
+    64-bit dHash. Transparent pixels count as black in the dHash."""
+    from mat_read import MATStream
+    digest = hashlib.sha1()
+    with MATStream(fname) as stream:
+        width, height = stream.width, stream.height
+        digest.update(struct.pack("<II", width, height))
+        columns = cell_bounds(width, HASH_WIDTH)
+        rows = cell_bounds(height, HASH_HEIGHT)
+        # Alpha weighted sums of the red, green, and blue of each cell
+        sums = [[0] * 3 for cell in range(HASH_WIDTH * HASH_HEIGHT)]
+        for row_idx, row in enumerate(stream.rows()):
+            digest.update(row)
+            alpha = row[3::4]
+            for cell_row, (start, stop) in enumerate(rows):
+                if not start <= row_idx < stop:
+                    continue
+                for cell_col, (left, right) in enumerate(columns):
+                    cell = sums[cell_row * HASH_WIDTH + cell_col]
+                    for chan in range(3):
+                        cell[chan] += sum(map(
+                            mul, row[left * 4 + chan:right * 4:4],
+                            alpha[left:right]))
+    grays = []
+    for cell_idx, (red, green, blue) in enumerate(sums):
+        top, bottom = rows[cell_idx // HASH_WIDTH]
+        left, right = columns[cell_idx % HASH_WIDTH]
+        grays.append((red * 299 + green * 587 + blue * 114) /
+                     ((bottom - top) * (right - left)))
+    dhash = 0
+    for cell_row in range(HASH_HEIGHT):
+        for cell_col in range(HASH_WIDTH - 1):
+            cell_idx = cell_row * HASH_WIDTH + cell_col
+            dhash = dhash << 1 | (grays[cell_idx] > grays[cell_idx + 1])
+    return fname, width, height, digest.hexdigest(), dhash
+
+
+def hamming(hash1, hash2):
+    return bin(hash1 ^ hash2).count("1")
+
+
+class BKTree:
+    """A BK-tree of hashes, for finding the hashes within a Hamming
+    distance of a hash without comparing it to all of them."""
+
+    def __init__(self):
+        self.root = None  # [hash, items, {distance: child node}]
+
+    def add(self, key, item):
+        if self.root is None:
+            self.root = [key, [item], {}]
+            return
+        node = self.root
+        while True:
+            dist = hamming(key, node[0])
+            if dist == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(dist)
+            if child is None:
+                node[2][dist] = [key, [item], {}]
+                return
+            node = child
+
+    def search(self, key, radius):
+        "Get the items with hashes at most radius bits from key."
+        found = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node_key, items, children = nodes.pop()
+            dist = hamming(key, node_key)
+            if dist <= radius:
+                found.extend(items)
+            for child_dist, child in children.items():
+                if dist - radius <= child_dist <= dist + radius:
+                    nodes.append(child)
+        return found
+
+
+def group_duplicates(hashes, radius=4, same_size=True):
+    """Group MATs that look the same.
+
+    hashes is a list of mat_hashes results. MATs are in the same group if
+    their dHashes are within radius bits of each other (directly, or
+    through other MATs in the group), and, if same_size is True, they have
+    the same size. Returns a list of groups of filenames, with more than
+    one MAT in each."""
+    tree = BKTree()
+    for idx, (fname, width, height, exact, dhash) in enumerate(hashes):
+        tree.add(dhash, idx)
+    parents = list(range(len(hashes)))
+
+    def find(idx):
+        while parents[idx] != idx:
+            parents[idx] = parents[parents[idx]]
+            idx = parents[idx]
+        return idx
+
+    for idx, (fname, width, height, exact, dhash) in enumerate(hashes):
+        for other in tree.search(dhash, radius):
+            if same_size and hashes[other][1:3] != (width, height):
+                continue
+            parents[find(other)] = find(idx)
+    groups = OrderedDict()
+    for idx in range(len(hashes)):
+        groups.setdefault(find(idx), []).append(hashes[idx][0])
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def mat_texnum(fname):
+    "Get the texture number of a MAT from its filename, or None."
+    stem = os.path.splitext(os.path.basename(fname))[0]
+    return int(stem) if stem.isdigit() else None
+
+
+def mesh_texnums(fname):
+    "Get the texture numbers used by the FACE chunks of a mesh IFF."
+    from iff_read import IffReader
+    texnums = set()
+    size = os.path.getsize(fname)
+    reader = IffReader(fname)
+    try:
+        offset = 0
+        while offset < size:
+            data = reader.read_data()
+            if data["type"] == "form":
+                offset = data["offset"] + 12
+                continue
+            if data["name"] == b"FACE":
+                for face in struct.iter_unpack(
+                        FACE_FMT, data["data"][:len(data["data"]) // 28 * 28]):
+                    texnums.add(face[2])
+                    if face[6] != DEFAULT_ALT_MAT:
+                        texnums.add(face[6])
+            offset = data["offset"] + 8 + data["length"]
+    finally:
+        reader.close()
+    return texnums
+
+
+def consolidation_plan(groups, hashes, users):
+    """Decide which MAT each group of duplicates should use.
+
+    The MAT used by the most meshes is kept, or the one with the lowest
+    texture number. users maps texture numbers to the meshes that use
+    them. Returns a list of dicts describing each group."""
+    exact = {fname: exact for fname, width, height, exact, dhash in hashes}
+    dhashes = {fname: dhash for fname, width, height, exact, dhash in hashes}
+    plan = []
+    for group in groups:
+        mats = [fname for fname in group if mat_texnum(fname) is not None]
+        if len(mats) < 2:
+            continue
+        keep = min(mats, key=lambda fname: (
+            -len(users.get(mat_texnum(fname), ())), mat_texnum(fname)))
+        remap = OrderedDict()
+        for fname in sorted(mats, key=mat_texnum):
+            if fname != keep:
+                remap[str(mat_texnum(fname))] = mat_texnum(keep)
+        plan.append({
+            "keep": keep,
+            "texnum": mat_texnum(keep),
+            "exact": len({exact[fname] for fname in mats}) == 1,
+            "distance": max(hamming(dhashes[keep], dhashes[fname])
+                            for fname in mats),
+            "remap": remap,
+            "meshes": sorted({mesh for fname in mats
+                              for mesh in users.get(mat_texnum(fname), ())}),
+            "bytes_saved": sum(os.path.getsize(fname) for fname in mats
+                               if fname != keep),
+        })
+    return plan
+
+
+def find_files(paths, ext):
+    "Find the files with an extension in a list of files and folders."
+    for fpath in paths:
+        if os.path.isdir(fpath):
+            for dirpath, dirnames, fnames in os.walk(fpath):
+                dirnames.sort()
+                for fname in sorted(fnames):
+                    if fname.lower().endswith(ext):
+                        yield os.path.join(dirpath, fname)
+        else:
+            yield fpath
+
+
+if __name__ == '__main__':
+    import workers
+
+    argp = argparse.ArgumentParser(
+        description="Find MATs that look the same, and plan which texture "
+        "numbers to use instead of them.")
+
+    argp.add_argument('mats', action='store', nargs='+', metavar='MAT',
+                      help="The MATs, or folders of MATs, to compare.")
+
+    argp.add_argument('-m', '--meshes', action='store', nargs='+',
+                      metavar='MESH', dest='meshes', default=[],
+                      help="Mesh IFFs, or folders of them, to find the "
+                      "texture users in.")
+
+    argp.add_argument('-d', '--distance', action='store', type=int,
+                      dest='distance', default=4,
+                      help="How many bits the hashes of two MATs may differ "
+                      "by for them to count as duplicates.")
+
+    argp.add_argument('--any-size', action='store_false', dest='same_size',
+                      help="Compare MATs of different sizes too.")
+
+    argp.add_argument('-j', '--workers', action='store', type=int,
+                      dest='workers', default=0,
+                      help="Number of worker processes (0 for one per CPU).")
+
+    argp.add_argument('-o', '--out-file', action='store', metavar='FILE',
+                      dest='out_file', default=None,
+                      help="Write the consolidation plan to this JSON file.")
+
+    args = argp.parse_args()
+
+    mat_fnames = list(find_files(args.mats, ".mat"))
+    with workers.WorkerPool(args.workers) as pool:
+        hashes = pool.map(mat_hashes, mat_fnames)
+        mesh_fnames = list(find_files(args.meshes, ".iff"))
+        users = {}
+        for mesh_fname, texnums in zip(
+                mesh_fnames, pool.map(mesh_texnums, mesh_fnames)):
+            for texnum in texnums:
+                users.setdefault(texnum, []).append(mesh_fname)
+
+    plan = consolidation_plan(
+        group_duplicates(hashes, args.distance, args.same_size),
+        hashes, users)
+    for group in plan:
+        print("{} ({}, up to {} bits apart):".format(
+            group["keep"], "exact" if group["exact"] else "similar",
+            group["distance"]))
+        for texnum, keep in group["remap"].items():
+            print("  {:0>8} --> {:0>8}".format(texnum, keep))
+        for mesh in group["meshes"]:
+            print("  Used by {}".format(mesh))
+    print("{} MATs in {} groups could be removed, saving {} bytes.".format(
+        sum(len(group["remap"]) for group in plan), len(plan),
+        sum(group["bytes_saved"] for group in plan)))
+    if args.out_file is not None:
+        remap = OrderedDict()
+        for group in plan:
+            remap.update(group["remap"])
+        with open(args.out_file, "w") as plan_file:
+            json.dump({"groups": plan, "remap": remap}, plan_file, indent=1)
+        print("Wrote {}".format(args.out_file))
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# VISION engine MAT to PNG converter
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+# -*- coding: utf8 -*-
+
+# Converts MATs to PNGs, and makes contact sheets of their thumbnails, so a
+# texture library can be previewed without Blender. MATs are decoded with
+# mat_read.MATStream, and the PNGs are encoded with zlib. The MATs are
+# converted by a pool of worker processes, and a manifest in the output
+# folder remembers what each PNG and contact sheet was made from, so only
+# the ones whose MATs or palettes changed are made again.
+import argparse
+import json
+import os
+import struct
+import zlib
+from os import getcwd
+from os.path import abspath
+from sys import path
+path.append(abspath(getcwd() + "/.."))
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+MANIFEST_FNAME = "mat2png.json"
+MANIFEST_VERSION = 1
+SHEET_PADDING = 2  # Pixels between the thumbnails on a contact sheet
+
+# External palettes found by this process, shared by all of its MATStreams
+_PALETTES = {}
+
+
+def png_chunk(name, data):
+    "Make a PNG chunk: length, name, data, and CRC of the name and data."
+    return b"".join((struct.pack(">I", len(data)), name, data, struct.pack(
+        ">I", zlib.crc32(name + data) & 0xFFFFFFFF)))
+
+
+def encode_png(width, height, rgba, level=6):
+    """Encode RGBA bytes, starting with the top row, as an 8-bit RGBA PNG.
+
+    Each row is stored unfiltered, so the image is only compressed by
+    zlib."""
+    row_size = width * 4
+    if len(rgba) != row_size * height:
+        raise ValueError("Expected {} bytes of RGBA data, got {}!".format(
+            row_size * height, len(rgba)))
+    rgba = bytes(rgba)
+    scanlines = b"".join(b"\x00" + rgba[start:start + row_size]
+                         for start in range(0, len(rgba), row_size))
+    return b"".join((
+        PNG_SIGNATURE,
+        png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6,
+                                       0, 0, 0)),
+        png_chunk(b"IDAT", zlib.compress(scanlines, level)),
+        png_chunk(b"IEND", b"")))
+
+
+def write_png(pngfpath, width, height, rgba, level=6):
+    "Write a PNG file, replacing it only once it is complete."
+    os.makedirs(os.path.dirname(os.path.abspath(pngfpath)), exist_ok=True)
+    tmp_path = pngfpath + ".tmp"
+    with open(tmp_path, "wb") as png_file:
+        png_file.write(encode_png(width, height, rgba, level))
+    os.replace(tmp_path, pngfpath)
+
+
+def file_stamp(fpath):
+    "The size and modification time of a file, or None if it is missing."
+    try:
+        stat = os.stat(fpath)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def thumb_size(width, height, size):
+    "Fit an image in a size x size square, keeping its aspect ratio."
+    scale = min(1.0, size / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def thumbnail(stream, size):
+    """Make a thumbnail of a MAT, no larger than size x size.
+
+    The nearest pixel is sampled, so only the pixels used by the thumbnail
+    are decoded. Returns the width, height, and RGBA bytes."""
+    width, height = thumb_size(stream.width, stream.height, size)
+    columns = [(col * 2 + 1) * stream.width // (width * 2)
+               for col in range(width)]
+    offsets = [(row * 2 + 1) * stream.height // (height * 2) * stream.width +
+               col for row in range(height) for col in columns]
+    return width, height, stream.decode(offsets, 1)
+
+
+def convert(task):
+    """Decode a MAT, and write its PNG and/or make its thumbnail.
+
+    task is a (MAT path, PNG path or None, thumbnail size or None,
+    compression level) tuple. Returns a dict with the MAT's stamp (see
+    mat_stamp), and its thumbnail, if one was made."""
+    from mat_read import MATStream
+    matfpath, pngfpath, size, level = task
+    with MATStream(matfpath, _PALETTES) as stream:
+        result = {"stamp": mat_stamp(matfpath, stream.palette_path),
+                  "thumb": None}
+        if pngfpath is not None:
+            write_png(pngfpath, stream.width, stream.height,
+                      b"".join(stream.rows()), level)
+        if size is not None:
+            result["thumb"] = thumbnail(stream, size)
+    return result
+
+
+def mat_stamp(matfpath, palpath=None):
+    "What a PNG of a MAT depends on: the MAT, and its external palette."
+    palette = None
+    if palpath is not None:
+        palette = [os.path.abspath(palpath), file_stamp(palpath)]
+    return {"mat": file_stamp(matfpath), "palette": palette}
+
+
+def stamp_changed(matfpath, stamp):
+    "Check whether a MAT, or the palette it used, changed since stamp."
+    if stamp is None or stamp["mat"] != file_stamp(matfpath):
+        return True
+    palette = stamp["palette"]
+    return palette is not None and palette[1] != file_stamp(palette[0])
+
+
+def compose_sheet(thumbs, columns, size, padding=SHEET_PADDING):
+    """Put thumbnails together on a contact sheet.
+
+    thumbs is a list of (width, height, RGBA bytes) tuples, laid out in
+    rows of columns cells, each size x size. Each thumbnail is centred in
+    its cell, and the rest of the sheet is transparent. Returns the width,
+    height, and RGBA bytes of the sheet."""
+    rows = -(-len(thumbs) // columns)
+    cell = size + padding
+    width = columns * cell + padding
+    height = rows * cell + padding
+    sheet = bytearray(width * height * 4)
+    for idx, (thumb_width, thumb_height, rgba) in enumerate(thumbs):
+        left = (idx % columns) * cell + padding + (size - thumb_width) // 2
+        top = (idx // columns) * cell + padding + (size - thumb_height) // 2
+        row_size = thumb_width * 4
+        for row in range(thumb_height):
+            offset = ((top + row) * width + left) * 4
+            sheet[offset:offset + row_size] = rgba[
+                row * row_size:row * row_size + row_size]
+    return width, height, bytes(sheet)
+
+
+def write_sheet(task):
+    """Compose and write a contact sheet.
+
+    task is a (path, thumbnails, columns, size, compression level) tuple."""
+    sheetfpath, thumbs, columns, size, level = task
+    write_png(sheetfpath, *compose_sheet(thumbs, columns, size), level=level)
+    return sheetfpath
+
+
+def find_mats(paths):
+    """Find the MATs in a list of files and folders.
+
+    Yields the path of each MAT, and the path of its PNG relative to the
+    output folder. MATs in folders keep their place in the folder tree."""
+    for fpath in paths:
+        if os.path.isdir(fpath):
+            for dirpath, dirnames, fnames in os.walk(fpath):
+                dirnames.sort()
+                for fname in sorted(fnames):
+                    if fname.lower().endswith(".mat"):
+                        matfpath = os.path.join(dirpath, fname)
+                        yield matfpath, os.path.splitext(
+                            os.path.relpath(matfpath, fpath))[0] + ".png"
+        else:
+            yield fpath, os.path.splitext(os.path.basename(fpath))[0] + ".png"
+
+
+class Manifest:
+    """Remembers what the PNGs and contact sheets in a folder were made
+    from.
+
+    pngs maps each PNG (relative to the folder) to the stamp of its MAT,
+    and sheets maps each contact sheet to its settings and the stamps of
+    its MATs."""
+
+    def __init__(self, outdir):
+        self.outdir = outdir
+        self.path = os.path.join(outdir, MANIFEST_FNAME)
+        self.pngs = {}
+        self.sheets = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as manifest_file:
+                data = json.load(manifest_file)
+        except (OSError, ValueError):
+            data = None
+        if isinstance(data, dict) and data.get("version") == MANIFEST_VERSION:
+            self.pngs = data.get("pngs", {})
+            self.sheets = data.get("sheets", {})
+
+    def exists(self, fname):
+        return os.path.isfile(os.path.join(self.outdir, fname))
+
+    def save(self):
+        os.makedirs(self.outdir, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as manifest_file:
+            json.dump({"version": MANIFEST_VERSION, "pngs": self.pngs,
+                       "sheets": self.sheets},
+                      manifest_file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def convert_all(pool, sources, outdir, sheet=None, size=64, level=6,
+                force=False):
+    """Convert MATs to PNGs, and make contact sheets of them.
+
+    sources is a list of MATs and folders of MATs, and pool is a
+    workers.WorkerPool. sheet is the (columns, rows) of thumbnails on each
+    contact sheet, or None for no contact sheets. MATs and contact sheets
+    that have not changed since the last run are skipped, unless force is
+    True. Returns the numbers of PNGs written, PNGs skipped, and contact
+    sheets written."""
+    manifest = Manifest(outdir)
+    mats = list(find_mats(sources))
+    stale = [(matfpath, pngfname) for matfpath, pngfname in mats
+             if force or not manifest.exists(pngfname) or
+             stamp_changed(matfpath, manifest.pngs.get(pngfname))]
+    thumbs = {}
+    for (matfpath, pngfname), result in zip(stale, pool.map(convert, [
+            (matfpath, os.path.join(outdir, pngfname),
+             size if sheet else None, level)
+            for matfpath, pngfname in stale])):
+        manifest.pngs[pngfname] = result["stamp"]
+        thumbs[pngfname] = result["thumb"]
+    sheets_written = 0
+    if sheet:
+        columns, rows = sheet
+        per_sheet = columns * rows
+        pages = []
+        for page, start in enumerate(range(0, len(mats), per_sheet)):
+            sheetfname = "sheet_{:03d}.png".format(page)
+            entries = [[pngfname, manifest.pngs[pngfname]]
+                       for matfpath, pngfname in mats[start:start + per_sheet]]
+            record = {"settings": [columns, rows, size], "mats": entries}
+            if (force or not manifest.exists(sheetfname) or
+                    manifest.sheets.get(sheetfname) != record):
+                pages.append((sheetfname, mats[start:start + per_sheet]))
+                manifest.sheets[sheetfname] = record
+        # Thumbnails of unchanged MATs on changed sheets are made now
+        missing = sorted({(matfpath, pngfname) for sheetfname, page in pages
+                          for matfpath, pngfname in page
+                          if pngfname not in thumbs})
+        for (matfpath, pngfname), result in zip(missing, pool.map(convert, [
+                (matfpath, None, size, level)
+                for matfpath, pngfname in missing])):
+            thumbs[pngfname] = result["thumb"]
+        sheets_written = len(pool.map(write_sheet, [
+            (os.path.join(outdir, sheetfname),
+             [thumbs[pngfname] for matfpath, pngfname in page], columns,
+             size, level) for sheetfname, page in pages]))
+    manifest.save()
+    return len(stale), len(mats) - len(stale), sheets_written
+
+
+def sheet_arg(value):
+    "Parse a contact sheet layout, such as 8x6."
+    try:
+        columns, rows = map(int, value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "Expected COLUMNSxROWS, got {}".format(value))
+    if columns < 1 or rows < 1:
+        raise argparse.ArgumentTypeError(
+            "A contact sheet needs at least one row and column")
+    return columns, rows
+
+
+if __name__ == '__main__':
+    import workers
+
+    argp = argparse.ArgumentParser(
+        description="Convert VISION engine MATs to PNGs, and make contact "
+        "sheets of their thumbnails.")
+
+    argp.add_argument('mats', action='store', nargs='+', metavar='MAT',
+                      help="The MATs, or folders of MATs, to convert.")
+
+    argp.add_argument('-o', '--out-dir', action='store', metavar='DIR',
+                      dest='out_dir', default='png',
+                      help="The folder to write the PNGs to.")
+
+    argp.add_argument('-s', '--sheet', action='store', type=sheet_arg,
+                      metavar='COLUMNSxROWS', dest='sheet', default=None,
+                      help="Make contact sheets with this many thumbnails.")
+
+    argp.add_argument('-t', '--thumb-size', action='store', type=int,
+                      metavar='PIXELS', dest='thumb_size', default=64,
+                      help="The largest width or height of a thumbnail.")
+
+    argp.add_argument('-l', '--level', action='store', type=int,
+                      choices=range(10), dest='level', default=6,
+                      help="zlib compression level of the PNGs.")
+
+    argp.add_argument('-f', '--force', action='store_true', dest='force',
+                      help="Convert MATs even if they have not changed.")
+
+    argp.add_argument('-j', '--workers', action='store', type=int,
+                      dest='workers', default=0,
+                      help="Number of worker processes (0 for one per CPU).")
+
+    args = argp.parse_args()
+
+    with workers.WorkerPool(args.workers) as pool:
+        written, skipped, sheets = convert_all(
+            pool, args.mats, args.out_dir, args.sheet, args.thumb_size,
+            args.level, args.force)
+    print("Wrote {} PNGs, skipped {} unchanged, and wrote {} contact "
+          "sheets to {}".format(written, skipped, sheets, args.out_dir))
@@ -39,6 +39,7 @@ class IffPalReader:
         self.pxld = array.array("B")
 
     def parse_pal_form(self, pal_form):
+        from mat_codec import parse_cmap, read_cstr
         pal_read = 4
         pal = ''
         pald = array.array("B")
@@ -47,22 +48,15 @@ class IffPalReader:
             pal_chunk = self.iff.read_data()
 
             if pal_chunk["type"] == 'chunk' and pal_chunk["name"] == b"NAME":
-                pal = 'external:{}'.format(self.parse_cstr(pal_chunk["data"]))
+                pal = 'external:{}'.format(read_cstr(pal_chunk["data"]))
             elif pal_chunk["type"] == 'chunk' and pal_chunk["name"] == b"CMAP":
                 pal = 'embedded'
-                pald.frombytes(pal_chunk["data"])
+                pald = array.array("B", parse_cmap(pal_chunk["data"]))
 
             pal_read += 8 + pal_chunk["length"]
 
         return pal, pald
 
-    def parse_cstr(self, data, offset=0):
-        cstr = bytearray()
-        while data[offset] != 0:
-            cstr.append(data[offset])
-            offset += 1
-        return cstr.decode("ascii", "ignore")
-
     def read(self):
         root_form = self.iff.read_data()
 
@@ -84,7 +78,7 @@ class IffPalReader:
                                 "child of root form is {})".format(
                                     fram_form["name"]))
         elif root_form["name"] == b"PAL ":
-            self.pal, self.pald = self.parse_pal_form(mdata)
+            self.pal, self.pald = self.parse_pal_form(root_form)
         else:
             print_iff_data(root_form)
             raise TypeError("Invalid root form! (must be either BITM or PAL,"
@@ -117,6 +111,7 @@ if __name__ == '__main__':
     matf = getattr(args, 'mat')
     out_fname = getattr(args, 'out_file')
 
+    from mat_codec import channel
     mat_reader = IffPalReader(matf)
     mat_reader.read()
 
@@ -130,13 +125,9 @@ Columns: 16
 
     if mat_reader.pal == "embedded":
         gpal = gpal_head.format(matf) + "\n".join(
-            [gpal_colr.format(
-                mat_reader.pald[x * 3],
-                mat_reader.pald[x * 3 + 1],
-                mat_reader.pald[x * 3 + 2],
-                x
-            ) for x in range(len(mat_reader.pald) // 3)]
-        )
+            gpal_colr.format(red, green, blue, x) for x, (red, green, blue)
+            in enumerate(zip(*(channel(mat_reader.pald, chan)
+                               for chan in range(3)))))
 
         if out_fname is not None:
             outfile = open(out_fname, "w")
@@ -49,6 +49,7 @@ class IffMatReader:
         return struct.unpack("<2i", hots_chunk["data"])
 
     def parse_pal_form(self, pal_form):
+        from mat_codec import parse_cmap, read_cstr
         pal_read = 4
         pal = ''
         pald = array.array("B")
@@ -57,39 +58,27 @@ class IffMatReader:
             pal_chunk = self.iff.read_data()
 
             if pal_chunk["type"] == 'chunk' and pal_chunk["name"] == b"NAME":
-                pal = 'external:{}'.format(self.parse_cstr(pal_chunk["data"]))
+                pal = 'external:{}'.format(read_cstr(pal_chunk["data"]))
             elif pal_chunk["type"] == 'chunk' and pal_chunk["name"] == b"CMAP":
                 pal = 'embedded'
-                pald.frombytes(pal_chunk["data"])
+                pald = array.array("B", parse_cmap(pal_chunk["data"]))
 
             pal_read += 8 + pal_chunk["length"]
 
         return pal, pald
 
     def parse_pxls_chunk(self, pxls_chunk):
+        from mat_codec import decode_rgb
         if self.pal == "embedded":
-            pxld = array.array("B")
-
-            for index in pxls_chunk["data"]:
-                bindex = index * 3
-                pxld.extend(self.pald[bindex:bindex + 3])
-
-            return pxld
+            return array.array("B", decode_rgb(pxls_chunk["data"], self.pald))
 
     def get_default_alpha(self, pxls_chunk):
-        alfd = array.array("B")
-
-        for index in pxls_chunk["data"]:
-            alfd.append(0 if index == 0 else 255)
-
-        return alfd
+        from mat_codec import default_alpha
+        return array.array("B", default_alpha(pxls_chunk["data"]))
 
-    def parse_cstr(self, data, offset=0):
-        cstr = bytearray()
-        while data[offset] != 0:
-            cstr.append(data[offset])
-            offset += 1
-        return cstr.decode("ascii", "ignore")
+    def parse_alph_chunk(self, alph_chunk):
+        from mat_codec import decode_alph
+        return array.array("B", decode_alph(alph_chunk["data"]))
 
     def read(self):
         root_form = self.iff.read_data()
@@ -114,9 +103,7 @@ class IffMatReader:
                         self.pxld = self.parse_pxls_chunk(mdata)
                         self.alfd = self.get_default_alpha(mdata)
                     elif mdata["type"] == 'chunk' and mdata["name"] == b'ALPH':
-                        self.alfd = array.array("B")
-                        self.alfd.fromlist(
-                            [chr(255 - ord(x)) for x in mdata["data"]])
+                        self.alfd = self.parse_alph_chunk(mdata)
                     else:
                         print_iff_data(mdata)
 
@@ -0,0 +1,215 @@
+# -*- coding: utf8 -*-
+# Blender WCP IFF mesh import/export script by Kevin Caccamo
+# Copyright © 2013-2016 Kevin Caccamo
+# E-mail: kevin@ciinet.org
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# <pep8-80 compliant>
+
+# Process pool helpers shared by the exporter's parallel stages.
+#
+# Worker processes are forked, so they inherit the add-on's modules without
+# having to start another copy of Blender. Where forking is not available
+# (ex. on Windows), the work is done serially in the calling process
+# instead. Large arrays are shared with the workers through anonymous
+# memory maps made before the workers are forked, which only needs the
+# standard library of Python 3.4 (the oldest that Blender 2.7x ships with),
+# unlike multiprocessing.shared_memory.
+import array
+import mmap
+import os
+import sys
+from itertools import count
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+
+def cpu_count():
+    "Number of CPUs available, or 1 if it cannot be determined."
+    return os.cpu_count() or 1
+
+
+def num_workers(workers):
+    """Resolve the number of worker processes to use.
+
+    0 (or less) means one worker per CPU."""
+    if workers <= 0:
+        return cpu_count()
+    return workers
+
+
+def can_fork():
+    "Check whether forked worker processes are available."
+    if multiprocessing is None:
+        return False
+    try:
+        multiprocessing.get_context("fork")
+    except ValueError:
+        return False
+    return True
+
+
+class WorkerPool:
+    """A pool of forked worker processes, usable as a context manager.
+
+    If workers is 1, or forking is not available, map runs the function
+    serially in this process."""
+
+    def __init__(self, workers):
+        self.workers = num_workers(workers)
+        self.pool = None
+        if self.workers > 1 and can_fork():
+            ctx = multiprocessing.get_context("fork")
+            self.pool = ctx.Pool(self.workers)
+
+    @property
+    def parallel(self):
+        return self.pool is not None
+
+    def map(self, func, items):
+        """Call func on each item, and return a list of the results.
+
+        The results are in the same order as the items."""
+        if self.pool is None:
+            return list(map(func, items))
+        return self.pool.map(func, items, chunksize=1)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.pool is not None and exc_type is not None:
+            self.pool.terminate()
+        self.close()
+
+
+_shared_maps = {}  # SharedArray key -> mmap, inherited by forked workers
+_shared_keys = count()
+
+
+class SharedArray:
+    """An array.array copied to an anonymous memory map.
+
+    The array can be read by worker processes using the descriptor, which
+    is much cheaper to pickle than the array itself. The workers find the
+    memory map by its key, so the SharedArray must be made before the
+    WorkerPool that uses it."""
+
+    def __init__(self, data):
+        if not isinstance(data, array.array):
+            raise TypeError("data must be an array.array!")
+        self.typecode = data.typecode
+        self.length = len(data)
+        nbytes = self.length * data.itemsize
+        # Anonymous memory maps cannot be empty.
+        self.map = mmap.mmap(-1, max(nbytes, 1))
+        self.map[:nbytes] = memoryview(data).cast("B")
+        self.key = next(_shared_keys)
+        _shared_maps[self.key] = self.map
+
+    @property
+    def descriptor(self):
+        "(key, typecode, length) tuple used to read the array."
+        return self.key, self.typecode, self.length
+
+    def close(self):
+        if self.map is not None:
+            del _shared_maps[self.key]
+            self.map.close()
+            self.map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_shared(descriptor, start=0, stop=None):
+    """Copy a slice of a SharedArray to a new array.array.
+
+    This is meant to be called from a worker process."""
+    key, typecode, length = descriptor
+    if key not in _shared_maps:
+        raise ValueError("The shared array is closed, or was made after "
+                         "this process was forked!")
+    if stop is None:
+        stop = length
+    data = array.array(typecode)
+    data.frombytes(_shared_maps[key][start * data.itemsize:
+                                     stop * data.itemsize])
+    return data
+
+
+def current_memory():
+    """Memory used by this process right now (its resident set size), in
+    MiB.
+
+    Returns None if it cannot be measured (it is only measured on
+    Linux)."""
+    try:
+        with open("/proc/self/statm", "rb") as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1048576
+
+
+def worker_peak_memory():
+    """Peak memory use of the largest finished child process, in MiB.
+
+    This covers every child process of Blender so far, not just the
+    workers of the current export. Returns None if it cannot be measured
+    (ex. on Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == "darwin":
+        peak /= 1024  # macOS reports bytes, other platforms report KiB.
+    return peak / 1024
+
+
+class MemoryWatch:
+    """Tracks how much the memory use of this process grows over a stretch
+    of work.
+
+    Call sample at the points where memory use should be measured. growth
+    is the largest increase, in MiB, over the memory used when the
+    MemoryWatch was made, or None if memory use cannot be measured."""
+
+    def __init__(self):
+        self.start = self.peak = current_memory()
+
+    def sample(self):
+        memory = current_memory()
+        if memory is not None and self.peak is not None:
+            self.peak = max(self.peak, memory)
+
+    @property
+    def growth(self):
+        if self.start is None:
+            return None
+        return self.peak - self.start